@@ -1,10 +1,35 @@
-from collections import defaultdict
-from dataclasses import dataclass
+from copy import deepcopy
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
-from statistics import median
-from typing import Dict, Iterable, List, Optional, Tuple
-
-from model import Reading
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+from model import Reading, Row, iter_rows, reorder_rows
+from sketch import StreamingMedian
+from timebuckets import CALENDAR, EPOCH_ORDINAL
+
+if TYPE_CHECKING:
+    from alerts import Alert, AlertRule
+    from analytics import DrySpell
+    from cache import SummaryCache
+    from sketch import QuantileSketch
+    from timebuckets import StationZones
+    from windowing import WindowPeak, WindowSpec, WindowSummary
+
+K = TypeVar("K")
+A = TypeVar("A", "DayAccumulator", "WeekAccumulator", "MonthAccumulator")
 
 @dataclass
 class DaySummary:
@@ -23,63 +48,193 @@ class DaySummary:
 def day_key(ts: datetime) -> Tuple[int, int, int]:
     return ts.year, ts.month, ts.day
 
-def aggregate_day(readings: Iterable[Reading]) -> Dict[Tuple[str, Tuple[int, int, int]], DaySummary]:
-    rain_sum = defaultdict(float)
-    temp_sum = defaultdict(float)
-    count = defaultdict(int)
-    min_temp = defaultdict(lambda: float("inf"))
-    max_temp = defaultdict(lambda: float("-inf"))
-    max_rain_per_reading = defaultdict(float)
-    max_rate = defaultdict(float)
-    first_ts: Dict[Tuple[str, Tuple[int, int, int]], Optional[datetime]] = defaultdict(lambda: None)
-    last_ts: Dict[Tuple[str, Tuple[int, int, int]], Optional[datetime]] = defaultdict(lambda: None)
-
-    prev_ts: Dict[Tuple[str, Tuple[int, int, int]], Optional[datetime]] = defaultdict(lambda: None)
-
-    for r in readings:
-        k = (r.station_id, day_key(r.ts))
-        rain_sum[k] += r.rainfall_mm
-        temp_sum[k] += r.temperature_c
-        count[k] += 1
-        min_temp[k] = min(min_temp[k], r.temperature_c)
-        max_temp[k] = max(max_temp[k], r.temperature_c)
-        max_rain_per_reading[k] = max(max_rain_per_reading[k], r.rainfall_mm)
-
-        if first_ts[k] is None or r.ts < first_ts[k]:
-            first_ts[k] = r.ts
-        if last_ts[k] is None or r.ts > last_ts[k]:
-            last_ts[k] = r.ts
-
-        prev = prev_ts[k]
+def aggregate_day(
+    readings: Iterable[Reading], zones: Optional["StationZones"] = None
+) -> Dict[Tuple[str, Tuple[int, int, int]], DaySummary]:
+    """Summarize readings per (station, day); with ``zones``, days are the stations' local days."""
+    return _aggregate_day_rows(iter_rows(readings), zones)
+
+
+class DayAccumulator:
+    """Partial state behind a single (station, day) ``DaySummary``."""
+
+    __slots__ = (
+        "station_id",
+        "date_key",
+        "rain_sum",
+        "temp_sum",
+        "count",
+        "min_temp",
+        "max_temp",
+        "max_rainfall",
+        "max_rate",
+        "first_ts",
+        "last_ts",
+        "prev_ts",
+        "head_ts",
+        "head_rain",
+    )
+
+    def __init__(self, station_id: str, date_key: Tuple[int, int, int]) -> None:
+        self.station_id = station_id
+        self.date_key = date_key
+        self.rain_sum = 0.0
+        self.temp_sum = 0.0
+        self.count = 0
+        self.min_temp = float("inf")
+        self.max_temp = float("-inf")
+        self.max_rainfall = 0.0
+        self.max_rate = 0.0
+        self.first_ts: Optional[datetime] = None
+        self.last_ts: Optional[datetime] = None
+        # Timestamps of the most recently and the first added readings (and
+        # the first reading's rainfall), so rates can be stitched on merge.
+        self.prev_ts: Optional[datetime] = None
+        self.head_ts: Optional[datetime] = None
+        self.head_rain = 0.0
+
+    def add(self, ts: datetime, temperature_c: float, rainfall_mm: float) -> None:
+        self.rain_sum += rainfall_mm
+        self.temp_sum += temperature_c
+        self.count += 1
+        if temperature_c < self.min_temp:
+            self.min_temp = temperature_c
+        if temperature_c > self.max_temp:
+            self.max_temp = temperature_c
+        if rainfall_mm > self.max_rainfall:
+            self.max_rainfall = rainfall_mm
+
+        if self.first_ts is None or ts < self.first_ts:
+            self.first_ts = ts
+        if self.last_ts is None or ts > self.last_ts:
+            self.last_ts = ts
+
+        prev = self.prev_ts
         if prev is not None:
-            delta_hours = (r.ts - prev).total_seconds() / 3600.0
+            delta_hours = (ts - prev).total_seconds() / 3600.0
             if delta_hours > 0:
-                rate = r.rainfall_mm / delta_hours
-                max_rate[k] = max(max_rate[k], rate)
-        prev_ts[k] = r.ts
-
-    out: Dict[Tuple[str, Tuple[int, int, int]], DaySummary] = {}
-    for k in rain_sum:
-        sid, date_key = k
-        c = count[k]
-        avg_temp = (temp_sum[k] / c) if c else 0.0
+                rate = rainfall_mm / delta_hours
+                if rate > self.max_rate:
+                    self.max_rate = rate
+        else:
+            self.head_ts = ts
+            self.head_rain = rainfall_mm
+        self.prev_ts = ts
+
+    def merge(self, other: "DayAccumulator") -> "DayAccumulator":
+        """
+        Fold ``other`` into this accumulator and return ``self``.
+
+        ``other`` is treated as the continuation of this feed: the rain rate
+        between this side's last reading and the other side's first one is
+        included, exactly as if both had been added to a single accumulator.
+        """
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            for name in DayAccumulator.__slots__:
+                setattr(self, name, getattr(other, name))
+            return self
+        self.rain_sum += other.rain_sum
+        self.temp_sum += other.temp_sum
+        self.count += other.count
+        self.min_temp = min(self.min_temp, other.min_temp)
+        self.max_temp = max(self.max_temp, other.max_temp)
+        self.max_rainfall = max(self.max_rainfall, other.max_rainfall)
+        self.max_rate = max(self.max_rate, other.max_rate)
+        delta_hours = (other.head_ts - self.prev_ts).total_seconds() / 3600.0
+        if delta_hours > 0:
+            self.max_rate = max(self.max_rate, other.head_rain / delta_hours)
+        self.first_ts = min(self.first_ts, other.first_ts)
+        self.last_ts = max(self.last_ts, other.last_ts)
+        self.prev_ts = other.prev_ts
+        return self
+
+    def to_summary(self) -> DaySummary:
+        c = self.count
+        avg_temp = (self.temp_sum / c) if c else 0.0
         # default first/last timestamps to midnight if readings missing
-        period_start = first_ts[k] or datetime(*date_key, 0, 0, 0)
-        period_end = last_ts[k] or period_start
-        out[k] = DaySummary(
-            station_id=sid,
-            date=datetime(*date_key, 0, 0, 0),
-            total_rain_mm=rain_sum[k],
+        period_start = self.first_ts or datetime(*self.date_key, 0, 0, 0)
+        period_end = self.last_ts or period_start
+        return DaySummary(
+            station_id=self.station_id,
+            date=datetime(*self.date_key, 0, 0, 0),
+            total_rain_mm=self.rain_sum,
             avg_temp_c=avg_temp,
             count=c,
-            min_temp_c=min_temp[k] if min_temp[k] != float("inf") else avg_temp,
-            max_temp_c=max_temp[k] if max_temp[k] != float("-inf") else avg_temp,
-            max_rainfall_mm=max_rain_per_reading[k],
-            max_rain_rate_mm_per_hr=max_rate[k],
+            min_temp_c=self.min_temp if self.min_temp != float("inf") else avg_temp,
+            max_temp_c=self.max_temp if self.max_temp != float("-inf") else avg_temp,
+            max_rainfall_mm=self.max_rainfall,
+            max_rain_rate_mm_per_hr=self.max_rate,
             first_observation=period_start,
             last_observation=period_end,
         )
-    return out
+
+
+def _aggregate_day_rows(
+    rows: Iterable[Row], zones: Optional["StationZones"] = None
+) -> Dict[Tuple[str, Tuple[int, int, int]], DaySummary]:
+    return {k: acc.to_summary() for k, acc in _day_accumulators(rows, zones).items()}
+
+
+def _day_accumulators(
+    rows: Iterable[Row], zones: Optional["StationZones"] = None
+) -> Dict[Tuple[str, Tuple[int, int, int]], DayAccumulator]:
+    accumulators: Dict[Tuple[str, int], DayAccumulator] = {}
+    add_day_rows(accumulators, rows, zones)
+    return {(acc.station_id, acc.date_key): acc for acc in accumulators.values()}
+
+
+def add_day_rows(
+    accumulators: Dict[Tuple[str, int], DayAccumulator], rows: Iterable[Row], zones: Optional["StationZones"] = None
+) -> None:
+    """
+    Add ``rows`` to ``accumulators``, creating one per (station, day) on first sight.
+
+    Keys are ``(station_id, day ordinal)``, which is cheaper to get than a
+    (y, m, d) tuple; the calendar table supplies the date key once per group.
+    """
+    date_key = CALENDAR.date_key
+    if zones is None or zones.is_utc:
+        for station_id, ts, temperature_c, rainfall_mm in rows:
+            k = (station_id, ts.toordinal())
+            acc = accumulators.get(k)
+            if acc is None:
+                acc = accumulators[k] = DayAccumulator(station_id, date_key(k[1] - EPOCH_ORDINAL))
+            acc.add(ts, temperature_c, rainfall_mm)
+    else:
+        local_ordinal = zones.local_ordinal
+        for station_id, ts, temperature_c, rainfall_mm in rows:
+            k = (station_id, local_ordinal(station_id, ts))
+            acc = accumulators.get(k)
+            if acc is None:
+                acc = accumulators[k] = DayAccumulator(station_id, date_key(k[1] - EPOCH_ORDINAL))
+            acc.add(ts, temperature_c, rainfall_mm)
+
+
+def aggregate_day_partial(
+    readings: Iterable[Reading], zones: Optional["StationZones"] = None
+) -> Dict[Tuple[str, Tuple[int, int, int]], DayAccumulator]:
+    """Like ``aggregate_day`` but return the mergeable accumulators instead of summaries."""
+    return _day_accumulators(iter_rows(readings), zones)
+
+
+def merge_partials(parts: Iterable[Dict[K, A]]) -> Dict[K, A]:
+    """
+    Merge per-key accumulators from several shards into a new mapping.
+
+    Shards must be given in feed order when they split the same keys by time,
+    e.g. consecutive slices of one reading stream. The inputs are left intact.
+    """
+    merged: Dict[K, A] = {}
+    for part in parts:
+        for key, acc in part.items():
+            existing = merged.get(key)
+            if existing is None:
+                merged[key] = deepcopy(acc)
+            else:
+                existing.merge(acc)
+    return merged
 
 
 @dataclass
@@ -107,84 +262,327 @@ class MonthSummary:
 
 
 def iso_week_key(ts: datetime) -> Tuple[int, int]:
-    iso_year, iso_week, _ = ts.isocalendar()
-    return iso_year, iso_week
+    return CALENDAR.iso_week_key(ts.toordinal() - EPOCH_ORDINAL)
 
 
 def aggregate_week(readings: Iterable[Reading]) -> Dict[Tuple[str, Tuple[int, int]], WeekSummary]:
     """Aggregate readings into ISO week buckets."""
-    daily = aggregate_day(readings)
-    rain_sum = defaultdict(float)
-    temp_sum = defaultdict(float)
-    count = defaultdict(int)
-    day_counter = defaultdict(int)
-    max_daily_rain = defaultdict(float)
+    return rollup_week(aggregate_day(readings))
+
+
+class WeekAccumulator:
+    """Partial state behind a single (station, ISO week) ``WeekSummary``."""
+
+    __slots__ = ("station_id", "iso_year", "iso_week", "rain_sum", "temp_sum", "count", "days", "max_daily_rain")
+
+    def __init__(self, station_id: str, iso_year: int, iso_week: int) -> None:
+        self.station_id = station_id
+        self.iso_year = iso_year
+        self.iso_week = iso_week
+        self.rain_sum = 0.0
+        self.temp_sum = 0.0
+        self.count = 0
+        self.days = 0
+        self.max_daily_rain = 0.0
+
+    def add(self, summary: DaySummary) -> None:
+        self.rain_sum += summary.total_rain_mm
+        self.temp_sum += summary.avg_temp_c * summary.count
+        self.count += summary.count
+        self.days += 1
+        self.max_daily_rain = max(self.max_daily_rain, summary.total_rain_mm)
+
+    def merge(self, other: "WeekAccumulator") -> "WeekAccumulator":
+        self.rain_sum += other.rain_sum
+        self.temp_sum += other.temp_sum
+        self.count += other.count
+        self.days += other.days
+        self.max_daily_rain = max(self.max_daily_rain, other.max_daily_rain)
+        return self
+
+    def to_summary(self) -> WeekSummary:
+        c = self.count
+        return WeekSummary(
+            station_id=self.station_id,
+            iso_year=self.iso_year,
+            iso_week=self.iso_week,
+            total_rain_mm=self.rain_sum,
+            avg_temp_c=(self.temp_sum / c) if c else 0.0,
+            days=self.days,
+            max_daily_rain_mm=self.max_daily_rain,
+        )
+
 
+def rollup_week(
+    daily: Dict[Tuple[str, Tuple[int, int, int]], DaySummary]
+) -> Dict[Tuple[str, Tuple[int, int]], WeekSummary]:
+    """Roll already aggregated day summaries up into ISO week buckets."""
+    accumulators: Dict[Tuple[str, Tuple[int, int]], WeekAccumulator] = {}
     for (station_id, _), summary in daily.items():
         key = (station_id, iso_week_key(summary.date))
-        rain_sum[key] += summary.total_rain_mm
-        temp_sum[key] += summary.avg_temp_c * summary.count
-        count[key] += summary.count
-        day_counter[key] += 1
-        max_daily_rain[key] = max(max_daily_rain[key], summary.total_rain_mm)
-
-    out: Dict[Tuple[str, Tuple[int, int]], WeekSummary] = {}
-    for (station_id, (iso_year, iso_week)), total_rain in rain_sum.items():
-        key = (station_id, (iso_year, iso_week))
-        c = count[key]
-        avg_temp = (temp_sum[key] / c) if c else 0.0
-        out[key] = WeekSummary(
-            station_id=station_id,
-            iso_year=iso_year,
-            iso_week=iso_week,
-            total_rain_mm=total_rain,
-            avg_temp_c=avg_temp,
-            days=day_counter[key],
-            max_daily_rain_mm=max_daily_rain[key],
-        )
-    return out
+        acc = accumulators.get(key)
+        if acc is None:
+            acc = accumulators[key] = WeekAccumulator(station_id, *key[1])
+        acc.add(summary)
+    return {key: acc.to_summary() for key, acc in accumulators.items()}
 
 
 def aggregate_month(readings: Iterable[Reading]) -> Dict[Tuple[str, Tuple[int, int]], MonthSummary]:
     """Aggregate readings into monthly buckets."""
-    daily = aggregate_day(readings)
-    rain_sum = defaultdict(float)
-    temp_sum = defaultdict(float)
-    temp_samples = defaultdict(list)
-    count = defaultdict(int)
-    day_counter = defaultdict(int)
-    max_daily_rain = defaultdict(float)
-    wettest_day = {}
-
-    for (station_id, _), summary in daily.items():
-        key = (station_id, (summary.date.year, summary.date.month))
-        rain_sum[key] += summary.total_rain_mm
-        temp_sum[key] += summary.avg_temp_c * summary.count
-        temp_samples[key].append(summary.avg_temp_c)
-        count[key] += summary.count
-        day_counter[key] += 1
-        if summary.total_rain_mm > max_daily_rain[key]:
-            max_daily_rain[key] = summary.total_rain_mm
-            wettest_day[key] = summary.date
-
-    out: Dict[Tuple[str, Tuple[int, int]], MonthSummary] = {}
-    for (station_id, (year, month)), total_rain in rain_sum.items():
-        key = (station_id, (year, month))
-        c = count[key]
-        avg_temp = (temp_sum[key] / c) if c else 0.0
-        med_temp = median(temp_samples[key]) if temp_samples[key] else avg_temp
-        out[key] = MonthSummary(
-            station_id=station_id,
-            year=year,
-            month=month,
-            total_rain_mm=total_rain,
+    return rollup_month(aggregate_day(readings))
+
+
+class MonthAccumulator:
+    """Partial state behind a single (station, month) ``MonthSummary``."""
+
+    __slots__ = (
+        "station_id",
+        "year",
+        "month",
+        "rain_sum",
+        "temp_sum",
+        "temp_median",
+        "count",
+        "days",
+        "max_daily_rain",
+        "wettest_day",
+    )
+
+    def __init__(self, station_id: str, year: int, month: int) -> None:
+        self.station_id = station_id
+        self.year = year
+        self.month = month
+        self.rain_sum = 0.0
+        self.temp_sum = 0.0
+        self.temp_median = StreamingMedian()
+        self.count = 0
+        self.days = 0
+        self.max_daily_rain = 0.0
+        self.wettest_day: Optional[datetime] = None
+
+    def add(self, summary: DaySummary) -> None:
+        self.rain_sum += summary.total_rain_mm
+        self.temp_sum += summary.avg_temp_c * summary.count
+        self.temp_median.add(summary.avg_temp_c)
+        self.count += summary.count
+        self.days += 1
+        if summary.total_rain_mm > self.max_daily_rain:
+            self.max_daily_rain = summary.total_rain_mm
+            self.wettest_day = summary.date
+
+    def merge(self, other: "MonthAccumulator") -> "MonthAccumulator":
+        self.rain_sum += other.rain_sum
+        self.temp_sum += other.temp_sum
+        self.temp_median.merge(other.temp_median)
+        self.count += other.count
+        self.days += other.days
+        if other.max_daily_rain > self.max_daily_rain:
+            self.max_daily_rain = other.max_daily_rain
+            self.wettest_day = other.wettest_day
+        return self
+
+    def to_summary(self) -> MonthSummary:
+        c = self.count
+        avg_temp = (self.temp_sum / c) if c else 0.0
+        med_temp = self.temp_median.median()
+        return MonthSummary(
+            station_id=self.station_id,
+            year=self.year,
+            month=self.month,
+            total_rain_mm=self.rain_sum,
             avg_temp_c=avg_temp,
-            median_temp_c=med_temp,
-            days=day_counter[key],
-            max_daily_rain_mm=max_daily_rain[key],
-            wettest_day=wettest_day.get(key, datetime(year, month, 1)),
+            median_temp_c=med_temp if med_temp is not None else avg_temp,
+            days=self.days,
+            max_daily_rain_mm=self.max_daily_rain,
+            wettest_day=self.wettest_day or datetime(self.year, self.month, 1),
         )
-    return out
+
+
+def rollup_month(
+    daily: Dict[Tuple[str, Tuple[int, int, int]], DaySummary]
+) -> Dict[Tuple[str, Tuple[int, int]], MonthSummary]:
+    """Roll already aggregated day summaries up into monthly buckets."""
+    accumulators: Dict[Tuple[str, Tuple[int, int]], MonthAccumulator] = {}
+    for (station_id, _), summary in daily.items():
+        key = (station_id, CALENDAR.month_key(summary.date.toordinal() - EPOCH_ORDINAL))
+        acc = accumulators.get(key)
+        if acc is None:
+            acc = accumulators[key] = MonthAccumulator(station_id, *key[1])
+        acc.add(summary)
+    return {key: acc.to_summary() for key, acc in accumulators.items()}
+
+
+def _week_bucket(summary: DaySummary) -> Tuple[int, int]:
+    return iso_week_key(summary.date)
+
+
+def _month_bucket(summary: DaySummary) -> Tuple[int, int]:
+    return CALENDAR.month_key(summary.date.toordinal() - EPOCH_ORDINAL)
+
+
+class StreamingRollup:
+    """
+    Fold closed day summaries into week or month buckets as they arrive.
+
+    A station's period closes as soon as one of its days from a later period
+    is added; closed rollups are collected until ``drain()`` is called.
+    """
+
+    def __init__(
+        self,
+        bucket: Callable[[DaySummary], Tuple[int, int]],
+        factory: Callable[[str, int, int], Union[WeekAccumulator, MonthAccumulator]],
+    ) -> None:
+        self._bucket = bucket
+        self._factory = factory
+        self._open: Dict[str, Dict[Tuple[int, int], Union[WeekAccumulator, MonthAccumulator]]] = {}
+        self._closed: List[Union[WeekSummary, MonthSummary]] = []
+
+    @classmethod
+    def weekly(cls) -> "StreamingRollup":
+        return cls(_week_bucket, WeekAccumulator)
+
+    @classmethod
+    def monthly(cls) -> "StreamingRollup":
+        return cls(_month_bucket, MonthAccumulator)
+
+    def add(self, summary: DaySummary) -> None:
+        period = self._bucket(summary)
+        periods = self._open.get(summary.station_id)
+        if periods is None:
+            periods = self._open[summary.station_id] = {}
+        acc = periods.get(period)
+        if acc is None:
+            for earlier in [p for p in periods if p < period]:
+                self._closed.append(periods.pop(earlier).to_summary())
+            acc = periods[period] = self._factory(summary.station_id, *period)
+        acc.add(summary)
+
+    def snapshot(self) -> Dict[Tuple[str, Tuple[int, int]], Union[WeekSummary, MonthSummary]]:
+        """Return in-progress rollups for every open period."""
+        return {
+            (station_id, period): acc.to_summary()
+            for station_id, periods in self._open.items()
+            for period, acc in periods.items()
+        }
+
+    def drain(self) -> List[Union[WeekSummary, MonthSummary]]:
+        """Return and forget the rollups closed since the last call."""
+        closed, self._closed = self._closed, []
+        return closed
+
+    def flush(self) -> List[Union[WeekSummary, MonthSummary]]:
+        """Close every open period and return all undrained rollups."""
+        for periods in self._open.values():
+            self._closed.extend(acc.to_summary() for acc in periods.values())
+        self._open.clear()
+        return self.drain()
+
+
+class StreamingDayAggregator:
+    """
+    Incrementally maintained day summaries for a live reading feed.
+
+    Only days that are still open are kept in memory, one accumulator per
+    (station, day). A station's day closes once that station reports a
+    reading more than ``allowed_lateness`` past the end of the day. At that
+    point it is finalized, returned from ``update``/``update_many`` and
+    folded into the ``weekly`` and ``monthly`` rollups. Readings for days
+    that already closed are dropped and counted in ``late_readings``.
+    """
+
+    def __init__(self, allowed_lateness: timedelta = timedelta(0)) -> None:
+        self.allowed_lateness = allowed_lateness
+        self.weekly = StreamingRollup.weekly()
+        self.monthly = StreamingRollup.monthly()
+        self.late_readings = 0
+        self._open: Dict[str, Dict[Tuple[int, int, int], DayAccumulator]] = {}
+        self._watermark: Dict[str, datetime] = {}
+        # Earliest moment at which one of the station's open days can close.
+        self._next_close: Dict[str, datetime] = {}
+
+    def _close_at(self, date_key: Tuple[int, int, int]) -> datetime:
+        return datetime(*date_key) + timedelta(days=1) + self.allowed_lateness
+
+    def update(self, reading: Reading) -> List[DaySummary]:
+        """Add one reading and return any day summaries it closed."""
+        return self._add(reading.station_id, reading.ts, reading.temperature_c, reading.rainfall_mm)
+
+    def update_many(self, readings: Iterable[Reading]) -> List[DaySummary]:
+        """Add readings (or a ``ReadingBatch``) and return the day summaries they closed."""
+        return self.update_rows(iter_rows(readings))
+
+    def update_rows(self, rows: Iterable[Row]) -> List[DaySummary]:
+        """Add ``(station_id, ts, temperature_c, rainfall_mm)`` rows and return the day summaries they closed."""
+        closed: List[DaySummary] = []
+        add = self._add
+        for station_id, ts, temperature_c, rainfall_mm in rows:
+            finished = add(station_id, ts, temperature_c, rainfall_mm)
+            if finished:
+                closed.extend(finished)
+        return closed
+
+    def _add(self, station_id: str, ts: datetime, temperature_c: float, rainfall_mm: float) -> List[DaySummary]:
+        key = day_key(ts)
+        days = self._open.get(station_id)
+        if days is None:
+            days = self._open[station_id] = {}
+        acc = days.get(key)
+        if acc is None:
+            close_at = self._close_at(key)
+            watermark = self._watermark.get(station_id)
+            if watermark is not None and close_at <= watermark:
+                self.late_readings += 1
+                return []
+            acc = days[key] = DayAccumulator(station_id, key)
+            next_close = self._next_close.get(station_id)
+            if next_close is None or close_at < next_close:
+                self._next_close[station_id] = close_at
+        acc.add(ts, temperature_c, rainfall_mm)
+
+        watermark = self._watermark.get(station_id)
+        if watermark is None or ts > watermark:
+            self._watermark[station_id] = ts
+            if ts >= self._next_close[station_id]:
+                return self._close_ready(station_id, ts)
+        return []
+
+    def _close_ready(self, station_id: str, watermark: datetime) -> List[DaySummary]:
+        days = self._open[station_id]
+        closed: List[DaySummary] = []
+        for key in sorted(days):
+            if self._close_at(key) > watermark:
+                break
+            summary = days.pop(key).to_summary()
+            self.weekly.add(summary)
+            self.monthly.add(summary)
+            closed.append(summary)
+        if days:
+            self._next_close[station_id] = self._close_at(min(days))
+        else:
+            del self._next_close[station_id]
+        return closed
+
+    def snapshot(self) -> Dict[Tuple[str, Tuple[int, int, int]], DaySummary]:
+        """Return in-progress summaries for every open day."""
+        return {
+            (station_id, key): acc.to_summary()
+            for station_id, days in self._open.items()
+            for key, acc in days.items()
+        }
+
+    def flush(self) -> List[DaySummary]:
+        """Close every open day, e.g. at the end of a replay, and return the summaries."""
+        closed: List[DaySummary] = []
+        for station_id, days in self._open.items():
+            for key in sorted(days):
+                summary = days[key].to_summary()
+                self.weekly.add(summary)
+                self.monthly.add(summary)
+                closed.append(summary)
+        self._open.clear()
+        self._next_close.clear()
+        return closed
 
 
 @dataclass
@@ -197,59 +595,214 @@ class RainEvent:
     readings: int
 
 
-def detect_heavy_rain_events(
-    readings: Iterable[Reading],
-    per_reading_threshold_mm: float = 1.0,
-    max_gap: timedelta = timedelta(minutes=10),
-) -> List[RainEvent]:
-    """Group consecutive high-rainfall readings into events."""
-    sorted_readings = sorted(readings, key=lambda r: (r.station_id, r.ts))
-
-    events: List[RainEvent] = []
-    current_event: Optional[RainEvent] = None
-
-    for reading in sorted_readings:
-        if reading.rainfall_mm < per_reading_threshold_mm:
-            if current_event is not None:
-                events.append(current_event)
-                current_event = None
-            continue
-
-        if current_event is None or reading.station_id != current_event.station_id:
-            current_event = RainEvent(
-                station_id=reading.station_id,
-                start=reading.ts,
-                end=reading.ts,
-                total_rain_mm=reading.rainfall_mm,
-                peak_intensity_mm_per_hr=reading.rainfall_mm,
+class RainEventDetector:
+    """
+    Per-station state machine behind the heavy-rain event detectors.
+
+    Each station keeps at most one open event. ``update`` expects every
+    station's readings in timestamp order (see ``model.ReorderBuffer``) and
+    returns the event the reading closed, if any.
+    """
+
+    def __init__(
+        self,
+        per_reading_threshold_mm: float = 1.0,
+        max_gap: timedelta = timedelta(minutes=10),
+    ) -> None:
+        self.per_reading_threshold_mm = per_reading_threshold_mm
+        self.max_gap = max_gap
+        self._open: Dict[str, RainEvent] = {}
+
+    def update(self, station_id: str, ts: datetime, rainfall_mm: float) -> Optional[RainEvent]:
+        current = self._open.get(station_id)
+        if rainfall_mm < self.per_reading_threshold_mm:
+            if current is not None:
+                del self._open[station_id]
+            return current
+
+        if current is None:
+            self._open[station_id] = RainEvent(
+                station_id=station_id,
+                start=ts,
+                end=ts,
+                total_rain_mm=rainfall_mm,
+                peak_intensity_mm_per_hr=rainfall_mm,
                 readings=1,
             )
-            continue
-
-        gap = reading.ts - current_event.end
-        if gap > max_gap:
-            events.append(current_event)
-            current_event = RainEvent(
-                station_id=reading.station_id,
-                start=reading.ts,
-                end=reading.ts,
-                total_rain_mm=reading.rainfall_mm,
-                peak_intensity_mm_per_hr=reading.rainfall_mm,
+            return None
+
+        gap = ts - current.end
+        if gap > self.max_gap:
+            self._open[station_id] = RainEvent(
+                station_id=station_id,
+                start=ts,
+                end=ts,
+                total_rain_mm=rainfall_mm,
+                peak_intensity_mm_per_hr=rainfall_mm,
                 readings=1,
             )
-            continue
+            return current
 
         delta_hours = max(gap.total_seconds() / 3600.0, 1e-6)
-        intensity = reading.rainfall_mm / delta_hours
+        intensity = rainfall_mm / delta_hours
 
-        current_event.end = reading.ts
-        current_event.total_rain_mm += reading.rainfall_mm
-        current_event.readings += 1
-        current_event.peak_intensity_mm_per_hr = max(
-            current_event.peak_intensity_mm_per_hr, intensity, reading.rainfall_mm
+        current.end = ts
+        current.total_rain_mm += rainfall_mm
+        current.readings += 1
+        current.peak_intensity_mm_per_hr = max(
+            current.peak_intensity_mm_per_hr, intensity, rainfall_mm
         )
+        return None
+
+    def open_events(self) -> List[RainEvent]:
+        return list(self._open.values())
+
+    def flush(self) -> List[RainEvent]:
+        """Close and return every open event."""
+        events = list(self._open.values())
+        self._open.clear()
+        return events
 
-    if current_event is not None:
-        events.append(current_event)
 
+def _events_from_rows(
+    rows: Iterable[Row],
+    per_reading_threshold_mm: float,
+    max_gap: timedelta,
+) -> Iterator[RainEvent]:
+    detector = RainEventDetector(per_reading_threshold_mm, max_gap)
+    for station_id, ts, _, rainfall_mm in rows:
+        closed = detector.update(station_id, ts, rainfall_mm)
+        if closed is not None:
+            yield closed
+    yield from detector.flush()
+
+
+def iter_heavy_rain_events(
+    readings: Iterable[Reading],
+    per_reading_threshold_mm: float = 1.0,
+    max_gap: timedelta = timedelta(minutes=10),
+    reorder_window: int = 8,
+) -> Iterator[RainEvent]:
+    """
+    Yield heavy-rain events in the order they close, consuming readings as they arrive.
+
+    Each station's feed may be out of order by up to ``reorder_window`` readings.
+    """
+    rows = reorder_rows(iter_rows(readings), reorder_window)
+    return _events_from_rows(rows, per_reading_threshold_mm, max_gap)
+
+
+def detect_heavy_rain_events(
+    readings: Iterable[Reading],
+    per_reading_threshold_mm: float = 1.0,
+    max_gap: timedelta = timedelta(minutes=10),
+    presorted: bool = False,
+) -> List[RainEvent]:
+    """
+    Group consecutive high-rainfall readings into events.
+
+    The readings are sorted by ``(station_id, ts)`` first unless
+    ``presorted=True``; use ``iter_heavy_rain_events`` to stream instead.
+    Events are returned ordered by station and start time.
+    """
+    rows = iter_rows(readings)
+    if not presorted:
+        rows = sorted(rows, key=lambda row: (row[0], row[1]))
+    events = list(_events_from_rows(rows, per_reading_threshold_mm, max_gap))
+    events.sort(key=lambda e: (e.station_id, e.start))
     return events
+
+
+PLAN_OUTPUTS = frozenset({"day", "week", "month", "events", "dry_spells", "percentiles", "windows", "alerts"})
+# Outputs derived from day summaries, and ones computed from each station's reading sequence.
+DAY_OUTPUTS = frozenset({"day", "week", "month", "percentiles"})
+SEQUENCE_OUTPUTS = frozenset({"events", "dry_spells", "windows", "alerts"})
+PLAN_ENGINES = ("python", "numpy")
+
+
+@dataclass(frozen=True)
+class AggregationPlan:
+    """Describe which outputs a single pass over the readings should produce."""
+
+    outputs: FrozenSet[str] = frozenset({"day"})
+    events_threshold_mm: float = 1.0
+    events_gap: timedelta = timedelta(minutes=10)
+    dry_threshold_mm: float = 0.05
+    dry_min_duration: timedelta = timedelta(hours=6)
+    dry_gap: timedelta = timedelta(minutes=45)
+    percentiles: Sequence[float] = (25, 50, 75, 90, 95, 99)
+    engine: str = "python"
+    reorder_window: int = 8
+    # When set, percentiles come from a mergeable QuantileSketch with this rank error.
+    percentile_error: Optional[float] = None
+    # Per-station time zones for local days; None buckets every station by UTC day.
+    zones: Optional["StationZones"] = None
+    # Tumbling/hopping windows (and rolling peaks) for the "windows" output.
+    windows: Tuple["WindowSpec", ...] = ()
+    # Rules evaluated on every reading for the "alerts" output.
+    alert_rules: Tuple["AlertRule", ...] = ()
+
+    def __post_init__(self) -> None:
+        unknown = set(self.outputs) - PLAN_OUTPUTS
+        if unknown:
+            raise ValueError(f"Unknown plan outputs: {', '.join(sorted(unknown))}")
+        if "windows" in self.outputs and not self.windows:
+            raise ValueError("The windows output needs at least one window spec")
+        if "alerts" in self.outputs and not self.alert_rules:
+            raise ValueError("The alerts output needs at least one alert rule")
+        if self.engine not in PLAN_ENGINES:
+            raise ValueError(f"Unknown aggregation engine '{self.engine}'")
+
+
+@dataclass
+class PlanResult:
+    days: Dict[Tuple[str, Tuple[int, int, int]], DaySummary] = field(default_factory=dict)
+    weeks: Optional[Dict[Tuple[str, Tuple[int, int]], WeekSummary]] = None
+    months: Optional[Dict[Tuple[str, Tuple[int, int]], MonthSummary]] = None
+    events: Optional[List[RainEvent]] = None
+    dry_spells: Optional[List["DrySpell"]] = None
+    percentiles: Optional[Dict[float, float]] = None
+    percentile_sketch: Optional["QuantileSketch"] = None
+    windows: Optional[List["WindowSummary"]] = None
+    window_peaks: Optional[List["WindowPeak"]] = None
+    alerts: Optional[List["Alert"]] = None
+
+
+def derive_day_outputs(result: PlanResult, plan: AggregationPlan) -> None:
+    """Fill in the weekly/monthly rollups and percentiles ``plan`` asks for from ``result.days``."""
+    from analytics import rainfall_percentile_sketch, rainfall_percentiles
+
+    outputs = plan.outputs
+    if "week" in outputs:
+        result.weeks = rollup_week(result.days)
+    if "month" in outputs:
+        result.months = rollup_month(result.days)
+    if "percentiles" in outputs:
+        if plan.percentile_error is not None:
+            result.percentile_sketch = rainfall_percentile_sketch(
+                result.days.values(), error=plan.percentile_error
+            )
+            result.percentiles = result.percentile_sketch.percentiles(plan.percentiles)
+        else:
+            result.percentiles = rainfall_percentiles(result.days.values(), percentiles=plan.percentiles)
+
+
+def execute_plan(
+    readings: Iterable[Reading], plan: AggregationPlan, cache: Optional["SummaryCache"] = None
+) -> PlanResult:
+    """
+    Produce every output requested by ``plan`` from one traversal of ``readings``.
+
+    Day summaries are aggregated once and weekly/monthly rollups are derived
+    from them. The event and dry-spell state machines, the window aggregator
+    and the alert engine consume the same traversal through a per-station
+    reorder buffer, so nothing is sorted or kept around beyond
+    ``plan.reorder_window`` readings per station (and the open windows). With a
+    ``cache``, only (station, day) groups whose readings changed since an
+    earlier run are aggregated again. See ``pipeline`` for how the pass is
+    laid out.
+    """
+    # pipeline imports this module, so pull it in lazily.
+    from pipeline import plan_pipeline
+
+    return plan_pipeline(plan, cached=cache is not None).run(readings, cache=cache)
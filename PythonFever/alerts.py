@@ -0,0 +1,284 @@
+"""
+Alert rules evaluated on every reading as it arrives.
+
+A rule compares one per-station metric with a threshold, e.g.
+``day_rain>=50``, ``S7:rain_1h>=12~2`` or ``temp<-5``:
+
+* ``rain`` / ``temp``: the reading's rainfall (mm) and temperature (°C);
+* ``day_rain``: rainfall so far on the reading's (local, with zones) day;
+* ``rain_<duration>``: rolling rainfall over the last duration (``rain_3h``).
+
+A rule raises an ``Alert`` when its condition starts to hold and stays
+quiet until it is cleared, which happens once the metric is back on the
+other side of the threshold by more than the rule's hysteresis (``~2``
+above). Rules are compiled once into groups of thresholds sorted per
+metric and direction, so a reading costs a couple of bisects per group no
+matter how many rules there are: only the thresholds between the metric's
+previous and new value can change state. Rules without a station apply to
+every station; the others are indexed by station.
+"""
+import math
+import re
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field, replace
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Set, Tuple
+
+from model import Row, to_epoch_us
+from windowing import RollingSum, format_duration, parse_duration
+
+if TYPE_CHECKING:
+    from timebuckets import StationZones
+
+ALERT_OPS = (">=", ">", "<=", "<")
+_RULE = re.compile(
+    r"^(?:(?P<station>.+?):)?(?P<metric>[a-z_0-9]+)\s*(?P<op>>=|<=|>|<)\s*(?P<threshold>[^~\s]+)"
+    r"(?:\s*~\s*(?P<hysteresis>\S+))?$"
+)
+# Slots of the per-reading metric values; rolling sums follow in the engine's order.
+_RAIN, _TEMP, _DAY_RAIN = 0, 1, 2
+_FIXED_METRICS = {"rain": _RAIN, "temp": _TEMP, "day_rain": _DAY_RAIN}
+
+
+def _rolling_size(metric: str) -> Optional[timedelta]:
+    if metric in _FIXED_METRICS:
+        return None
+    if not metric.startswith("rain_"):
+        raise ValueError(f"Unknown alert metric '{metric}' (use rain, temp, day_rain or rain_<duration>)")
+    return parse_duration(metric[len("rain_") :])
+
+
+@dataclass(frozen=True)
+class AlertRule:
+    metric: str
+    op: str
+    threshold: float
+    station_id: Optional[str] = None
+    # How far the metric must fall back past the threshold before the rule can fire again.
+    hysteresis: float = 0.0
+
+    def __post_init__(self) -> None:
+        if self.op not in ALERT_OPS:
+            raise ValueError(f"Unknown alert operator '{self.op}'")
+        size = _rolling_size(self.metric)
+        if size is not None:
+            # rain_60m and rain_1h are the same rule.
+            object.__setattr__(self, "metric", f"rain_{format_duration(size)}")
+        if not math.isfinite(self.threshold):
+            raise ValueError("alert threshold must be finite")
+        if not self.hysteresis >= 0:
+            raise ValueError("alert hysteresis must not be negative")
+
+    @classmethod
+    def parse(cls, text: str) -> "AlertRule":
+        """Parse ``[STATION:]METRIC OP THRESHOLD[~HYSTERESIS]``, e.g. ``S1:rain_1h>=10~2``."""
+        match = _RULE.match(text.strip())
+        if match is None:
+            raise ValueError(f"Invalid alert rule '{text}' (expected [STATION:]METRIC OP THRESHOLD[~HYSTERESIS])")
+        try:
+            threshold = float(match["threshold"])
+            hysteresis = float(match["hysteresis"]) if match["hysteresis"] else 0.0
+        except ValueError:
+            raise ValueError(f"Invalid number in alert rule '{text}'") from None
+        return cls(match["metric"], match["op"], threshold, match["station"], hysteresis)
+
+    @property
+    def label(self) -> str:
+        scope = f"{self.station_id}:" if self.station_id is not None else ""
+        hysteresis = f"~{self.hysteresis:g}" if self.hysteresis else ""
+        return f"{scope}{self.metric}{self.op}{self.threshold:g}{hysteresis}"
+
+
+def parse_alert_rules(texts: Iterable[str]) -> List[AlertRule]:
+    """Parse rule strings, skipping blank lines and ``#`` comments."""
+    rules = []
+    for text in texts:
+        text = text.split("#", 1)[0].strip()
+        if text:
+            rules.append(AlertRule.parse(text))
+    return rules
+
+
+def load_alert_rules(path: Path) -> List[AlertRule]:
+    """Read one rule per line from ``path``."""
+    with open(path, encoding="utf-8") as handle:
+        return parse_alert_rules(handle)
+
+
+@dataclass
+class Alert:
+    station_id: str
+    ts: datetime
+    rule: AlertRule
+    # The metric's value at ``ts``.
+    value: float
+    # False when the rule's condition stopped holding.
+    raised: bool = True
+
+
+@dataclass
+class _RuleGroup:
+    # Rules on one metric and direction, normalized to ``sign * value`` >=
+    # (or > when strict) ``threshold``; ``clears`` are the levels below which
+    # an active rule clears, ``clear_order`` maps them to rule indexes.
+    slot: int
+    sign: float
+    strict: bool
+    rules: List[AlertRule] = field(default_factory=list)
+    thresholds: List[float] = field(default_factory=list)
+    clears: List[float] = field(default_factory=list)
+    clear_order: List[int] = field(default_factory=list)
+
+
+def _compile(rules: Iterable[AlertRule], slots: Dict[str, int]) -> List[_RuleGroup]:
+    grouped: Dict[Tuple[int, float, bool], List[Tuple[float, float, AlertRule]]] = {}
+    for rule in rules:
+        sign = 1.0 if rule.op[0] == ">" else -1.0
+        key = (slots[rule.metric], sign, len(rule.op) == 1)
+        grouped.setdefault(key, []).append((sign * rule.threshold, sign * rule.threshold - rule.hysteresis, rule))
+    groups = []
+    for (slot, sign, strict), entries in grouped.items():
+        entries.sort(key=lambda entry: entry[0])
+        group = _RuleGroup(slot, sign, strict)
+        group.thresholds = [threshold for threshold, _, _ in entries]
+        group.rules = [rule for _, _, rule in entries]
+        group.clear_order = sorted(range(len(entries)), key=lambda index: entries[index][1])
+        group.clears = [entries[index][1] for index in group.clear_order]
+        groups.append(group)
+    return groups
+
+
+class _StationAlerts:
+    __slots__ = ("groups", "last", "active", "rolling", "needs_day", "day", "day_rain", "last_us")
+
+    def __init__(self, groups: List[_RuleGroup], rolling: Dict[int, timedelta]) -> None:
+        self.groups = groups
+        self.last: List[Optional[float]] = [None] * len(groups)
+        self.active: List[Set[int]] = [set() for _ in groups]
+        slots = {group.slot for group in groups}
+        self.rolling = [(slot, RollingSum(rolling[slot])) for slot in sorted(slots) if slot in rolling]
+        self.needs_day = _DAY_RAIN in slots
+        self.day: Optional[int] = None
+        self.day_rain = 0.0
+        self.last_us: Optional[int] = None
+
+
+class AlertEngine:
+    """
+    Evaluate alert rules on every reading.
+
+    ``update`` expects every station's readings in timestamp order; older
+    readings are dropped and counted in ``late_readings``. With ``zones``,
+    ``day_rain`` restarts at the stations' local midnight. Identical rules
+    fire once.
+    """
+
+    def __init__(self, rules: Iterable[AlertRule], *, zones: Optional["StationZones"] = None) -> None:
+        self.rules = list(dict.fromkeys(rules))
+        self.zones = None if zones is None or zones.is_utc else zones
+        self.late_readings = 0
+        slots = dict(_FIXED_METRICS)
+        self._rolling: Dict[int, timedelta] = {}
+        for rule in self.rules:
+            if rule.metric not in slots:
+                slots[rule.metric] = len(slots)
+                self._rolling[slots[rule.metric]] = _rolling_size(rule.metric)
+        self._slots = len(slots)
+        global_rules = [rule for rule in self.rules if rule.station_id is None]
+        covered = set(global_rules)
+        station_rules: Dict[str, List[AlertRule]] = {}
+        for rule in self.rules:
+            # A station rule that repeats a rule for every station would fire twice.
+            if rule.station_id is not None and replace(rule, station_id=None) not in covered:
+                station_rules.setdefault(rule.station_id, []).append(rule)
+        self._global = _compile(global_rules, slots)
+        self._by_station = {station_id: _compile(rules, slots) for station_id, rules in station_rules.items()}
+        self._stations: Dict[str, _StationAlerts] = {}
+
+    def _station(self, station_id: str) -> _StationAlerts:
+        groups = self._global + self._by_station.get(station_id, [])
+        state = self._stations[station_id] = _StationAlerts(groups, self._rolling)
+        return state
+
+    def update(self, station_id: str, ts: datetime, temperature_c: float, rainfall_mm: float) -> List[Alert]:
+        """Add one reading and return the alerts it raised or cleared."""
+        state = self._stations.get(station_id)
+        if state is None:
+            state = self._station(station_id)
+        if not state.groups:
+            return []
+        epoch_us = to_epoch_us(ts)
+        if state.last_us is not None and epoch_us < state.last_us:
+            self.late_readings += 1
+            return []
+        state.last_us = epoch_us
+        values = [0.0] * self._slots
+        values[_RAIN] = rainfall_mm
+        values[_TEMP] = temperature_c
+        if state.needs_day:
+            day = ts.toordinal() if self.zones is None else self.zones.local_ordinal(station_id, ts)
+            if day != state.day:
+                state.day = day
+                state.day_rain = 0.0
+            state.day_rain += rainfall_mm
+            values[_DAY_RAIN] = state.day_rain
+        for slot, rolling in state.rolling:
+            values[slot] = rolling.add(epoch_us, rainfall_mm)
+
+        alerts: List[Alert] = []
+        last = state.last
+        for index, group in enumerate(state.groups):
+            value = group.sign * values[group.slot]
+            previous = last[index]
+            if value == previous or value != value:
+                continue
+            last[index] = value
+            active = state.active[index]
+            if previous is None or value > previous:
+                # Rising: the rules whose threshold was passed fire, unless still active.
+                thresholds = group.thresholds
+                if group.strict:
+                    lo = 0 if previous is None else bisect_left(thresholds, previous)
+                    hi = bisect_left(thresholds, value)
+                else:
+                    lo = 0 if previous is None else bisect_right(thresholds, previous)
+                    hi = bisect_right(thresholds, value)
+                for rule_index in range(lo, hi):
+                    if rule_index not in active:
+                        active.add(rule_index)
+                        alerts.append(Alert(station_id, ts, group.rules[rule_index], values[group.slot]))
+            elif active:
+                # Falling: the active rules whose clear level was passed clear.
+                clears = group.clears
+                if group.strict:
+                    lo, hi = bisect_left(clears, value), bisect_left(clears, previous)
+                else:
+                    lo, hi = bisect_right(clears, value), bisect_right(clears, previous)
+                for position in range(lo, hi):
+                    rule_index = group.clear_order[position]
+                    if rule_index in active:
+                        active.discard(rule_index)
+                        alerts.append(
+                            Alert(station_id, ts, group.rules[rule_index], values[group.slot], raised=False)
+                        )
+        return alerts
+
+    def update_rows(self, rows: Iterable[Row]) -> List[Alert]:
+        """Add ``(station_id, ts, temperature_c, rainfall_mm)`` rows and return their alerts in order."""
+        alerts: List[Alert] = []
+        update = self.update
+        for station_id, ts, temperature_c, rainfall_mm in rows:
+            fired = update(station_id, ts, temperature_c, rainfall_mm)
+            if fired:
+                alerts.extend(fired)
+        return alerts
+
+    def active(self) -> List[Tuple[str, AlertRule]]:
+        """``(station_id, rule)`` of every rule whose condition currently holds."""
+        return [
+            (station_id, group.rules[rule_index])
+            for station_id, state in sorted(self._stations.items())
+            for group, active in zip(state.groups, state.active)
+            for rule_index in sorted(active)
+        ]
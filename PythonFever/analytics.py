@@ -1,10 +1,14 @@
+import heapq
 import math
+from bisect import bisect_left, bisect_right, insort
 from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from itertools import chain
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 
 from aggregator import DaySummary
-from model import Reading
+from model import Reading, Row, iter_rows, reorder_rows
+from sketch import QuantileSketch
 
 
 @dataclass
@@ -16,62 +20,122 @@ class DrySpell:
     readings: int
 
 
-def detect_dry_spells(
-    readings: Iterable[Reading],
-    *,
-    dry_threshold_mm: float = 0.05,
-    min_duration: timedelta = timedelta(hours=6),
-    max_gap: timedelta = timedelta(minutes=45),
-) -> List[DrySpell]:
-    """Identify extended periods with minimal rainfall."""
-    sorted_readings = sorted(readings, key=lambda r: (r.station_id, r.ts))
+class DrySpellDetector:
+    """
+    Per-station state machine behind the dry-spell detectors.
 
-    spells: List[DrySpell] = []
-    current: Dict[str, Optional[DrySpell]] = {}
-    last_ts: Dict[str, Optional[datetime]] = {}
+    Each station keeps at most one open spell. ``update`` expects every
+    station's readings in timestamp order (see ``model.ReorderBuffer``) and
+    returns the spell the reading closed, if it lasted long enough.
+    """
 
-    min_hours = min_duration.total_seconds() / 3600.0
+    def __init__(
+        self,
+        dry_threshold_mm: float = 0.05,
+        min_duration: timedelta = timedelta(hours=6),
+        max_gap: timedelta = timedelta(minutes=45),
+    ) -> None:
+        self.dry_threshold_mm = dry_threshold_mm
+        self.max_gap = max_gap
+        self._min_hours = min_duration.total_seconds() / 3600.0
+        self._open: Dict[str, DrySpell] = {}
+        self._last_ts: Dict[str, datetime] = {}
 
-    def finalize(station_id: str) -> None:
-        active = current.get(station_id)
-        if active and active.duration_hours >= min_hours:
-            spells.append(active)
-        current[station_id] = None
+    def _finalize(self, station_id: str) -> Optional[DrySpell]:
+        active = self._open.pop(station_id, None)
+        if active is not None and active.duration_hours >= self._min_hours:
+            return active
+        return None
 
-    for reading in sorted_readings:
-        station_id = reading.station_id
-        prev_ts = last_ts.get(station_id)
-        active = current.get(station_id)
+    def update(self, station_id: str, ts: datetime, rainfall_mm: float) -> Optional[DrySpell]:
+        closed = None
+        prev_ts = self._last_ts.get(station_id)
+        active = self._open.get(station_id)
 
-        if active and prev_ts and reading.ts - prev_ts > max_gap:
-            finalize(station_id)
+        if active is not None and prev_ts is not None and ts - prev_ts > self.max_gap:
+            closed = self._finalize(station_id)
             active = None
 
-        if reading.rainfall_mm <= dry_threshold_mm:
+        if rainfall_mm <= self.dry_threshold_mm:
             if active is None:
                 active = DrySpell(
                     station_id=station_id,
-                    start=reading.ts,
-                    end=reading.ts,
+                    start=ts,
+                    end=ts,
                     duration_hours=0.0,
                     readings=1,
                 )
-                current[station_id] = active
+                self._open[station_id] = active
             else:
-                active.end = reading.ts
+                active.end = ts
                 active.readings += 1
 
             active.duration_hours = max(
                 (active.end - active.start).total_seconds() / 3600.0, 0.0
             )
-        else:
-            finalize(station_id)
+        elif active is not None:
+            closed = self._finalize(station_id)
+
+        self._last_ts[station_id] = ts
+        return closed
+
+    def flush(self) -> List[DrySpell]:
+        """Close every open spell and return those that lasted long enough."""
+        spells = [self._finalize(station_id) for station_id in list(self._open)]
+        return [spell for spell in spells if spell is not None]
+
+
+def _spells_from_rows(
+    rows: Iterable[Row],
+    dry_threshold_mm: float,
+    min_duration: timedelta,
+    max_gap: timedelta,
+) -> Iterator[DrySpell]:
+    detector = DrySpellDetector(dry_threshold_mm, min_duration, max_gap)
+    for station_id, ts, _, rainfall_mm in rows:
+        closed = detector.update(station_id, ts, rainfall_mm)
+        if closed is not None:
+            yield closed
+    yield from detector.flush()
+
+
+def iter_dry_spells(
+    readings: Iterable[Reading],
+    *,
+    dry_threshold_mm: float = 0.05,
+    min_duration: timedelta = timedelta(hours=6),
+    max_gap: timedelta = timedelta(minutes=45),
+    reorder_window: int = 8,
+) -> Iterator[DrySpell]:
+    """
+    Yield dry spells in the order they close, consuming readings as they arrive.
 
-        last_ts[station_id] = reading.ts
+    Each station's feed may be out of order by up to ``reorder_window`` readings.
+    """
+    rows = reorder_rows(iter_rows(readings), reorder_window)
+    return _spells_from_rows(rows, dry_threshold_mm, min_duration, max_gap)
 
-    for station_id in list(current.keys()):
-        finalize(station_id)
 
+def detect_dry_spells(
+    readings: Iterable[Reading],
+    *,
+    dry_threshold_mm: float = 0.05,
+    min_duration: timedelta = timedelta(hours=6),
+    max_gap: timedelta = timedelta(minutes=45),
+    presorted: bool = False,
+) -> List[DrySpell]:
+    """
+    Identify extended periods with minimal rainfall.
+
+    The readings are sorted by ``(station_id, ts)`` first unless
+    ``presorted=True``; use ``iter_dry_spells`` to stream instead. Spells
+    are returned ordered by station and start time.
+    """
+    rows = iter_rows(readings)
+    if not presorted:
+        rows = sorted(rows, key=lambda row: (row[0], row[1]))
+    spells = list(_spells_from_rows(rows, dry_threshold_mm, min_duration, max_gap))
+    spells.sort(key=lambda s: (s.station_id, s.start))
     return spells
 
 
@@ -81,18 +145,120 @@ def top_wettest_days(
     limit: int = 5,
 ) -> List[DaySummary]:
     """Return the wettest day summaries across stations."""
-    return sorted(
-        summaries,
-        key=lambda s: (s.total_rain_mm, s.date),
-        reverse=True,
-    )[:limit]
+    return heapq.nlargest(limit, summaries, key=lambda s: (s.total_rain_mm, s.date))
+
+
+_RankEntry = Tuple[float, datetime, int, DaySummary]
+
+
+class TopKIndex:
+    """
+    Incrementally maintained wettest-day rankings.
+
+    Bounded min-heaps hold the ``capacity`` wettest days overall, per station
+    and per calendar date, so "top K" queries (``K <= capacity``) never touch
+    more than a handful of candidates. Feeding a summary for a (station, day)
+    that is already indexed replaces the earlier one, which makes it safe to
+    feed in-progress snapshots from ``StreamingDayAggregator``. Because the
+    heaps are bounded, rankings stay exact only while a replacement never
+    ranks lower than what it replaces; this always holds for growing rain
+    totals. Ties rank in insertion order, like ``top_wettest_days``.
+    """
+
+    def __init__(self, capacity: int = 10) -> None:
+        if capacity < 1:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self._global: List[_RankEntry] = []
+        self._by_station: Dict[str, List[_RankEntry]] = {}
+        self._by_date: Dict[datetime, List[_RankEntry]] = {}
+        self._dates: List[datetime] = []
+        self._seq = 0
+
+    def _offer(self, heap: List[_RankEntry], entry: _RankEntry) -> None:
+        if len(heap) < self.capacity:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+
+    @staticmethod
+    def _discard(heap: List[_RankEntry], station_id: str, date: datetime) -> None:
+        for idx, entry in enumerate(heap):
+            if entry[3].station_id == station_id and entry[1] == date:
+                heap[idx] = heap[-1]
+                heap.pop()
+                heapq.heapify(heap)
+                return
+
+    def add(self, summary: DaySummary) -> None:
+        station_heap = self._by_station.get(summary.station_id)
+        if station_heap is None:
+            station_heap = self._by_station[summary.station_id] = []
+        date_heap = self._by_date.get(summary.date)
+        if date_heap is None:
+            date_heap = self._by_date[summary.date] = []
+            insort(self._dates, summary.date)
+        else:
+            # Anything in the global heap is also in its station and date heaps.
+            for heap in (self._global, station_heap, date_heap):
+                self._discard(heap, summary.station_id, summary.date)
+
+        # Negated sequence numbers make earlier insertions win ties.
+        self._seq += 1
+        entry = (summary.total_rain_mm, summary.date, -self._seq, summary)
+        self._offer(self._global, entry)
+        self._offer(station_heap, entry)
+        self._offer(date_heap, entry)
+
+    def add_many(self, summaries: Iterable[DaySummary]) -> None:
+        for summary in summaries:
+            self.add(summary)
+
+    def _check(self, k: Optional[int]) -> int:
+        if k is None:
+            return self.capacity
+        if k > self.capacity:
+            raise ValueError(f"k={k} exceeds the index capacity of {self.capacity}")
+        return k
+
+    def top(self, k: Optional[int] = None) -> List[DaySummary]:
+        """Wettest days across all stations."""
+        return [entry[3] for entry in heapq.nlargest(self._check(k), self._global)]
+
+    def top_for_station(self, station_id: str, k: Optional[int] = None) -> List[DaySummary]:
+        """Wettest days recorded by one station."""
+        heap = self._by_station.get(station_id, [])
+        return [entry[3] for entry in heapq.nlargest(self._check(k), heap)]
+
+    def top_between(self, start: datetime, end: datetime, k: Optional[int] = None) -> List[DaySummary]:
+        """Wettest days with ``start <= date <= end`` across all stations."""
+        lo = bisect_left(self._dates, start)
+        hi = bisect_right(self._dates, end)
+        candidates = chain.from_iterable(self._by_date[date] for date in self._dates[lo:hi])
+        return [entry[3] for entry in heapq.nlargest(self._check(k), candidates)]
+
+
+def rainfall_percentile_sketch(summaries: Iterable[DaySummary], *, error: float = 0.01) -> QuantileSketch:
+    """Build a mergeable sketch of daily rainfall totals with roughly ``error`` rank error."""
+    sketch = QuantileSketch.with_error(error)
+    sketch.update_many(summary.total_rain_mm for summary in summaries)
+    return sketch
 
 
 def rainfall_percentiles(
     summaries: Iterable[DaySummary],
     percentiles: Sequence[float] = (25, 50, 75, 90, 95, 99),
+    *,
+    error: Optional[float] = None,
 ) -> Dict[float, float]:
-    """Compute rainfall percentiles from day summaries."""
+    """
+    Compute rainfall percentiles from day summaries.
+
+    With ``error`` set the totals are streamed through a ``QuantileSketch``
+    in fixed memory instead of being sorted.
+    """
+    if error is not None:
+        return rainfall_percentile_sketch(summaries, error=error).percentiles(percentiles)
     totals = sorted(summary.total_rain_mm for summary in summaries)
     if not totals:
         return {p: 0.0 for p in percentiles}
@@ -117,16 +283,19 @@ def rainfall_percentiles(
     return results
 
 
+_SEVERITY_LABELS = ("no rain", "light", "moderate", "heavy", "very heavy", "violent")
+
+
 def classify_rain_intensity(
     total_rain_mm: float,
     thresholds: Sequence[float] = (2.5, 7.5, 15.0, 30.0),
 ) -> str:
     """
-    Classify rainfall severity similar to standard meteorological scales.
+    Map a daily total to a severity label.
 
     thresholds define the boundaries for light, moderate, heavy, very heavy rain.
     """
-    labels = ["no rain", "light", "moderate", "heavy", "very heavy", "violent"]
+    labels = _SEVERITY_LABELS
     if total_rain_mm <= 0.0:
         return labels[0]
     for idx, threshold in enumerate(thresholds, start=1):
@@ -135,5 +304,31 @@ def classify_rain_intensity(
     return labels[min(len(labels) - 1, len(thresholds) + 1)]
 
 
+def classify_rain_intensities(
+    totals: Iterable[float],
+    thresholds: Sequence[float] = (2.5, 7.5, 15.0, 30.0),
+) -> List[str]:
+    """
+    ``classify_rain_intensity`` for many totals, bisecting the thresholds once per value.
+
+    The thresholds must be in ascending order; ``ValueError`` otherwise.
+    """
+    if any(low > high for low, high in zip(thresholds, thresholds[1:])):
+        raise ValueError("rain intensity thresholds must be in ascending order")
+    labels = _SEVERITY_LABELS
+    top = len(labels) - 1
+    if len(thresholds) >= top:
+        # Totals past the last labelled boundary share the last label.
+        thresholds = thresholds[: top - 1]
+    # NaN compares false against every boundary and lands on the last label, as in the scan.
+    return [labels[0] if total <= 0.0 else labels[bisect_right(thresholds, total) + 1] for total in totals]
+
+
 def classify_day_severity(summary: DaySummary, thresholds: Sequence[float] = (2.5, 7.5, 15.0, 30.0)) -> str:
     return classify_rain_intensity(summary.total_rain_mm, thresholds)
+
+
+def classify_day_severities(
+    summaries: Iterable[DaySummary], thresholds: Sequence[float] = (2.5, 7.5, 15.0, 30.0)
+) -> List[str]:
+    return classify_rain_intensities([summary.total_rain_mm for summary in summaries], thresholds)
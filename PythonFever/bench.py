@@ -0,0 +1,545 @@
+"""
+Benchmark suite for the pipeline stages.
+
+Datasets are generated once with fixed seeds from
+``multi_station_cycle_batches`` (stations interleaved minute by minute) or
+``rainfall_burst_batches`` (one station after another), written to a
+``ReadingStore`` and memory-mapped, so even 100M-reading datasets never exist
+as ``Reading`` objects. Every stage is timed separately over a few repeats,
+then run once more under ``tracemalloc`` for its peak allocation. Results are
+written as JSON and can be compared against a stored baseline:
+
+    python bench.py --readings 10k 1M --stations 1 100 --out bench.json
+    python bench.py --readings 10k 1M --stations 1 100 --baseline bench.json
+
+The process exits with status 1 when a stage got slower (or hungrier) than
+the baseline by more than ``--tolerance``. Differences below ``--min-delta-ms``
+(or 64 KiB of peak memory) are timer and allocator noise and never count,
+and a slowdown only counts when even the fastest repeat is slower than the
+baseline's median.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+
+from aggregator import (
+    AggregationPlan,
+    PlanResult,
+    aggregate_day,
+    aggregate_month,
+    aggregate_week,
+    derive_day_outputs,
+    detect_heavy_rain_events,
+)
+from analytics import classify_day_severities, detect_dry_spells, rainfall_percentile_sketch, rainfall_percentiles
+from model import ReadingBatch
+from persistence import (
+    ReadingStore,
+    write_day_summary_csv,
+    write_day_summary_ndjson,
+    write_dry_spells_csv,
+    write_dry_spells_ndjson,
+    write_month_summary_csv,
+    write_month_summary_ndjson,
+    write_percentiles_json,
+    write_quantile_sketch,
+    write_rain_events_csv,
+    write_rain_events_ndjson,
+    write_reading_store,
+    write_summary_store,
+    write_week_summary_json,
+    write_week_summary_ndjson,
+)
+from reporter import (
+    render,
+    render_days,
+    render_detailed,
+    render_dry_spells,
+    render_events,
+    render_month,
+    render_percentiles,
+    render_records,
+    render_week,
+)
+from sensor_stream import multi_station_cycle_batches, rainfall_burst_batches, with_noise_batches
+
+SCHEMA_VERSION = 1
+SCENARIOS = ("cycle", "burst")
+DEFAULT_TOLERANCE = 0.10
+# Smaller differences than these are noise, whatever the ratio.
+DEFAULT_MIN_DELTA_SECONDS = 0.005
+MIN_DELTA_PEAK_BYTES = 64 * 1024
+# Readings generated per chunk while building a dataset.
+GENERATE_CHUNK = 1_000_000
+START = datetime(2024, 1, 1)
+STAGE_NAMES = (
+    "aggregate_day",
+    "aggregate_week",
+    "aggregate_month",
+    "detect_heavy_rain_events",
+    "detect_dry_spells",
+    "rainfall_percentiles",
+    "render",
+    "render_detailed",
+    "render_days",
+    "render_records_tsv",
+    "render_records_ndjson",
+    "render_week",
+    "render_month",
+    "render_events",
+    "render_dry_spells",
+    "render_percentiles",
+    "write_day_summary_csv",
+    "write_day_summary_ndjson",
+    "write_week_summary_json",
+    "write_week_summary_ndjson",
+    "write_month_summary_csv",
+    "write_month_summary_ndjson",
+    "write_rain_events_csv",
+    "write_rain_events_ndjson",
+    "write_dry_spells_csv",
+    "write_dry_spells_ndjson",
+    "write_percentiles_json",
+    "write_quantile_sketch",
+    "write_reading_store",
+    "write_summary_store",
+)
+
+
+@dataclass(frozen=True)
+class DatasetSpec:
+    scenario: str
+    readings: int
+    stations: int
+    seed: int
+
+    @property
+    def name(self) -> str:
+        return f"{self.scenario}-{_format_count(self.readings)}-{self.stations}st-seed{self.seed}"
+
+
+@dataclass
+class StageResult:
+    dataset: str
+    stage: str
+    group: str
+    inputs: int
+    items: int
+    repeats: int
+    seconds_min: float
+    seconds_median: float
+    throughput_per_s: float
+    peak_bytes: Optional[int]
+
+
+@dataclass
+class Regression:
+    dataset: str
+    stage: str
+    metric: str
+    baseline: float
+    current: float
+
+    @property
+    def ratio(self) -> float:
+        return self.current / self.baseline if self.baseline else float("inf")
+
+
+def _parse_count(text: str) -> int:
+    """Parse ``10k``, ``1M``, ``2.5M`` or plain integers."""
+    scale = {"k": 1_000, "m": 1_000_000, "g": 1_000_000_000}.get(text[-1:].lower())
+    value = float(text[:-1]) * scale if scale else float(text)
+    if value < 1 or value != int(value):
+        raise argparse.ArgumentTypeError(f"invalid count {text!r}")
+    return int(value)
+
+
+def _format_count(value: int) -> str:
+    for suffix, scale in (("G", 1_000_000_000), ("M", 1_000_000), ("k", 1_000)):
+        if value >= scale and value % scale == 0:
+            return f"{value // scale}{suffix}"
+    return str(value)
+
+
+def _station_ids(count: int) -> List[str]:
+    return [f"S{index + 1:05d}" for index in range(count)]
+
+
+def _dataset_chunks(spec: DatasetSpec) -> Iterator[ReadingBatch]:
+    stations = _station_ids(spec.stations)
+    if spec.scenario == "cycle":
+        minutes = max(spec.readings // spec.stations, 1)
+        yield from multi_station_cycle_batches(stations, start=START, minutes=minutes, chunk_rows=GENERATE_CHUNK)
+    elif spec.scenario == "burst":
+        per_station = max(spec.readings // spec.stations, 1)
+        for station_id in stations:
+            yield from rainfall_burst_batches(
+                station_id, start=START, increments=per_station, step=0.2, chunk_rows=GENERATE_CHUNK
+            )
+    else:
+        raise ValueError(f"Unknown scenario '{spec.scenario}'")
+
+
+def build_dataset(spec: DatasetSpec, root: Path) -> ReadingBatch:
+    """
+    Generate ``spec`` into a reading store under ``root`` (reusing one built earlier).
+
+    Returns the stored readings as a memory-mapped batch.
+    """
+    path = root / spec.name
+    if (path / "meta.json").exists():
+        store = ReadingStore(path)
+        if len(store):
+            return store.read()
+        shutil.rmtree(path)
+    store = ReadingStore(path, create=True)
+    for batch in with_noise_batches(_dataset_chunks(spec), seed=spec.seed):
+        store.append(batch)
+    return ReadingStore(path).read()
+
+
+@dataclass
+class _Stage:
+    name: str
+    group: str
+    inputs: int
+    run: Callable[[], Any]
+
+
+def _count(result: Any) -> int:
+    if isinstance(result, str):
+        return result.count("\n") + 1 if result else 0
+    try:
+        return len(result)
+    except TypeError:
+        return 1
+
+
+def _stages(readings: ReadingBatch, out_dir: Path) -> List[_Stage]:
+    """The stages of ``STAGE_NAMES``; downstream inputs are computed once up front and not timed."""
+    n = len(readings)
+    plan = AggregationPlan(outputs=frozenset({"day", "week", "month"}))
+    result = PlanResult(days=aggregate_day(readings))
+    derive_day_outputs(result, plan)
+    days = sorted(result.days.values(), key=lambda s: (s.station_id, s.date))
+    weeks = list(result.weeks.values())
+    months = list(result.months.values())
+    # The store keeps each station's readings in timestamp order, so the
+    # batch detectors can skip their up-front sort.
+    events = detect_heavy_rain_events(readings, presorted=True)
+    spells = detect_dry_spells(readings, presorted=True)
+    percentiles = rainfall_percentiles(days)
+    sketch = rainfall_percentile_sketch(days)
+
+    def writer(name: str, func: Callable[[Path, Any], Any], filename: str, items: Any) -> _Stage:
+        return _Stage(name, "persistence", _count(items), lambda: func(out_dir / filename, items))
+
+    def renderer(name: str, func: Callable[[Any], str], items: Sequence) -> _Stage:
+        return _Stage(name, "reporter", len(items), lambda: "\n".join(map(func, items)))
+
+    def day_records(fmt: str) -> List[str]:
+        return render_records("top_wet", days, fmt, classify_day_severities(days))
+
+    def rewrite_store(path: Path, batch: ReadingBatch) -> Path:
+        # The reading store appends, so start from scratch every time.
+        shutil.rmtree(path, ignore_errors=True)
+        return write_reading_store(path, batch)
+
+    return [
+        _Stage("aggregate_day", "aggregate", n, lambda: aggregate_day(readings)),
+        _Stage("aggregate_week", "aggregate", n, lambda: aggregate_week(readings)),
+        _Stage("aggregate_month", "aggregate", n, lambda: aggregate_month(readings)),
+        _Stage("detect_heavy_rain_events", "detect", n, lambda: detect_heavy_rain_events(readings, presorted=True)),
+        _Stage("detect_dry_spells", "detect", n, lambda: detect_dry_spells(readings, presorted=True)),
+        _Stage("rainfall_percentiles", "analytics", len(days), lambda: rainfall_percentiles(days)),
+        renderer("render", render, days),
+        renderer("render_detailed", render_detailed, days),
+        _Stage("render_days", "reporter", len(days), lambda: "\n".join(render_days(days))),
+        _Stage("render_records_tsv", "reporter", len(days), lambda: "\n".join(day_records("tsv"))),
+        _Stage("render_records_ndjson", "reporter", len(days), lambda: "\n".join(day_records("ndjson"))),
+        renderer("render_week", render_week, weeks),
+        renderer("render_month", render_month, months),
+        _Stage("render_events", "reporter", len(events), lambda: render_events(events)),
+        _Stage("render_dry_spells", "reporter", len(spells), lambda: render_dry_spells(spells)),
+        _Stage("render_percentiles", "reporter", len(percentiles), lambda: render_percentiles(percentiles)),
+        writer("write_day_summary_csv", write_day_summary_csv, "days.csv", days),
+        writer("write_day_summary_ndjson", write_day_summary_ndjson, "days.ndjson", days),
+        writer("write_week_summary_json", write_week_summary_json, "weeks.json", weeks),
+        writer("write_week_summary_ndjson", write_week_summary_ndjson, "weeks.ndjson", weeks),
+        writer("write_month_summary_csv", write_month_summary_csv, "months.csv", months),
+        writer("write_month_summary_ndjson", write_month_summary_ndjson, "months.ndjson", months),
+        writer("write_rain_events_csv", write_rain_events_csv, "events.csv", events),
+        writer("write_rain_events_ndjson", write_rain_events_ndjson, "events.ndjson", events),
+        writer("write_dry_spells_csv", write_dry_spells_csv, "dry.csv", spells),
+        writer("write_dry_spells_ndjson", write_dry_spells_ndjson, "dry.ndjson", spells),
+        writer("write_percentiles_json", write_percentiles_json, "percentiles.json", percentiles),
+        writer("write_quantile_sketch", write_quantile_sketch, "sketch.bin", sketch),
+        writer("write_reading_store", rewrite_store, "reading_store", readings),
+        _Stage(
+            "write_summary_store",
+            "persistence",
+            len(days) + len(weeks) + len(months),
+            lambda: write_summary_store(out_dir / "summary_store", result),
+        ),
+    ]
+
+
+def _time_stage(stage: _Stage, repeats: int, measure_memory: bool) -> Dict[str, Any]:
+    timings = []
+    items = 0
+    for _ in range(repeats):
+        gc.collect()
+        started = time.perf_counter()
+        output = stage.run()
+        timings.append(time.perf_counter() - started)
+        items = _count(output)
+        del output
+    peak = None
+    if measure_memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            stage.run()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    median = statistics.median(timings)
+    return {
+        "items": items,
+        "seconds_min": min(timings),
+        "seconds_median": median,
+        "throughput_per_s": stage.inputs / median if median > 0 else 0.0,
+        "peak_bytes": peak,
+    }
+
+
+def run_benchmarks(
+    specs: Iterable[DatasetSpec],
+    *,
+    stages: Optional[Sequence[str]] = None,
+    repeats: int = 3,
+    measure_memory: bool = True,
+    data_dir: Optional[Path] = None,
+    progress: Optional[Callable[[StageResult], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Benchmark the selected ``stages`` (default: all) on every dataset in ``specs``.
+
+    Returns the JSON-ready report. Datasets are kept in ``data_dir`` when
+    given (and reused by later runs); otherwise they live in a temporary
+    directory that is removed afterwards.
+    """
+    if repeats < 1:
+        raise ValueError("repeats must be positive")
+    wanted = set(stages) if stages else None
+    scratch = Path(tempfile.mkdtemp(prefix="pythonfever-bench-"))
+    root = Path(data_dir) if data_dir is not None else scratch / "data"
+    results: List[StageResult] = []
+    datasets = []
+    try:
+        for spec in specs:
+            started = time.perf_counter()
+            readings = build_dataset(spec, root)
+            generate_seconds = time.perf_counter() - started
+            datasets.append({**asdict(spec), "name": spec.name, "generate_seconds": generate_seconds})
+            out_dir = scratch / "out" / spec.name
+            out_dir.mkdir(parents=True, exist_ok=True)
+            for stage in _stages(readings, out_dir):
+                if wanted is not None and stage.name not in wanted:
+                    continue
+                measured = _time_stage(stage, repeats, measure_memory)
+                result = StageResult(spec.name, stage.name, stage.group, stage.inputs, repeats=repeats, **measured)
+                results.append(result)
+                if progress is not None:
+                    progress(result)
+            del readings
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return {
+        "schema": SCHEMA_VERSION,
+        "meta": _environment(),
+        "datasets": datasets,
+        "results": [asdict(result) for result in results],
+    }
+
+
+def _environment() -> Dict[str, Any]:
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(
+    current: Dict[str, Any],
+    baseline: Dict[str, Any],
+    tolerance: float = DEFAULT_TOLERANCE,
+    min_delta_seconds: float = DEFAULT_MIN_DELTA_SECONDS,
+) -> List[Regression]:
+    """
+    Stages of ``current`` that are slower, or allocate more, than in ``baseline`` by over ``tolerance``.
+
+    Results are matched by dataset and stage name; ones missing from either
+    report are ignored. Time is compared on the median of the repeats; it
+    only counts when the median grew by more than ``min_delta_seconds`` and
+    even the fastest repeat is over ``tolerance`` slower than the baseline's
+    median, so the odd slow repeat is not a regression. Peak memory has to
+    grow by more than ``MIN_DELTA_PEAK_BYTES``.
+    """
+    if baseline.get("schema") != SCHEMA_VERSION:
+        raise ValueError(f"Unsupported baseline schema {baseline.get('schema')!r}")
+    reference = {(entry["dataset"], entry["stage"]): entry for entry in baseline["results"]}
+    regressions = []
+    for entry in current["results"]:
+        before = reference.get((entry["dataset"], entry["stage"]))
+        if before is None:
+            continue
+        for metric in ("seconds_median", "peak_bytes"):
+            old, new = before.get(metric), entry.get(metric)
+            if old is None or new is None:
+                continue
+            if new <= old * (1 + tolerance):
+                continue
+            if metric == "peak_bytes":
+                if new - old <= MIN_DELTA_PEAK_BYTES:
+                    continue
+            elif new - old <= min_delta_seconds or not _slower(entry, before, tolerance):
+                continue
+            regressions.append(Regression(entry["dataset"], entry["stage"], metric, old, new))
+    return regressions
+
+
+def _slower(entry: Dict[str, Any], before: Dict[str, Any], tolerance: float) -> bool:
+    # Reports without the fastest repeat fall back to the median alone.
+    fastest = entry.get("seconds_min")
+    return fastest is None or fastest > before["seconds_median"] * (1 + tolerance)
+
+
+def render_results(report: Dict[str, Any]) -> str:
+    lines = [f"{'dataset':<28} {'stage':<28} {'median':>10} {'throughput/s':>14} {'peak':>10}"]
+    for entry in report["results"]:
+        peak = entry["peak_bytes"]
+        lines.append(
+            f"{entry['dataset']:<28} {entry['stage']:<28} {entry['seconds_median'] * 1e3:>8.1f}ms "
+            f"{entry['throughput_per_s']:>14,.0f} {_format_bytes(peak) if peak is not None else '-':>10}"
+        )
+    return "\n".join(lines)
+
+
+def render_regressions(regressions: Iterable[Regression]) -> str:
+    lines = []
+    for regression in regressions:
+        if regression.metric == "peak_bytes":
+            before, after = _format_bytes(regression.baseline), _format_bytes(regression.current)
+        else:
+            before, after = f"{regression.baseline * 1e3:.1f}ms", f"{regression.current * 1e3:.1f}ms"
+        lines.append(
+            f"REGRESSION {regression.dataset} {regression.stage} {regression.metric}: "
+            f"{before} -> {after} (x{regression.ratio:.2f})"
+        )
+    return "\n".join(lines)
+
+
+def _format_bytes(value: float) -> str:
+    for unit in ("B", "KiB", "MiB"):
+        if value < 1024:
+            return f"{value:.0f}{unit}"
+        value /= 1024
+    return f"{value:.1f}GiB"
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark PythonFever pipeline stages")
+    parser.add_argument(
+        "--readings", type=_parse_count, nargs="+", default=[10_000, 100_000], help="Dataset sizes, e.g. 10k 1M 100M"
+    )
+    parser.add_argument("--stations", type=int, nargs="+", default=[1, 100], help="Station counts per dataset")
+    parser.add_argument("--scenario", choices=SCENARIOS, nargs="+", default=["cycle"], help="Dataset generators")
+    parser.add_argument("--seed", type=int, default=7, help="Noise seed for the generated datasets")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per stage (the median is reported)")
+    parser.add_argument("--stages", nargs="+", metavar="STAGE", help="Only run these stages")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc pass for peak memory")
+    parser.add_argument("--data-dir", type=Path, help="Keep generated datasets here and reuse them across runs")
+    parser.add_argument("--out", type=Path, help="Write the JSON report here")
+    parser.add_argument("--baseline", type=Path, help="Compare against a report saved by an earlier run")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="Allowed slowdown or memory growth versus the baseline (0.1 = 10%%)",
+    )
+    parser.add_argument(
+        "--min-delta-ms",
+        type=float,
+        default=DEFAULT_MIN_DELTA_SECONDS * 1e3,
+        help="Ignore slowdowns smaller than this many milliseconds, whatever the ratio",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = parse_args(argv)
+    specs = [
+        DatasetSpec(scenario, readings, stations, args.seed)
+        for scenario in args.scenario
+        for readings in args.readings
+        for stations in args.stations
+        if stations <= readings
+    ]
+    if args.stages:
+        unknown = set(args.stages) - set(STAGE_NAMES)
+        if unknown:
+            raise SystemExit(f"Unknown stages: {', '.join(sorted(unknown))}")
+    baseline = json.loads(args.baseline.read_text()) if args.baseline else None
+
+    def progress(result: StageResult) -> None:
+        print(
+            f"{result.dataset} {result.stage}: {result.seconds_median * 1e3:.1f}ms "
+            f"({result.throughput_per_s:,.0f}/s)",
+            file=sys.stderr,
+        )
+
+    report = run_benchmarks(
+        specs,
+        stages=args.stages,
+        repeats=args.repeats,
+        measure_memory=not args.no_memory,
+        data_dir=args.data_dir,
+        progress=progress,
+    )
+    print(render_results(report))
+    if args.out:
+        args.out.parent.mkdir(parents=True, exist_ok=True)
+        args.out.write_text(json.dumps(report, indent=2))
+    if baseline is not None:
+        regressions = compare(report, baseline, args.tolerance, args.min_delta_ms / 1e3)
+        if baseline.get("meta", {}).get("machine") != report["meta"]["machine"]:
+            print("Warning: the baseline was recorded on a different machine", file=sys.stderr)
+        if regressions:
+            print(render_regressions(regressions))
+            return 1
+        print(
+            f"No regressions against {args.baseline} "
+            f"(tolerance {args.tolerance:.0%}, at least {args.min_delta_ms:g}ms)"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
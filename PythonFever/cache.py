@@ -0,0 +1,394 @@
+"""
+On-disk cache of day summaries keyed by the readings they were built from.
+
+Every (station, day) group of readings is fingerprinted from its columns in
+feed order; a rerun looks the fingerprints up and only aggregates the groups
+it has not seen before, so appending today's readings to a long history
+recomputes today alone. Fingerprints are hashed batch by batch, so a stream
+is fingerprinted in the same pass that feeds everything else. Weekly and
+monthly rollups are rebuilt from the day summaries as usual.
+
+The cache is a single file of fixed-size records that is rewritten
+atomically on ``save``. Each record remembers the run that last used it, and
+the least recently used records are evicted once the file would outgrow
+``max_bytes``.
+"""
+import hashlib
+import os
+import struct
+from array import array
+from bisect import bisect_right
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+from aggregator import DayAccumulator, DaySummary, _aggregate_day_rows
+from model import BatchStream, Reading, ReadingBatch, as_batch, from_epoch_us, to_epoch_us
+from timebuckets import CALENDAR, DAY_US
+from vectorized import aggregate_day_vectorized
+
+if TYPE_CHECKING:
+    from timebuckets import StationZones
+
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+# Readings held back until their group's fingerprint is complete (about 24 bytes each).
+DEFAULT_PENDING_ROWS = 4_000_000
+CACHE_FILE = "days.bin"
+
+_MAGIC = b"PFDC"
+# Bump when the record layout, the fingerprint or the aggregation semantics change.
+_VERSION = 2
+_HEADER = struct.Struct("<4sIQ")
+# fingerprint, total_rain, avg_temp, count, min_temp, max_temp, max_rainfall,
+# max_rate, first/last observation (epoch us), generation of last use
+_RECORD = struct.Struct("<16sddqddddqqQ")
+
+DayKey = Tuple[str, Tuple[int, int, int]]
+_Values = Tuple[float, float, int, float, float, float, float, int, int]
+
+
+def default_cache_dir() -> Path:
+    """``$XDG_CACHE_HOME/pythonfever``, falling back to ``~/.cache/pythonfever``."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return Path(base) / "pythonfever"
+
+
+class SummaryCache:
+    """
+    Content-addressed store of ``DaySummary`` values.
+
+    ``get``/``put`` work on fingerprints from ``aggregate_day_cached``;
+    nothing touches the disk until ``save``. An unreadable or outdated cache
+    file is treated as empty.
+    """
+
+    def __init__(self, root: Path, *, max_bytes: int = DEFAULT_CACHE_BYTES) -> None:
+        if max_bytes < _HEADER.size + _RECORD.size:
+            raise ValueError("max_bytes is too small to hold a single cache entry")
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[bytes, List] = {}
+        self._generation = 0
+        self._dirty = False
+        self._load()
+
+    @property
+    def path(self) -> Path:
+        return self.root / CACHE_FILE
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _load(self) -> None:
+        try:
+            data = self.path.read_bytes()
+        except FileNotFoundError:
+            return
+        if len(data) < _HEADER.size:
+            return
+        magic, version, generation = _HEADER.unpack_from(data)
+        if magic != _MAGIC or version != _VERSION or (len(data) - _HEADER.size) % _RECORD.size:
+            return
+        self._generation = generation
+        self._entries = {
+            record[0]: list(record[1:]) for record in _RECORD.iter_unpack(memoryview(data)[_HEADER.size :])
+        }
+
+    def get(self, fingerprint: bytes) -> Optional[_Values]:
+        entry = self._entries.get(fingerprint)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if entry[-1] != self._generation + 1:
+            entry[-1] = self._generation + 1
+            self._dirty = True
+        return tuple(entry[:-1])
+
+    def put(self, fingerprint: bytes, values: _Values) -> None:
+        self._entries[fingerprint] = [*values, self._generation + 1]
+        self._dirty = True
+
+    def save(self) -> None:
+        """Write the cache back, evicting the least recently used entries beyond ``max_bytes``."""
+        if not self._dirty:
+            return
+        self._generation += 1
+        capacity = (self.max_bytes - _HEADER.size) // _RECORD.size
+        items = self._entries.items()
+        if len(self._entries) > capacity:
+            items = sorted(items, key=lambda item: item[1][-1], reverse=True)[:capacity]
+            self._entries = dict(items)
+            items = self._entries.items()
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(CACHE_FILE + ".tmp")
+        with tmp.open("wb") as handle:
+            handle.write(_HEADER.pack(_MAGIC, _VERSION, self._generation))
+            pack = _RECORD.pack
+            handle.write(b"".join(pack(fingerprint, *entry) for fingerprint, entry in items))
+        os.replace(tmp, self.path)
+        self._dirty = False
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._dirty = True
+
+
+def _summary_values(summary: DaySummary) -> _Values:
+    return (
+        summary.total_rain_mm,
+        summary.avg_temp_c,
+        summary.count,
+        summary.min_temp_c,
+        summary.max_temp_c,
+        summary.max_rainfall_mm,
+        summary.max_rain_rate_mm_per_hr,
+        to_epoch_us(summary.first_observation),
+        to_epoch_us(summary.last_observation),
+    )
+
+
+def _summary(station_id: str, date_key: Tuple[int, int, int], values: _Values) -> DaySummary:
+    total, avg, count, low, high, max_rain, max_rate, first_us, last_us = values
+    return DaySummary(
+        station_id=station_id,
+        date=datetime(*date_key, 0, 0, 0),
+        total_rain_mm=total,
+        avg_temp_c=avg,
+        count=count,
+        min_temp_c=low,
+        max_temp_c=high,
+        max_rainfall_mm=max_rain,
+        max_rain_rate_mm_per_hr=max_rate,
+        first_observation=from_epoch_us(first_us),
+        last_observation=from_epoch_us(last_us),
+    )
+
+
+# Typecodes of the four ReadingBatch columns, in ``_columns`` order.
+_TYPECODES = ("I", "q", "d", "d")
+
+
+def _columns(batch: ReadingBatch) -> Tuple[Sequence[int], Sequence[int], Sequence[float], Sequence[float]]:
+    return batch.station_codes, batch.epoch_us, batch.temperature_c, batch.rainfall_mm
+
+
+def _grouped(
+    batch: ReadingBatch, zones: Optional["StationZones"] = None
+) -> Tuple[ReadingBatch, List[Tuple[str, int, int, int]]]:
+    """
+    Reorder ``batch`` so every (station, day) group is contiguous.
+
+    Returns the reordered batch and ``(station_id, day, start, stop)`` per
+    group in first-arrival order, ``day`` counting (local, with ``zones``)
+    days since the epoch. The sort is stable, so readings keep their feed
+    order within a group.
+    """
+    if zones is not None and zones.is_utc:
+        zones = None
+    if np is not None:
+        return _grouped_numpy(batch, zones)
+    if zones is None:
+        days = array("q", map(DAY_US.__rfloordiv__, batch.epoch_us))
+    else:
+        local_day, stations = zones.local_day, batch.stations
+        days = array("q", (local_day(stations[code], us) for code, us in zip(batch.station_codes, batch.epoch_us)))
+    day_min = min(days)
+    span = max(days) - day_min + 1
+    keys = [code * span + day - day_min for code, day in zip(batch.station_codes, days)]
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    if order != list(range(len(order))):
+        batch = batch.with_columns(
+            *(
+                array(typecode, map(column.__getitem__, order))
+                for typecode, column in zip(_TYPECODES, _columns(batch))
+            )
+        )
+        keys = list(map(keys.__getitem__, order))
+    groups = []
+    start = 0
+    while start < len(keys):
+        stop = bisect_right(keys, keys[start], start)
+        groups.append((order[start], start, stop))
+        start = stop
+    groups.sort()
+    stations = batch.stations
+    return batch, [
+        (stations[keys[start] // span], keys[start] % span + day_min, start, stop) for _, start, stop in groups
+    ]
+
+
+def _grouped_numpy(
+    batch: ReadingBatch, zones: Optional["StationZones"]
+) -> Tuple[ReadingBatch, List[Tuple[str, int, int, int]]]:
+    codes = np.frombuffer(batch.station_codes, dtype=np.uint32).astype(np.int64)
+    epoch_us = np.frombuffer(batch.epoch_us, dtype=np.int64)
+    day = epoch_us // DAY_US if zones is None else zones.local_days(batch.stations, codes, epoch_us)
+    day_min = int(day.min())
+    span = int(day.max()) - day_min + 1
+    key = codes * span + (day - day_min)
+    order = np.argsort(key, kind="stable")
+    if (order[1:] < order[:-1]).any():
+        batch = batch.with_columns(
+            *(
+                array(typecode, np.frombuffer(column, dtype=typecode)[order].tobytes())
+                for typecode, column in zip(_TYPECODES, _columns(batch))
+            )
+        )
+        key = key[order]
+    starts = np.flatnonzero(np.concatenate(([True], key[1:] != key[:-1])))
+    stops = np.append(starts[1:], len(key))
+    first_arrival = np.argsort(order[starts], kind="stable")
+    stations = batch.stations
+    return batch, [
+        (stations[group_key // span], group_key % span + day_min, start, stop)
+        for group_key, start, stop in zip(
+            key[starts][first_arrival].tolist(), starts[first_arrival].tolist(), stops[first_arrival].tolist()
+        )
+    ]
+
+
+class _PendingDay:
+    # One (station, day) group seen so far: running hashes of its columns,
+    # the readings not aggregated yet and, once those were spilled, the
+    # accumulator holding the earlier ones.
+    __slots__ = ("station_id", "day", "hashes", "columns", "partial")
+
+    def __init__(self, station_id: str, day: int) -> None:
+        self.station_id = station_id
+        self.day = day
+        self.hashes = [hashlib.blake2b(digest_size=16, person=b"pythonfever-col") for _ in range(3)]
+        self.columns = (array("q"), array("d"), array("d"))
+        self.partial: Optional[DayAccumulator] = None
+
+    def fingerprint(self) -> bytes:
+        digest = hashlib.blake2b(digest_size=16, person=b"pythonfever-day")
+        digest.update(struct.pack("<Iq", _VERSION, self.day))
+        digest.update(self.station_id.encode("utf-8"))
+        digest.update(b"\0")
+        for column in self.hashes:
+            digest.update(column.digest())
+        return digest.digest()
+
+    def accumulate(self) -> DayAccumulator:
+        """Add the pending readings to ``partial`` (in feed order) and return it."""
+        acc = self.partial
+        if acc is None:
+            acc = self.partial = DayAccumulator(self.station_id, CALENDAR.date_key(self.day))
+        add = acc.add
+        for epoch_us, temperature_c, rainfall_mm in zip(*self.columns):
+            add(from_epoch_us(epoch_us), temperature_c, rainfall_mm)
+        self.columns = (array("q"), array("d"), array("d"))
+        return acc
+
+
+class CachedDayAggregator:
+    """
+    ``aggregate_day_cached`` over batches added one at a time.
+
+    ``add`` extends the column hashes of every (station, day) group in the
+    batch and holds its readings back; ``finish`` looks the completed
+    fingerprints up and aggregates only the groups the cache does not know.
+    Beyond ``max_pending_rows`` held-back readings, they are aggregated right
+    away instead, which bounds memory at the price of re-aggregating some
+    days that turn out to be cached.
+    """
+
+    def __init__(
+        self,
+        cache: SummaryCache,
+        *,
+        engine: str = "python",
+        zones: Optional["StationZones"] = None,
+        max_pending_rows: int = DEFAULT_PENDING_ROWS,
+    ) -> None:
+        self.cache = cache
+        self.engine = engine
+        self.zones = None if zones is None or zones.is_utc else zones
+        self.max_pending_rows = max_pending_rows
+        self._days: Dict[Tuple[str, int], _PendingDay] = {}
+        self._pending = 0
+
+    def add(self, batch: ReadingBatch) -> None:
+        if not len(batch):
+            return
+        grouped, groups = _grouped(batch, self.zones)
+        views = [memoryview(column) for column in (grouped.epoch_us, grouped.temperature_c, grouped.rainfall_mm)]
+        days = self._days
+        for station_id, day, start, stop in groups:
+            state = days.get((station_id, day))
+            if state is None:
+                state = days[(station_id, day)] = _PendingDay(station_id, day)
+            for digest, pending, view in zip(state.hashes, state.columns, views):
+                part = view[start:stop].cast("B")
+                digest.update(part)
+                pending.frombytes(part)
+            self._pending += stop - start
+        if self._pending > self.max_pending_rows:
+            for state in days.values():
+                if state.columns[0]:
+                    state.accumulate()
+            self._pending = 0
+
+    def finish(self) -> Dict[DayKey, DaySummary]:
+        """Return the day summaries in first-arrival order, updating the cache with new ones."""
+        out: Dict[DayKey, Optional[DaySummary]] = {}
+        misses: List[Tuple[DayKey, bytes, _PendingDay]] = []
+        for state in self._days.values():
+            key = (state.station_id, CALENDAR.date_key(state.day))
+            fingerprint = state.fingerprint()
+            values = self.cache.get(fingerprint)
+            if values is None:
+                # Placeholder keeps the first-arrival order of the result.
+                out[key] = None
+                misses.append((key, fingerprint, state))
+            else:
+                out[key] = _summary(state.station_id, key[1], values)
+        fresh = self._aggregate([state for _, _, state in misses if state.partial is None])
+        for key, fingerprint, state in misses:
+            summary = fresh[key] if state.partial is None else state.accumulate().to_summary()
+            out[key] = summary
+            self.cache.put(fingerprint, _summary_values(summary))
+        self._days = {}
+        self._pending = 0
+        return out
+
+    def _aggregate(self, states: List[_PendingDay]) -> Dict[DayKey, DaySummary]:
+        if not states:
+            return {}
+        subset = ReadingBatch()
+        for state in states:
+            subset.station_codes.extend([subset.station_code(state.station_id)] * len(state.columns[0]))
+            for column, pending in zip((subset.epoch_us, subset.temperature_c, subset.rainfall_mm), state.columns):
+                column.extend(pending)
+        if self.engine == "numpy":
+            return aggregate_day_vectorized(subset, self.zones)
+        return _aggregate_day_rows(subset.rows(), self.zones)
+
+
+def aggregate_day_cached(
+    readings: Iterable[Reading],
+    cache: SummaryCache,
+    *,
+    engine: str = "python",
+    zones: Optional["StationZones"] = None,
+) -> Dict[DayKey, DaySummary]:
+    """
+    ``aggregate_day`` that reuses cached summaries for unchanged (station, day) groups.
+
+    Only the groups missing from ``cache`` are aggregated (with the numpy
+    engine if requested) and added to it. A ``BatchStream`` is read batch by
+    batch (see ``CachedDayAggregator``). The result lists days in
+    first-arrival order, like ``aggregate_day``.
+    """
+    aggregator = CachedDayAggregator(cache, engine=engine, zones=zones)
+    for batch in readings.batches() if isinstance(readings, BatchStream) else [as_batch(readings)]:
+        aggregator.add(batch)
+    return aggregator.finish()
@@ -0,0 +1,117 @@
+"""
+Background export of finished result sets.
+
+``ExportScheduler`` hands each write to a small thread pool so rendering and
+further analysis carry on while files are formatted, compressed and flushed.
+Compression follows the file suffix (see ``persistence``); durability follows
+the scheduler's fsync policy.
+"""
+import os
+import time
+from concurrent import futures
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, List
+
+FSYNC_POLICIES = ("none", "file", "full")
+
+
+@dataclass
+class ExportReport:
+    path: Path
+    bytes: int
+    write_seconds: float
+    fsync_seconds: float
+
+
+def _fsync_file(path: Path) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_dir(path: Path) -> None:
+    # Directories cannot be opened for fsync on every platform (e.g. Windows).
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _size(path: Path) -> int:
+    if path.is_dir():
+        return sum(child.stat().st_size for child in path.iterdir() if child.is_file())
+    return path.stat().st_size
+
+
+class ExportScheduler:
+    """
+    Run ``writer(path, items)`` calls on background threads.
+
+    ``fsync`` is one of ``FSYNC_POLICIES``: ``"none"`` leaves flushing to the
+    OS, ``"file"`` fsyncs every written file (or every file of a written
+    directory) and ``"full"`` also fsyncs the containing directory so newly
+    created entries survive a crash. ``wait`` blocks until all writes are done
+    and returns one ``ExportReport`` per write in submission order.
+    """
+
+    def __init__(self, workers: int = 2, *, fsync: str = "none") -> None:
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy '{fsync}'")
+        self.fsync = fsync
+        self._pool = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="export")
+        self._pending: List[Future] = []
+
+    def _run(self, writer: Callable[[Path, Any], Path], path: Path, items: Any) -> ExportReport:
+        started = time.perf_counter()
+        target = Path(writer(path, items) or path)
+        written = time.perf_counter()
+        if self.fsync != "none":
+            files = [child for child in target.iterdir() if child.is_file()] if target.is_dir() else [target]
+            for file in files:
+                _fsync_file(file)
+            if target.is_dir():
+                _fsync_dir(target)
+            if self.fsync == "full":
+                _fsync_dir(target.parent)
+        return ExportReport(
+            path=target,
+            bytes=_size(target),
+            write_seconds=written - started,
+            fsync_seconds=time.perf_counter() - written,
+        )
+
+    def submit(self, writer: Callable[[Path, Any], Path], path: Path, items: Any) -> "Future[ExportReport]":
+        """
+        Schedule ``writer(path, items)``.
+
+        ``items`` is consumed on a worker thread, so it must not be mutated
+        after submission.
+        """
+        future = self._pool.submit(self._run, writer, Path(path), items)
+        self._pending.append(future)
+        return future
+
+    def wait(self) -> List[ExportReport]:
+        """Wait for every scheduled write, then re-raise the first failure if any."""
+        pending, self._pending = self._pending, []
+        futures.wait(pending)
+        return [future.result() for future in pending]
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=True)
+
+    def __enter__(self) -> "ExportScheduler":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
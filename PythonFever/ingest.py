@@ -0,0 +1,329 @@
+"""
+Chunked ingestion of logger dumps.
+
+CSV files need a header naming ``station_id``, ``ts`` (or ``timestamp``),
+``temperature_c`` and ``rainfall_mm``; NDJSON files hold one object per line
+with the same keys. Either may be gzip-compressed (``.gz``). Readings are
+produced as ``ReadingBatch`` chunks, so an input is never materialized as a
+list of ``Reading`` objects.
+"""
+import csv
+import glob
+import gzip
+import json
+import os
+import sys
+from array import array
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime, timedelta
+from itertools import groupby, islice
+from operator import itemgetter
+from pathlib import Path
+from typing import IO, Callable, Deque, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from model import EPOCH, BatchStream, ReadingBatch, to_epoch_us
+
+DEFAULT_CHUNK_ROWS = 65_536
+# Uncompressed files are split into byte ranges of about this size for workers.
+RANGE_BYTES = 16 * 1024 * 1024
+
+_ONE_US = timedelta(microseconds=1)
+
+_CSV_FIELDS = ("station_id", "ts", "temperature_c", "rainfall_mm")
+_NDJSON_SUFFIXES = {".ndjson", ".jsonl", ".json"}
+_get_station = itemgetter("station_id")
+_get_ts = itemgetter("ts")
+_get_timestamp = itemgetter("timestamp")
+_get_temperature = itemgetter("temperature_c")
+_get_rainfall = itemgetter("rainfall_mm")
+
+Columns = Tuple[int, int, int, int]
+ErrorHandler = Callable[[str, Exception], None]
+
+# Column order of CSV lines on the wire, which carry no header.
+WIRE_COLUMNS: Columns = (0, 1, 2, 3)
+
+
+def parse_epoch_us(text: str) -> int:
+    """Parse one ISO-8601 timestamp into epoch microseconds (naive means UTC)."""
+    if text.endswith("Z"):
+        text = text[:-1] + "+00:00"
+    return to_epoch_us(datetime.fromisoformat(text))
+
+
+def _epoch_column(stamps: Sequence[str]) -> array:
+    try:
+        # Naive timestamps convert without leaving C: parse, subtract the epoch,
+        # floor-divide by one microsecond.
+        return array("q", map(_ONE_US.__rfloordiv__, map(EPOCH.__rsub__, map(datetime.fromisoformat, stamps))))
+    except (TypeError, ValueError):
+        # Offsets or "Z" suffixes somewhere in the chunk.
+        return array("q", map(parse_epoch_us, stamps))
+
+
+def _format(path: Path) -> str:
+    suffixes = [suffix.lower() for suffix in path.suffixes]
+    if suffixes and suffixes[-1] == ".gz":
+        suffixes.pop()
+    suffix = suffixes[-1] if suffixes else ""
+    if suffix == ".csv":
+        return "csv"
+    if suffix in _NDJSON_SUFFIXES:
+        return "ndjson"
+    raise ValueError(f"Cannot tell the format of {path}; expected .csv or .ndjson (optionally .gz)")
+
+
+def _compressed(path: Path) -> bool:
+    return path.suffix.lower() == ".gz"
+
+
+def _open_text(path: Path) -> IO[str]:
+    if _compressed(path):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return path.open("r", encoding="utf-8", newline="")
+
+
+def _csv_columns(header: str, source: Path) -> Columns:
+    names = [name.strip().lower() for name in next(csv.reader([header]), [])]
+    if "ts" not in names and "timestamp" in names:
+        names[names.index("timestamp")] = "ts"
+    missing = [field for field in _CSV_FIELDS if field not in names]
+    if missing:
+        raise ValueError(f"{source}: CSV header is missing {', '.join(missing)}")
+    station, ts, temperature, rainfall = (names.index(field) for field in _CSV_FIELDS)
+    return station, ts, temperature, rainfall
+
+
+def _batch_from_columns(
+    stations: Sequence[object], stamps: Sequence[str], temperatures: Sequence[object], rainfalls: Sequence[object]
+) -> ReadingBatch:
+    batch = ReadingBatch()
+    # Station ids are interned once per chunk, not once per reading.
+    codes = {station_id: batch.station_code(sys.intern(str(station_id))) for station_id in dict.fromkeys(stations)}
+    batch.station_codes = array("I", map(codes.__getitem__, stations))
+    batch.epoch_us = _epoch_column(stamps)
+    batch.temperature_c = array("d", map(float, temperatures))
+    batch.rainfall_mm = array("d", map(float, rainfalls))
+    return batch
+
+
+def _parse_chunk(lines: List[str], fmt: str, columns: Optional[Columns]) -> ReadingBatch:
+    """Parse a chunk column by column; raises on anything unusual."""
+    if fmt == "csv":
+        if '"' in "".join(lines):
+            raise ValueError("quoted fields")
+        rows = [line.split(",") for line in lines]
+        if len(set(map(len, rows))) != 1:
+            raise ValueError("ragged or blank lines")
+        fields = list(zip(*rows))
+        station_col, ts_col, temperature_col, rainfall_col = (fields[index] for index in columns)
+        if columns[0] == len(fields) - 1:
+            station_col = [value.rstrip("\r\n") for value in station_col]
+        if columns[1] == len(fields) - 1:
+            ts_col = [value.rstrip("\r\n") for value in ts_col]
+        return _batch_from_columns(station_col, ts_col, temperature_col, rainfall_col)
+    records = json.loads("[" + ",".join(lines) + "]")
+    try:
+        stamps = list(map(_get_ts, records))
+    except KeyError:
+        stamps = list(map(_get_timestamp, records))
+    return _batch_from_columns(
+        list(map(_get_station, records)),
+        stamps,
+        list(map(_get_temperature, records)),
+        list(map(_get_rainfall, records)),
+    )
+
+
+def _parse_rows(
+    lines: Iterable[str],
+    fmt: str,
+    columns: Optional[Columns],
+    source: object,
+    on_error: Optional[ErrorHandler] = None,
+) -> ReadingBatch:
+    """Parse line by line, skipping blank lines and naming the first bad one (or reporting each to ``on_error``)."""
+    batch = ReadingBatch()
+    append = batch.append_values
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            if fmt == "csv":
+                fields = next(csv.reader([line]))
+                station_id = fields[columns[0]]
+                ts = fields[columns[1]]
+                temperature_c = fields[columns[2]]
+                rainfall_mm = fields[columns[3]]
+            else:
+                record = json.loads(line)
+                station_id = record["station_id"]
+                ts = record["ts"] if "ts" in record else record["timestamp"]
+                temperature_c = record["temperature_c"]
+                rainfall_mm = record["rainfall_mm"]
+            append(sys.intern(str(station_id)), parse_epoch_us(ts), float(temperature_c), float(rainfall_mm))
+        except (KeyError, IndexError, TypeError, ValueError) as exc:
+            if on_error is None:
+                raise ValueError(f"{source}: cannot parse {line[:80]!r}: {exc}") from exc
+            on_error(line, exc)
+    return batch
+
+
+def _parse_lines(
+    lines: List[str],
+    fmt: str,
+    columns: Optional[Columns],
+    source: object,
+    on_error: Optional[ErrorHandler] = None,
+) -> ReadingBatch:
+    try:
+        return _parse_chunk(lines, fmt, columns)
+    except (KeyError, IndexError, TypeError, ValueError):
+        return _parse_rows(lines, fmt, columns, source, on_error)
+
+
+def parse_lines(lines: List[str], *, on_error: Optional[ErrorHandler] = None) -> ReadingBatch:
+    """
+    Parse wire-format readings into one batch.
+
+    Each line is either CSV in ``station_id,ts,temperature_c,rainfall_mm``
+    order or an NDJSON object, told apart by a leading ``{``. Bad lines raise
+    ``ValueError`` unless ``on_error`` is given, in which case they are
+    handed to it and skipped.
+    """
+    parts = [
+        _parse_lines(list(group), "ndjson" if is_json else "csv", WIRE_COLUMNS, "wire", on_error)
+        for is_json, group in groupby(lines, key=lambda line: line[:1] == "{")
+    ]
+    if len(parts) == 1:
+        return parts[0]
+    return BatchStream(lambda: parts).to_batch()
+
+
+def _iter_file(path: Path, chunk_rows: int) -> Iterator[ReadingBatch]:
+    fmt = _format(path)
+    with _open_text(path) as handle:
+        columns = _csv_columns(handle.readline(), path) if fmt == "csv" else None
+        while True:
+            lines = list(islice(handle, chunk_rows))
+            if not lines:
+                return
+            batch = _parse_lines(lines, fmt, columns, path)
+            if len(batch):
+                yield batch
+
+
+def _iter_range(
+    path: Path, fmt: str, columns: Optional[Columns], start: int, stop: int, chunk_rows: int
+) -> Iterator[ReadingBatch]:
+    """Parse the lines of ``path`` whose first byte lies in ``[start, stop)``."""
+    with path.open("rb") as handle:
+        if start:
+            # Finish the line straddling ``start``; it belongs to the previous range.
+            handle.seek(start - 1)
+            position = start - 1 + len(handle.readline())
+        else:
+            position = 0
+        lines: List[str] = []
+        while position < stop:
+            raw = handle.readline()
+            if not raw:
+                break
+            position += len(raw)
+            lines.append(raw.decode("utf-8"))
+            if len(lines) >= chunk_rows:
+                yield _parse_lines(lines, fmt, columns, path)
+                lines = []
+        if lines:
+            yield _parse_lines(lines, fmt, columns, path)
+
+
+def _parse_unit(
+    path: Path, start: Optional[int], stop: int, columns: Optional[Columns], chunk_rows: int
+) -> List[ReadingBatch]:
+    if start is None:
+        return list(_iter_file(path, chunk_rows))
+    return [batch for batch in _iter_range(path, _format(path), columns, start, stop, chunk_rows) if len(batch)]
+
+
+def _units(
+    paths: Sequence[Path], chunk_rows: int
+) -> Iterator[Tuple[Path, Optional[int], int, Optional[Columns], int]]:
+    for path in paths:
+        fmt = _format(path)
+        if _compressed(path):
+            # gzip streams cannot be split, so a compressed file is one unit.
+            yield path, None, 0, None, chunk_rows
+            continue
+        size = os.path.getsize(path)
+        start = 0
+        columns = None
+        if fmt == "csv":
+            with path.open("rb") as handle:
+                header = handle.readline()
+            start = len(header)
+            columns = _csv_columns(header.decode("utf-8"), path)
+        while start < size:
+            stop = min(start + RANGE_BYTES, size)
+            yield path, start, stop, columns, chunk_rows
+            start = stop
+
+
+def expand_inputs(patterns: Iterable[str]) -> List[Path]:
+    """Resolve file names and glob patterns (``*``, ``?``, ``[...]``, ``**``) to files."""
+    paths: List[Path] = []
+    for pattern in patterns:
+        pattern = str(pattern)
+        if glob.has_magic(pattern):
+            matches = sorted(glob.glob(pattern, recursive=True))
+            if not matches:
+                raise FileNotFoundError(f"No input files match {pattern!r}")
+            paths.extend(Path(match) for match in matches if os.path.isfile(match))
+        elif os.path.isfile(pattern):
+            paths.append(Path(pattern))
+        else:
+            raise FileNotFoundError(f"Input file {pattern!r} does not exist")
+    return paths
+
+
+def iter_reading_batches(
+    paths: Iterable[Path],
+    *,
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+    workers: int = 1,
+) -> Iterator[ReadingBatch]:
+    """
+    Yield readings from ``paths`` as batches of at most ``chunk_rows`` readings.
+
+    Batches come out in file order. With ``workers > 1`` files (and byte
+    ranges of large uncompressed files) are parsed in a process pool, with
+    only a couple of units per worker in flight at a time.
+    """
+    if chunk_rows < 1:
+        raise ValueError("chunk_rows must be positive")
+    paths = list(paths)
+    if workers <= 1:
+        for path in paths:
+            yield from _iter_file(path, chunk_rows)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending: Deque[Future] = deque()
+        for unit in _units(paths, chunk_rows):
+            pending.append(pool.submit(_parse_unit, *unit))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def open_readings(
+    patterns: Iterable[str],
+    *,
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+    workers: int = 1,
+) -> BatchStream:
+    """Return a re-iterable stream over the readings in the files matching ``patterns``."""
+    paths = expand_inputs(patterns)
+    return BatchStream(lambda: iter_reading_batches(paths, chunk_rows=chunk_rows, workers=workers))
@@ -0,0 +1,251 @@
+"""
+Per-stage instrumentation hooks.
+
+``Instrumentation.stage`` wraps one step of a run (loading readings,
+aggregating, rendering, exporting, ...) and measures its wall and CPU time,
+optionally its tracemalloc peak, and whatever reading/item counts the caller
+records. Finished ``StageMetrics`` are handed to every attached
+``StageCollector``; subclass it to ship metrics elsewhere. The collectors
+here keep the metrics for a JSON report or profile each stage with cProfile
+or a stack sampler and dump the hottest one.
+
+CPU time is the whole process's, so it includes background export threads;
+work done in worker processes is not seen at all.
+"""
+import cProfile
+import json
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from types import FrameType
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+PROFILERS = ("cprofile", "sample")
+
+
+@dataclass
+class StageMetrics:
+    name: str
+    readings: int = 0
+    items: int = 0
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    # Allocated on top of what was live when the stage started; None when memory is not traced.
+    peak_bytes: Optional[int] = None
+
+    @property
+    def readings_per_s(self) -> float:
+        return self.readings / self.wall_seconds if self.wall_seconds > 0 else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data["readings_per_s"] = self.readings_per_s
+        return data
+
+
+class StageCollector:
+    """Hooks called around every stage; the defaults do nothing."""
+
+    def stage_started(self, name: str) -> None:
+        pass
+
+    def stage_finished(self, metrics: StageMetrics) -> None:
+        pass
+
+
+class MetricsRecorder(StageCollector):
+    """Keep the metrics of every finished stage, in order."""
+
+    def __init__(self) -> None:
+        self.stages: List[StageMetrics] = []
+
+    def stage_finished(self, metrics: StageMetrics) -> None:
+        self.stages.append(metrics)
+
+    def write_json(self, path: Path, **meta: Any) -> None:
+        """Write ``{"meta": ..., "stages": [...]}`` to ``path``."""
+        report = {"meta": meta, "stages": [metrics.to_dict() for metrics in self.stages]}
+        Path(path).write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+
+
+class _HottestStage(StageCollector):
+    # Profiles every stage and keeps the profile of the slowest one.
+
+    def __init__(self) -> None:
+        self.hottest: Optional[StageMetrics] = None
+        self._profile: Any = None
+        self._hottest_profile: Any = None
+
+    def _start(self) -> Any:
+        raise NotImplementedError
+
+    def _stop(self, profile: Any) -> None:
+        raise NotImplementedError
+
+    def stage_started(self, name: str) -> None:
+        self._profile = self._start()
+
+    def stage_finished(self, metrics: StageMetrics) -> None:
+        if self._profile is None:
+            # Recorded rather than run as a stage, so there is nothing to keep.
+            return
+        self._stop(self._profile)
+        if self.hottest is None or metrics.wall_seconds > self.hottest.wall_seconds:
+            self.hottest = metrics
+            self._hottest_profile = self._profile
+        self._profile = None
+
+
+class CProfileCollector(_HottestStage):
+    """Run each stage under cProfile; ``dump`` writes the hottest stage's stats for ``pstats``."""
+
+    def _start(self) -> cProfile.Profile:
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def _stop(self, profile: cProfile.Profile) -> None:
+        profile.disable()
+
+    def dump(self, path: Path) -> Optional[StageMetrics]:
+        if self.hottest is None:
+            return None
+        self._hottest_profile.dump_stats(str(path))
+        return self.hottest
+
+
+class _Sampler:
+    def __init__(self, thread_id: int, interval: float) -> None:
+        self.stacks: Counter = Counter()
+        self._thread_id = thread_id
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stage-sampler", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None:
+                self.stacks[_collapse(frame)] += 1
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def _collapse(frame: Optional[FrameType]) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingCollector(_HottestStage):
+    """
+    Sample the stack of the thread running each stage every ``interval`` seconds.
+
+    Much cheaper than cProfile on hot loops. The sampler needs the GIL, so it
+    cannot sample more often than the interpreter's switch interval, which is
+    the default ``interval``. ``dump`` writes the hottest stage's samples in
+    collapsed-stack form (``frame;frame;frame count``), which flame graph
+    tools read directly.
+    """
+
+    def __init__(self, interval: Optional[float] = None) -> None:
+        if interval is None:
+            interval = sys.getswitchinterval()
+        if interval <= 0:
+            raise ValueError("interval must be positive")
+        super().__init__()
+        self.interval = interval
+
+    def _start(self) -> _Sampler:
+        return _Sampler(threading.get_ident(), self.interval)
+
+    def _stop(self, sampler: _Sampler) -> None:
+        sampler.stop()
+
+    def dump(self, path: Path) -> Optional[StageMetrics]:
+        if self.hottest is None:
+            return None
+        lines = [f"{stack} {count}\n" for stack, count in self._hottest_profile.stacks.most_common()]
+        Path(path).write_text("".join(lines), encoding="utf-8")
+        return self.hottest
+
+
+class Instrumentation:
+    """
+    Measure stages of a run and report them to ``collectors``.
+
+    With ``trace_memory`` tracemalloc runs from the first stage until
+    ``close``, which slows allocation-heavy code down noticeably. Stages do
+    not nest.
+    """
+
+    def __init__(self, collectors: Iterable[StageCollector] = (), *, trace_memory: bool = False) -> None:
+        self.collectors = list(collectors)
+        self.trace_memory = trace_memory
+        self._active: Optional[str] = None
+        self._started_tracing = False
+
+    def add(self, collector: StageCollector) -> None:
+        self.collectors.append(collector)
+
+    @contextmanager
+    def stage(self, name: str, *, readings: int = 0) -> Iterator[StageMetrics]:
+        """
+        Measure the ``with`` block as stage ``name``.
+
+        The yielded ``StageMetrics`` is filled in when the block exits; set
+        its ``readings`` and ``items`` inside the block once they are known.
+        """
+        if self._active is not None:
+            raise ValueError(f"Stage '{name}' started inside stage '{self._active}'")
+        self._active = name
+        metrics = StageMetrics(name, readings=readings)
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        for collector in self.collectors:
+            collector.stage_started(name)
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        cpu_started = time.process_time()
+        started = time.perf_counter()
+        try:
+            yield metrics
+        finally:
+            metrics.wall_seconds = time.perf_counter() - started
+            metrics.cpu_seconds = time.process_time() - cpu_started
+            if self.trace_memory:
+                metrics.peak_bytes = max(tracemalloc.get_traced_memory()[1] - baseline, 0)
+            self._active = None
+            for collector in self.collectors:
+                collector.stage_finished(metrics)
+
+    def record(self, metrics: StageMetrics) -> None:
+        """
+        Report a stage measured elsewhere, e.g. one interleaved with another stage.
+
+        Its time is also part of the stage it ran within, and profiling
+        collectors have no profile of it.
+        """
+        if self._active is not None:
+            raise ValueError(f"Stage '{metrics.name}' recorded inside stage '{self._active}'")
+        for collector in self.collectors:
+            collector.stage_finished(metrics)
+
+    def close(self) -> None:
+        """Stop tracemalloc if this instance started it."""
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
@@ -1,39 +1,86 @@
 import argparse
-from datetime import timedelta
+import asyncio
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
 from pathlib import Path
-from typing import Iterable, List, Optional, Sequence
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple, Union
 
 from aggregator import (
+    PLAN_ENGINES,
+    AggregationPlan,
     DaySummary,
     MonthSummary,
+    PlanResult,
     RainEvent,
     WeekSummary,
-    aggregate_day,
-    aggregate_month,
-    aggregate_week,
-    detect_heavy_rain_events,
 )
-from analytics import DrySpell, detect_dry_spells, rainfall_percentiles, top_wettest_days
-from model import Reading
+from alerts import AlertRule, load_alert_rules, parse_alert_rules
+from analytics import DrySpell, classify_day_severities, top_wettest_days
+from cache import DEFAULT_CACHE_BYTES, SummaryCache, default_cache_dir
+from export import FSYNC_POLICIES, ExportScheduler
+from ingest import DEFAULT_CHUNK_ROWS, open_readings
+from instrument import (
+    PROFILERS,
+    CProfileCollector,
+    Instrumentation,
+    MetricsRecorder,
+    SamplingCollector,
+    StageMetrics,
+)
+from model import BatchStream, ReadingBatch
+from pipeline import plan_pipeline
 from persistence import (
+    ReadingStore,
+    SummaryStore,
+    read_quantile_sketch,
     write_day_summary_csv,
+    write_day_summary_ndjson,
     write_dry_spells_csv,
+    write_dry_spells_ndjson,
     write_month_summary_csv,
+    write_month_summary_ndjson,
     write_percentiles_json,
+    write_quantile_sketch,
     write_rain_events_csv,
+    write_rain_events_ndjson,
+    write_summary_store,
     write_week_summary_json,
+    write_week_summary_ndjson,
+    write_window_summary_csv,
+    write_window_summary_ndjson,
+    zstd_available,
 )
 from reporter import (
+    REPORT_FORMATS,
+    ReportSink,
     rain_alert,
-    render,
-    render_detailed,
+    render_alerts,
+    render_days,
     render_dry_spells,
+    render_export_report,
     render_events,
     render_month,
     render_percentiles,
+    render_records,
+    render_stage_report,
+    render_week,
+    render_window_peaks,
+    render_windows,
     temperature_alert,
 )
-from sensor_stream import multi_station_cycle, rainfall_burst, rainfall_profile, with_noise
+from sensor_stream import (
+    multi_station_cycle_batches,
+    rainfall_burst_batches,
+    rainfall_profile_batches,
+    resolve_start,
+    with_noise_batches,
+)
+from server import ServerConfig, run_fake_stations, serve
+from timebuckets import StationZones
+from vectorized import numpy_available
+from windowing import WindowSpec, parse_duration
 
 
 def _parse_profile(profile_arg: Optional[str]) -> Optional[Sequence[float]]:
@@ -48,160 +95,443 @@ def _parse_percentiles(percentiles_arg: Optional[str]) -> Sequence[float]:
     return [float(chunk.strip()) for chunk in percentiles_arg.split(",") if chunk.strip()]
 
 
-def build_readings(args: argparse.Namespace) -> List[Reading]:
+def build_readings(args: argparse.Namespace) -> Union[ReadingBatch, BatchStream]:
+    if args.input:
+        return open_readings(args.input, chunk_rows=args.chunk_rows, workers=args.workers)
+    if args.input_store:
+        store = ReadingStore(args.input_store)
+        if args.store_stations is None and args.store_start is None and args.store_end is None:
+            return store.read()
+        # Only the runs of the selected stations and time range are read, station by station.
+        return BatchStream(lambda: store.scan(args.store_stations, args.store_start, args.store_end))
+    # Resolved once so every pass over the stream sees the same timestamps.
+    start = resolve_start(None)
     if args.scenario == "burst":
-        base: Iterable[Reading] = rainfall_burst(
-            station_id=args.station,
-            start=None,
-            increments=args.increments,
-            step=args.step,
+        stream = BatchStream(
+            lambda: rainfall_burst_batches(
+                station_id=args.station,
+                start=start,
+                increments=args.increments,
+                step=args.step,
+                chunk_rows=args.chunk_rows,
+            )
         )
     elif args.scenario == "profile":
-        base = rainfall_profile(
-            station_id=args.station,
-            start=None,
-            profile=_parse_profile(args.profile),
-            interval_minutes=args.interval,
-            base_temp_c=args.base_temp,
-            temp_variation_c=args.temp_variation,
+        profile = _parse_profile(args.profile)
+        stream = BatchStream(
+            lambda: rainfall_profile_batches(
+                station_id=args.station,
+                start=start,
+                profile=profile,
+                interval_minutes=args.interval,
+                base_temp_c=args.base_temp,
+                temp_variation_c=args.temp_variation,
+                chunk_rows=args.chunk_rows,
+            )
         )
     elif args.scenario == "cycle":
-        base = multi_station_cycle(
-            stations=args.stations,
-            start=None,
-            minutes=args.minutes,
-            base_temp_c=args.base_temp,
-            diurnal_amplitude_c=args.diurnal_amp,
-            rainfall_peak_mm=args.rainfall_peak,
+        stream = BatchStream(
+            lambda: multi_station_cycle_batches(
+                stations=args.stations,
+                start=start,
+                minutes=args.minutes,
+                base_temp_c=args.base_temp,
+                diurnal_amplitude_c=args.diurnal_amp,
+                rainfall_peak_mm=args.rainfall_peak,
+                chunk_rows=args.chunk_rows,
+            )
         )
     else:
         raise ValueError(f"Unknown scenario '{args.scenario}'")
 
     if args.add_noise:
-        base = with_noise(
-            base,
-            temperature_sigma=args.noise_temp,
-            rainfall_sigma=args.noise_rain,
-            seed=args.noise_seed,
+        # Noise is keyed by seed, station and timestamp, so re-reading the
+        # stream (or sharding it) reproduces it as long as the seed is fixed.
+        seed = random.getrandbits(64) if args.noise_seed is None else args.noise_seed
+        clean = stream
+        stream = BatchStream(
+            lambda: with_noise_batches(
+                clean.batches(),
+                temperature_sigma=args.noise_temp,
+                rainfall_sigma=args.noise_rain,
+                seed=seed,
+            )
         )
-
-    return list(base)
-
-
-def render_summaries(args: argparse.Namespace, summaries: List[DaySummary]) -> None:
-    limit = args.limit or len(summaries)
-    for summary in summaries[:limit]:
-        print(render_detailed(summary) if args.detailed else render(summary))
-        alerts = []
-        if rain_alert(summary, threshold_mm=args.threshold):
-            alerts.append("rain")
-        if temperature_alert(
-            summary,
-            low_threshold_c=args.temp_low,
-            high_threshold_c=args.temp_high,
-            inclusive=args.temp_inclusive,
-        ):
-            alerts.append("temperature")
-        if alerts:
-            print(f"  Alerts: {', '.join(alerts)}")
+    return stream
+
+
+_NDJSON_SUFFIXES = {".ndjson", ".jsonl"}
+
+
+def _export(
+    exports: ExportScheduler, path: Path, items: Iterable, writer: Callable, ndjson_writer: Callable
+) -> None:
+    """Schedule ``writer`` for ``items``, or ``ndjson_writer`` for .ndjson/.jsonl paths (optionally .gz/.zst)."""
+    suffixes = [suffix.lower() for suffix in path.suffixes]
+    if suffixes and suffixes[-1] in (".gz", ".zst"):
+        suffixes.pop()
+    ndjson = bool(suffixes) and suffixes[-1] in _NDJSON_SUFFIXES
+    exports.submit(ndjson_writer if ndjson else writer, path, items)
+
+
+def _day_alerts(args: argparse.Namespace, summary: DaySummary) -> List[str]:
+    alerts = []
+    if rain_alert(summary, threshold_mm=args.threshold):
+        alerts.append("rain")
+    if temperature_alert(
+        summary,
+        low_threshold_c=args.temp_low,
+        high_threshold_c=args.temp_high,
+        inclusive=args.temp_inclusive,
+    ):
+        alerts.append("temperature")
+    return alerts
+
+
+def render_summaries(args: argparse.Namespace, summaries: List[DaySummary], sink: ReportSink) -> int:
+    """Write day summaries with their alerts to ``sink``; returns how many were written."""
+    summaries = summaries[: args.limit or len(summaries)]
+    alerts = [_day_alerts(args, summary) for summary in summaries]
+    if args.format != "text":
+        severities = classify_day_severities(summaries)
+        sink.write_lines(render_records("day", summaries, args.format, severities, [",".join(a) for a in alerts]))
+        return len(summaries)
+    write = sink.write
+    for line, names in zip(render_days(summaries, detailed=args.detailed), alerts):
+        write(line)
+        if names:
+            write(f"  Alerts: {', '.join(names)}")
+    return len(summaries)
+
+
+def _use_percentile_sketch(args: argparse.Namespace) -> bool:
+    return bool(args.percentiles_sketch or args.percentiles_sketch_in or args.percentiles_sketch_out)
+
+
+def _parse_zones(specs: Optional[Sequence[str]]) -> Optional[StationZones]:
+    if not specs:
+        return None
+    try:
+        return StationZones.parse(specs)
+    except ValueError as exc:
+        raise SystemExit(f"--station-tz: {exc}")
+
+
+def _duration(text: str) -> timedelta:
+    try:
+        return parse_duration(text)
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(str(exc))
+
+
+def _window_specs(args: argparse.Namespace) -> Tuple[WindowSpec, ...]:
+    sizes = list(dict.fromkeys(args.window or ()))
+    try:
+        return tuple(WindowSpec(size, args.slide) for size in sizes)
+    except ValueError as exc:
+        raise SystemExit(f"--slide: {exc}")
+
+
+def _alert_rules(args: argparse.Namespace) -> Tuple[AlertRule, ...]:
+    try:
+        rules = parse_alert_rules(args.alert or ())
+        if args.alert_file:
+            rules.extend(load_alert_rules(args.alert_file))
+    except (OSError, ValueError) as exc:
+        raise SystemExit(f"--alert: {exc}")
+    return tuple(rules)
+
+
+def build_plan(args: argparse.Namespace) -> AggregationPlan:
+    outputs = {"day"}
+    if args.show_weekly or args.week_json or args.summary_store:
+        outputs.add("week")
+    if args.show_monthly or args.month_csv or args.summary_store:
+        outputs.add("month")
+    if args.percentiles or args.percentiles_json or args.percentiles_sketch_out:
+        outputs.add("percentiles")
+    if args.events or args.events_csv:
+        outputs.add("events")
+    if args.dry_spells or args.dry_csv:
+        outputs.add("dry_spells")
+    windows = _window_specs(args)
+    if windows:
+        outputs.add("windows")
+    alert_rules = _alert_rules(args)
+    if alert_rules:
+        outputs.add("alerts")
+    return AggregationPlan(
+        outputs=frozenset(outputs),
+        events_threshold_mm=args.events_threshold,
+        events_gap=timedelta(minutes=args.events_gap),
+        dry_threshold_mm=args.dry_threshold,
+        dry_min_duration=timedelta(hours=args.dry_min_hours),
+        dry_gap=timedelta(minutes=args.dry_gap),
+        percentiles=_parse_percentiles(args.percentiles_values),
+        engine=args.engine,
+        reorder_window=args.reorder_window,
+        percentile_error=args.percentiles_error if _use_percentile_sketch(args) else None,
+        zones=_parse_zones(args.station_tz),
+        windows=windows,
+        alert_rules=alert_rules,
+    )
 
 
-def run_demo(args: argparse.Namespace) -> None:
+def run_demo(
+    args: argparse.Namespace,
+    exports: ExportScheduler,
+    instruments: Optional[Instrumentation] = None,
+    sink: Optional[ReportSink] = None,
+) -> int:
+    """Analyze the readings selected by ``args``; returns how many readings were analyzed."""
+    instruments = instruments or Instrumentation()
+    sink = sink or ReportSink()
     readings = build_readings(args)
-    day_map = aggregate_day(readings)
-    day_summaries = sorted(day_map.values(), key=lambda s: (s.station_id, s.date))
+    pipeline = plan_pipeline(build_plan(args), workers=args.workers, cached=not args.no_cache, store=args.write_store)
+    if args.explain_plan:
+        print("Pipeline:", file=sys.stderr)
+        print(pipeline.explain(), file=sys.stderr)
+    # Streamed inputs and generated scenarios are produced during the pass, so
+    # the pipeline source measures them (items are batches).
+    produced = StageMetrics("readings")
+    with instruments.stage("aggregate") as stage:
+        cache = (
+            SummaryCache(args.cache_dir, max_bytes=int(args.cache_size_mb * 1024 * 1024)) if pipeline.cached else None
+        )
+        # One pass over the readings feeds every operator, the reading store included.
+        result = pipeline.run(readings, cache=cache, exports=exports, source_metrics=produced)
+        if cache is not None:
+            try:
+                cache.save()
+            except OSError as exc:
+                print(f"Warning: could not update the day summary cache: {exc}", file=sys.stderr)
+        day_summaries = sorted(result.days.values(), key=lambda s: (s.station_id, s.date))
+        total_readings = sum(summary.count for summary in day_summaries)
+        stage.readings = total_readings
+        stage.items = len(day_summaries) + sum(
+            len(outputs or ())
+            for outputs in (result.weeks, result.months, result.events, result.dry_spells, result.windows)
+        )
+    instruments.record(produced)
 
     if not day_summaries:
-        print("No readings generated.")
-        return
-
-    render_summaries(args, day_summaries)
-
-    if args.show_weekly or args.week_json:
-        weekly_map = aggregate_week(readings)
+        if args.format == "text":
+            sink.write("No readings generated.")
+        sink.flush()
+        return 0
+    with instruments.stage("render", readings=total_readings) as stage:
+        stage.items = _render_and_export(args, exports, result, day_summaries, sink)
+        sink.flush()
+    return total_readings
+
+
+def _render_and_export(
+    args: argparse.Namespace,
+    exports: ExportScheduler,
+    result: PlanResult,
+    day_summaries: List[DaySummary],
+    sink: ReportSink,
+) -> int:
+    """
+    Write the requested outputs to ``sink`` and schedule the requested exports.
+
+    Returns how many entries were written. The tsv and ndjson formats write
+    bare records, without headings or "none" notes.
+    """
+    if args.summary_store:
+        exports.submit(write_summary_store, args.summary_store, result)
+
+    fmt = args.format
+    text = fmt == "text"
+    write = sink.write
+    shown = render_summaries(args, day_summaries, sink)
+
+    if result.weeks is not None:
         weekly: List[WeekSummary] = sorted(
-            weekly_map.values(), key=lambda w: (w.station_id, w.iso_year, w.iso_week)
+            result.weeks.values(), key=lambda w: (w.station_id, w.iso_year, w.iso_week)
         )
         if args.show_weekly:
-            print("\nWeekly rollups:")
-            for summary in weekly:
-                print(
-                    f"[{summary.station_id}] ISO {summary.iso_year}-W{summary.iso_week:02d} | "
-                    f"rain={summary.total_rain_mm:.2f} mm | avgT={summary.avg_temp_c:.1f} °C | "
-                    f"days={summary.days} | maxDaily={summary.max_daily_rain_mm:.2f} mm"
-        )
+            if text:
+                write("\nWeekly rollups:")
+                sink.write_lines(map(render_week, weekly))
+            else:
+                sink.write_lines(render_records("week", weekly, fmt))
+            shown += len(weekly)
         if args.week_json:
-            write_week_summary_json(args.week_json, weekly)
+            _export(exports, args.week_json, weekly, write_week_summary_json, write_week_summary_ndjson)
 
-    if args.show_monthly or args.month_csv:
-        monthly_map = aggregate_month(readings)
+    if result.months is not None:
         monthly: List[MonthSummary] = sorted(
-            monthly_map.values(), key=lambda m: (m.station_id, m.year, m.month)
+            result.months.values(), key=lambda m: (m.station_id, m.year, m.month)
         )
         if args.show_monthly:
-            print("\nMonthly rollups:")
-            for summary in monthly:
-                print(render_month(summary))
+            if text:
+                write("\nMonthly rollups:")
+                sink.write_lines(map(render_month, monthly))
+            else:
+                sink.write_lines(render_records("month", monthly, fmt))
+            shown += len(monthly)
         if args.month_csv:
-            write_month_summary_csv(args.month_csv, monthly)
+            _export(exports, args.month_csv, monthly, write_month_summary_csv, write_month_summary_ndjson)
 
     if args.top_wet:
         top = top_wettest_days(day_summaries, limit=args.top_wet)
-        if top:
-            print(f"\nTop {len(top)} wettest days:")
-            for summary in top:
-                print(render(summary))
-
-    show_percentiles = args.percentiles or args.percentiles_json
-    if show_percentiles:
-        percentiles = rainfall_percentiles(
-            day_summaries, percentiles=_parse_percentiles(args.percentiles_values)
-        )
+        if top and text:
+            write(f"\nTop {len(top)} wettest days:")
+            sink.write_lines(render_days(top))
+        elif top:
+            sink.write_lines(render_records("top_wet", top, fmt, classify_day_severities(top)))
+        shown += len(top)
+
+    if result.percentiles is not None:
+        percentiles = result.percentiles
+        sketch = result.percentile_sketch
+        if sketch is not None and args.percentiles_sketch_in:
+            for path in args.percentiles_sketch_in:
+                sketch.merge(read_quantile_sketch(path))
+            percentiles = sketch.percentiles(_parse_percentiles(args.percentiles_values))
+        if sketch is not None and args.percentiles_sketch_out:
+            exports.submit(write_quantile_sketch, args.percentiles_sketch_out, sketch)
         if args.percentiles:
-            print("\nDaily rainfall percentiles:")
-            print(render_percentiles(percentiles))
+            if text:
+                write("\nDaily rainfall percentiles:")
+                write(render_percentiles(percentiles))
+            else:
+                sink.write_lines(render_records("percentile", sorted(percentiles.items()), fmt))
+            shown += len(percentiles)
         if args.percentiles_json:
-            write_percentiles_json(args.percentiles_json, percentiles)
-
-    events: List[RainEvent] = []
-    if args.events or args.events_csv:
-        events = detect_heavy_rain_events(
-            readings,
-            per_reading_threshold_mm=args.events_threshold,
-            max_gap=timedelta(minutes=args.events_gap),
-        )
-        if args.events and events:
-            print("\nHeavy rain events:")
-            print(render_events(events))
+            exports.submit(write_percentiles_json, args.percentiles_json, percentiles)
+
+    events: List[RainEvent] = result.events or []
+    if result.events is not None:
+        if args.events and not text:
+            sink.write_lines(render_records("event", events, fmt))
+            shown += len(events)
+        elif args.events and events:
+            write("\nHeavy rain events:")
+            write(render_events(events))
+            shown += len(events)
         elif args.events:
-            print("\nHeavy rain events: none detected")
+            write("\nHeavy rain events: none detected")
         if args.events_csv:
-            write_rain_events_csv(args.events_csv, events)
+            _export(exports, args.events_csv, events, write_rain_events_csv, write_rain_events_ndjson)
 
-    dry_spells: List[DrySpell] = []
-    if args.dry_spells or args.dry_csv:
-        dry_spells = detect_dry_spells(
-            readings,
-            dry_threshold_mm=args.dry_threshold,
-            min_duration=timedelta(hours=args.dry_min_hours),
-            max_gap=timedelta(minutes=args.dry_gap),
-        )
+    dry_spells: List[DrySpell] = result.dry_spells or []
+    if result.dry_spells is not None:
         if args.dry_spells:
-            if dry_spells:
-                print("\nDetected dry spells:")
-                print(render_dry_spells(dry_spells))
+            if not text:
+                sink.write_lines(render_records("dry_spell", dry_spells, fmt))
+                shown += len(dry_spells)
+            elif dry_spells:
+                write("\nDetected dry spells:")
+                write(render_dry_spells(dry_spells))
+                shown += len(dry_spells)
             else:
-                print("\nDetected dry spells: none")
+                write("\nDetected dry spells: none")
         if args.dry_csv:
-            write_dry_spells_csv(args.dry_csv, dry_spells)
+            _export(exports, args.dry_csv, dry_spells, write_dry_spells_csv, write_dry_spells_ndjson)
+
+    if result.windows is not None:
+        if not text:
+            sink.write_lines(render_records("window", result.windows, fmt))
+            sink.write_lines(render_records("window_peak", result.window_peaks, fmt))
+            shown += len(result.windows) + len(result.window_peaks)
+        else:
+            for spec in _window_specs(args):
+                windows = [window for window in result.windows if window.end - window.start == spec.size]
+                write(f"\nRainfall windows ({spec.label}):")
+                write(render_windows(windows))
+                shown += len(windows)
+            write("\nPeak rolling rainfall:")
+            write(render_window_peaks(result.window_peaks))
+            shown += len(result.window_peaks)
+        if args.window_csv:
+            _export(exports, args.window_csv, result.windows, write_window_summary_csv, write_window_summary_ndjson)
+
+    if result.alerts is not None:
+        if not text:
+            sink.write_lines(render_records("alert", result.alerts, fmt))
+            shown += len(result.alerts)
+        elif result.alerts:
+            write("\nStreaming alerts:")
+            write(render_alerts(result.alerts))
+            shown += len(result.alerts)
+        else:
+            write("\nStreaming alerts: none raised")
 
     if args.csv:
-        write_day_summary_csv(args.csv, day_summaries)
+        _export(exports, args.csv, day_summaries, write_day_summary_csv, write_day_summary_ndjson)
+    return shown
+
+
+def _add_alert_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--alert",
+        nargs="+",
+        metavar="RULE",
+        help="Evaluate [STATION:]METRIC OP THRESHOLD[~HYSTERESIS] on every reading, e.g. 'day_rain>=50', "
+        "'S1:rain_1h>=10~2' or 'temp<-5' (metrics: rain, temp, day_rain, rain_<duration>)",
+    )
+    parser.add_argument("--alert-file", type=Path, help="Read more --alert rules from a file, one per line")
 
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Synthetic rainfall analytics demo")
     parser.add_argument("--scenario", choices=["burst", "profile", "cycle"], default="burst")
+    parser.add_argument(
+        "--input",
+        nargs="+",
+        metavar="PATH",
+        help="Analyze CSV/NDJSON reading files (optionally .gz; glob patterns allowed) instead of a scenario",
+    )
+    parser.add_argument(
+        "--chunk-rows",
+        type=int,
+        default=DEFAULT_CHUNK_ROWS,
+        help="Readings per batch when streaming --input files or generating a scenario",
+    )
+    parser.add_argument(
+        "--input-store",
+        type=Path,
+        help="Analyze readings from a columnar reading store instead of generating a scenario",
+    )
+    parser.add_argument(
+        "--store-stations", nargs="+", metavar="STATION", help="Only read these stations from --input-store"
+    )
+    parser.add_argument(
+        "--store-start",
+        type=datetime.fromisoformat,
+        metavar="TIME",
+        help="Only read --input-store readings at or after this UTC time (ISO 8601)",
+    )
+    parser.add_argument(
+        "--store-end",
+        type=datetime.fromisoformat,
+        metavar="TIME",
+        help="Only read --input-store readings before this UTC time (ISO 8601)",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=default_cache_dir(),
+        help="Directory of the day summary cache that lets reruns skip unchanged days",
+    )
+    parser.add_argument(
+        "--cache-size-mb",
+        type=float,
+        default=DEFAULT_CACHE_BYTES / (1024 * 1024),
+        help="Evict the least recently used cached days beyond this size",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Aggregate every day from scratch and leave the cache alone"
+    )
+    parser.add_argument(
+        "--station-tz",
+        nargs="+",
+        metavar="[STATION=]ZONE",
+        help="Bucket days in local time: IANA zone names or UTC offsets (+05:30) per station; "
+        "a bare ZONE applies to all other stations",
+    )
     parser.add_argument("--station", default="S1", help="Station id for single-station scenarios")
     parser.add_argument(
         "--stations",
@@ -226,6 +556,19 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--noise-rain", type=float, default=0.05, help="Rainfall noise sigma")
     parser.add_argument("--noise-seed", type=int, help="Optional RNG seed for noise")
 
+    parser.add_argument(
+        "--engine",
+        choices=list(PLAN_ENGINES),
+        default="python",
+        help="Aggregation backend; 'numpy' uses the vectorized engine (requires NumPy)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Shard stations (and --input parsing) across N worker processes (1 runs in-process)",
+    )
+
     parser.add_argument("--threshold", type=float, default=10.0, help="Rain alert threshold")
     parser.add_argument("--temp-low", type=float, help="Low temperature alert threshold")
     parser.add_argument("--temp-high", type=float, help="High temperature alert threshold")
@@ -235,7 +578,15 @@ def parse_args() -> argparse.Namespace:
         help="Use inclusive comparisons when checking temperature thresholds",
     )
 
+    _add_alert_args(parser)
+
     parser.add_argument("--detailed", action="store_true", help="Render detailed day summaries")
+    parser.add_argument(
+        "--format",
+        choices=REPORT_FORMATS,
+        default="text",
+        help="Output format: text for people, or tsv/ndjson records for other tools (skips headings)",
+    )
     parser.add_argument("--limit", type=int, help="Only render the first N day summaries")
     parser.add_argument("--show-weekly", action="store_true", help="Display weekly rollups in stdout")
     parser.add_argument("--show-monthly", action="store_true", help="Display monthly rollups in stdout")
@@ -248,6 +599,34 @@ def parse_args() -> argparse.Namespace:
         "--percentiles-values",
         help="Comma separated percentile list (e.g. 50,90,99) used when displaying/writing percentiles",
     )
+    parser.add_argument(
+        "--reorder-window",
+        type=int,
+        default=8,
+        help="Per-station readings buffered to correct out-of-order timestamps before event/dry-spell detection",
+    )
+    parser.add_argument(
+        "--percentiles-sketch",
+        action="store_true",
+        help="Estimate percentiles with a fixed-memory, mergeable quantile sketch",
+    )
+    parser.add_argument(
+        "--percentiles-error",
+        type=float,
+        default=0.01,
+        help="Target rank error for sketch-backed percentiles",
+    )
+    parser.add_argument(
+        "--percentiles-sketch-in",
+        type=Path,
+        nargs="+",
+        help="Merge percentile sketches saved by earlier runs (implies --percentiles-sketch)",
+    )
+    parser.add_argument(
+        "--percentiles-sketch-out",
+        type=Path,
+        help="Path to write the percentile sketch for later merging (implies --percentiles-sketch)",
+    )
     parser.add_argument("--dry-spells", action="store_true", help="Display detected dry spells")
     parser.add_argument("--dry-threshold", type=float, default=0.05, help="Rainfall threshold (mm) to qualify as dry")
     parser.add_argument(
@@ -263,19 +642,262 @@ def parse_args() -> argparse.Namespace:
         help="Maximum allowed gap in minutes between dry readings before closing a spell",
     )
 
-    parser.add_argument("--csv", type=Path, help="Path to write daily summaries as CSV")
-    parser.add_argument("--week-json", type=Path, help="Path to write weekly summaries as JSON")
-    parser.add_argument("--events-csv", type=Path, help="Path to write detected events as CSV")
-    parser.add_argument("--month-csv", type=Path, help="Path to write monthly rollups as CSV")
-    parser.add_argument("--dry-csv", type=Path, help="Path to write dry spells as CSV")
+    parser.add_argument(
+        "--window",
+        nargs="+",
+        type=_duration,
+        metavar="DURATION",
+        help="Display rain accumulations per window (e.g. 15m 1h 24h) and each station's wettest rolling window",
+    )
+    parser.add_argument(
+        "--slide",
+        type=_duration,
+        metavar="DURATION",
+        help="Start a --window every DURATION (hopping windows); by default windows do not overlap",
+    )
+
+    parser.add_argument("--write-store", type=Path, help="Append the analyzed readings to a columnar reading store")
+    parser.add_argument(
+        "--summary-store",
+        type=Path,
+        help="Merge day/week/month summaries into an indexed summary store for 'main.py query'",
+    )
+    parser.add_argument("--csv", type=Path, help="Path to write daily summaries as CSV (NDJSON for .ndjson/.jsonl)")
+    parser.add_argument(
+        "--week-json", type=Path, help="Path to write weekly summaries as JSON (NDJSON for .ndjson/.jsonl)"
+    )
+    parser.add_argument(
+        "--events-csv", type=Path, help="Path to write detected events as CSV (NDJSON for .ndjson/.jsonl)"
+    )
+    parser.add_argument(
+        "--month-csv", type=Path, help="Path to write monthly rollups as CSV (NDJSON for .ndjson/.jsonl)"
+    )
+    parser.add_argument("--dry-csv", type=Path, help="Path to write dry spells as CSV (NDJSON for .ndjson/.jsonl)")
+    parser.add_argument(
+        "--window-csv", type=Path, help="Path to write --window summaries as CSV (NDJSON for .ndjson/.jsonl)"
+    )
     parser.add_argument("--percentiles-json", type=Path, help="Path to write rainfall percentiles as JSON")
+    parser.add_argument(
+        "--export-workers",
+        type=int,
+        default=2,
+        help="Background threads writing export files (.gz/.zst suffixes compress)",
+    )
+    parser.add_argument(
+        "--fsync",
+        choices=list(FSYNC_POLICIES),
+        default="none",
+        help="Durability of export files: none, file (fsync each file) or full (also fsync directories)",
+    )
+
+    parser.add_argument(
+        "--profile-stages",
+        action="store_true",
+        help="Report wall/CPU time, readings/s, items and memory peak per stage on stderr",
+    )
+    parser.add_argument(
+        "--explain-plan",
+        action="store_true",
+        help="Print the operators the requested outputs need, and which ones hold every reading, on stderr",
+    )
+    parser.add_argument("--metrics-json", type=Path, help="Write the per-stage metrics as JSON")
+    parser.add_argument(
+        "--profile-out",
+        type=Path,
+        help="Write a profile of the slowest stage here (pstats file, or collapsed stacks with --profiler sample)",
+    )
+    parser.add_argument(
+        "--profiler",
+        choices=list(PROFILERS),
+        default="cprofile",
+        help="Profiler behind --profile-out; 'sample' adds far less overhead than cProfile",
+    )
+    parser.add_argument(
+        "--no-trace-memory",
+        action="store_true",
+        help="Skip tracemalloc when profiling stages, which otherwise slows allocation-heavy stages down",
+    )
 
     return parser.parse_args()
 
 
+def parse_serve_args(argv: Sequence[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="main.py serve", description="Aggregate readings streamed by stations over the network"
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=7878, help="TCP port stations send readings to")
+    parser.add_argument("--udp-port", type=int, help="Also accept readings as UDP datagrams on this port")
+    parser.add_argument(
+        "--subscribe-port", type=int, default=7879, help="TCP port streaming results to subscribers as NDJSON"
+    )
+    parser.add_argument(
+        "--queue-blocks",
+        type=int,
+        default=64,
+        help="Blocks of readings buffered before senders are slowed down (UDP datagrams are dropped)",
+    )
+    parser.add_argument(
+        "--allowed-lateness", type=int, default=0, help="Minutes a day stays open for late readings"
+    )
+    parser.add_argument("--events-threshold", type=float, default=1.0, help="Rain threshold per reading for events")
+    parser.add_argument("--events-gap", type=int, default=10, help="Minutes allowed between event readings")
+    parser.add_argument("--dry-threshold", type=float, default=0.05, help="Rainfall threshold (mm) to qualify as dry")
+    parser.add_argument("--dry-min-hours", type=float, default=6.0, help="Minimum dry spell duration in hours")
+    parser.add_argument("--dry-gap", type=int, default=45, help="Maximum gap in minutes between dry readings")
+    parser.add_argument("--reorder-window", type=int, default=8, help="Per-station reorder buffer for detectors")
+    parser.add_argument(
+        "--stats-interval", type=float, default=10.0, help="Seconds between throughput reports (0 disables)"
+    )
+    _add_alert_args(parser)
+    return parser.parse_args(argv)
+
+
+def parse_fake_station_args(argv: Sequence[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="main.py fake-stations", description="Stream simulated readings to a running server"
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Server address")
+    parser.add_argument("--port", type=int, default=7878, help="Server TCP (or UDP) port")
+    parser.add_argument("--protocol", choices=["tcp", "udp"], default="tcp", help="Transport to send readings over")
+    parser.add_argument("--stations", type=int, default=10, help="Number of simulated stations")
+    parser.add_argument("--readings", type=int, default=24 * 60, help="Readings (minutes) sent per station")
+    parser.add_argument("--rate", type=float, help="Total readings per second (default: as fast as possible)")
+    return parser.parse_args(argv)
+
+
+def parse_query_args(argv: Sequence[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="main.py query", description="Look up summaries saved with --summary-store without re-aggregating"
+    )
+    parser.add_argument("store", type=Path, help="Summary store directory")
+    parser.add_argument("--level", choices=["day", "week", "month"], default="day", help="Summary granularity")
+    parser.add_argument("--station", help="Only this station (default: all stations)")
+    parser.add_argument(
+        "--from", dest="start", type=date.fromisoformat, help="First date (YYYY-MM-DD) of the range, inclusive"
+    )
+    parser.add_argument(
+        "--to", dest="end", type=date.fromisoformat, help="Last date (YYYY-MM-DD) of the range, inclusive"
+    )
+    return parser.parse_args(argv)
+
+
+def run_query(argv: Sequence[str]) -> None:
+    args = parse_query_args(argv)
+    try:
+        store = SummaryStore.load(args.store)
+    except (FileNotFoundError, ValueError) as exc:
+        raise SystemExit(str(exc))
+    if args.level == "day":
+        lines = render_days(list(store.days(args.station, args.start, args.end)))
+    elif args.level == "week":
+        lines = [render_week(summary) for summary in store.weeks(args.station, args.start, args.end)]
+    else:
+        lines = [render_month(summary) for summary in store.months(args.station, args.start, args.end)]
+    with ReportSink() as sink:
+        sink.write_lines(lines or ["No matching summaries."])
+
+
+def run_serve(argv: Sequence[str]) -> None:
+    args = parse_serve_args(argv)
+    config = ServerConfig(
+        host=args.host,
+        tcp_port=args.port,
+        udp_port=args.udp_port,
+        subscribe_port=args.subscribe_port,
+        queue_blocks=args.queue_blocks,
+        allowed_lateness=timedelta(minutes=args.allowed_lateness),
+        events_threshold_mm=args.events_threshold,
+        events_gap=timedelta(minutes=args.events_gap),
+        dry_threshold_mm=args.dry_threshold,
+        dry_min_duration=timedelta(hours=args.dry_min_hours),
+        dry_gap=timedelta(minutes=args.dry_gap),
+        reorder_window=args.reorder_window,
+        stats_interval=args.stats_interval,
+        alert_rules=_alert_rules(args),
+    )
+    stats = asyncio.run(serve(config))
+    print(
+        f"[serve] stopped after {stats.readings} readings "
+        f"({stats.rejected_lines} rejected lines, {stats.dropped_datagrams} dropped datagrams)",
+        file=sys.stderr,
+    )
+
+
+def run_fake_station_client(argv: Sequence[str]) -> None:
+    args = parse_fake_station_args(argv)
+    stations = [f"S{index + 1}" for index in range(args.stations)]
+    started = time.perf_counter()
+    sent = asyncio.run(
+        run_fake_stations(args.host, args.port, stations, args.readings, rate=args.rate, protocol=args.protocol)
+    )
+    elapsed = time.perf_counter() - started
+    print(f"Sent {sent} readings in {elapsed:.2f}s ({sent / elapsed:,.0f} readings/s)", file=sys.stderr)
+
+
+def build_instrumentation(
+    args: argparse.Namespace,
+) -> Tuple[Instrumentation, MetricsRecorder, Optional[Union[CProfileCollector, SamplingCollector]]]:
+    recorder = MetricsRecorder()
+    profiler = None
+    if args.profile_out:
+        profiler = SamplingCollector() if args.profiler == "sample" else CProfileCollector()
+    trace_memory = bool(args.profile_stages or args.metrics_json) and not args.no_trace_memory
+    collectors = [recorder] if profiler is None else [recorder, profiler]
+    return Instrumentation(collectors, trace_memory=trace_memory), recorder, profiler
+
+
 def main() -> None:
+    if sys.argv[1:2] == ["serve"]:
+        run_serve(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ["fake-stations"]:
+        run_fake_station_client(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ["query"]:
+        run_query(sys.argv[2:])
+        return
     args = parse_args()
-    run_demo(args)
+    if args.engine == "numpy" and not numpy_available():
+        raise SystemExit("--engine numpy requires NumPy to be installed")
+    if args.window_csv and not args.window:
+        raise SystemExit("--window-csv requires --window")
+    if not args.input_store and (args.store_stations or args.store_start or args.store_end):
+        raise SystemExit("--store-stations, --store-start and --store-end require --input-store")
+    export_paths = [
+        args.csv,
+        args.week_json,
+        args.month_csv,
+        args.events_csv,
+        args.dry_csv,
+        args.window_csv,
+        args.percentiles_json,
+    ]
+    if not zstd_available() and any(path and path.suffix.lower() == ".zst" for path in export_paths):
+        raise SystemExit(".zst exports require Python 3.14+ or the zstandard package")
+    instruments, recorder, profiler = build_instrumentation(args)
+    try:
+        with ExportScheduler(args.export_workers, fsync=args.fsync) as exports:
+            analyzed = run_demo(args, exports, instruments, ReportSink())
+            with instruments.stage("export", readings=analyzed) as stage:
+                reports = exports.wait()
+                stage.items = len(reports)
+    finally:
+        instruments.close()
+    if reports:
+        print("\nExports:", file=sys.stderr)
+        print(render_export_report(reports), file=sys.stderr)
+    if args.profile_stages:
+        print("\nStages:", file=sys.stderr)
+        print(render_stage_report(recorder.stages), file=sys.stderr)
+    if args.metrics_json:
+        recorder.write_json(
+            args.metrics_json, argv=sys.argv[1:], readings=analyzed, engine=args.engine, workers=args.workers
+        )
+    if profiler is not None:
+        hottest = profiler.dump(args.profile_out)
+        if hottest is not None:
+            print(f"Profile of stage '{hottest.name}' written to {args.profile_out}", file=sys.stderr)
 
 
 if __name__ == "__main__":
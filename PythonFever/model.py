@@ -1,5 +1,14 @@
+import heapq
+from array import array
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union, overload
+
+EPOCH = datetime(1970, 1, 1)
+_ONE_US = timedelta(microseconds=1)
+
+Row = Tuple[str, datetime, float, float]
+
 
 @dataclass(frozen=True)
 class Reading:
@@ -7,3 +16,226 @@ class Reading:
     ts: datetime
     temperature_c: float
     rainfall_mm: float
+
+
+def to_epoch_us(ts: datetime) -> int:
+    """Convert a timestamp to integer microseconds since the epoch (naive means UTC)."""
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return (ts - EPOCH) // _ONE_US
+
+
+def from_epoch_us(value: int) -> datetime:
+    return EPOCH + timedelta(microseconds=value)
+
+
+class ReadingBatch:
+    """
+    Columnar collection of readings.
+
+    Station ids are interned into ``stations`` and referenced by index from
+    ``station_codes``; timestamps are epoch microseconds. Each column is a
+    contiguous typed array, so a batch costs ~28 bytes per reading instead of
+    a ``Reading`` object holding a ``datetime`` and a string.
+    """
+
+    __slots__ = ("stations", "_station_index", "station_codes", "epoch_us", "temperature_c", "rainfall_mm")
+
+    def __init__(
+        self,
+        stations: Optional[Sequence[str]] = None,
+        station_codes: Optional[Sequence[int]] = None,
+        epoch_us: Optional[Sequence[int]] = None,
+        temperature_c: Optional[Sequence[float]] = None,
+        rainfall_mm: Optional[Sequence[float]] = None,
+    ) -> None:
+        self.stations: List[str] = list(stations or [])
+        self._station_index: Dict[str, int] = {s: i for i, s in enumerate(self.stations)}
+        self.station_codes = station_codes if station_codes is not None else array("I")
+        self.epoch_us = epoch_us if epoch_us is not None else array("q")
+        self.temperature_c = temperature_c if temperature_c is not None else array("d")
+        self.rainfall_mm = rainfall_mm if rainfall_mm is not None else array("d")
+
+    @classmethod
+    def from_readings(cls, readings: Iterable[Reading]) -> "ReadingBatch":
+        batch = cls()
+        batch.extend(readings)
+        return batch
+
+    def station_code(self, station_id: str) -> int:
+        """Return the interned code for ``station_id``, registering it if needed."""
+        code = self._station_index.get(station_id)
+        if code is None:
+            code = self._station_index[station_id] = len(self.stations)
+            self.stations.append(station_id)
+        return code
+
+    def append_values(self, station_id: str, epoch_us: int, temperature_c: float, rainfall_mm: float) -> None:
+        self.station_codes.append(self.station_code(station_id))
+        self.epoch_us.append(epoch_us)
+        self.temperature_c.append(temperature_c)
+        self.rainfall_mm.append(rainfall_mm)
+
+    def append(self, reading: Reading) -> None:
+        self.append_values(reading.station_id, to_epoch_us(reading.ts), reading.temperature_c, reading.rainfall_mm)
+
+    def extend(self, readings: Iterable[Reading]) -> None:
+        for station_id, ts, temperature_c, rainfall_mm in iter_rows(readings):
+            self.append_values(station_id, to_epoch_us(ts), temperature_c, rainfall_mm)
+
+    def __len__(self) -> int:
+        return len(self.epoch_us)
+
+    def __repr__(self) -> str:
+        return f"ReadingBatch(readings={len(self)}, stations={len(self.stations)})"
+
+    @overload
+    def __getitem__(self, index: int) -> Reading: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> "ReadingBatch": ...
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Reading, "ReadingBatch"]:
+        if isinstance(index, slice):
+            return self.with_columns(
+                self.station_codes[index], self.epoch_us[index], self.temperature_c[index], self.rainfall_mm[index]
+            )
+        return Reading(
+            station_id=self.stations[self.station_codes[index]],
+            ts=from_epoch_us(self.epoch_us[index]),
+            temperature_c=self.temperature_c[index],
+            rainfall_mm=self.rainfall_mm[index],
+        )
+
+    def with_columns(
+        self,
+        station_codes: Sequence[int],
+        epoch_us: Sequence[int],
+        temperature_c: Sequence[float],
+        rainfall_mm: Sequence[float],
+    ) -> "ReadingBatch":
+        """Return a batch over the given columns that shares this batch's station table."""
+        view = ReadingBatch.__new__(ReadingBatch)
+        # The station table is append-only, so sharing it keeps codes valid.
+        view.stations = self.stations
+        view._station_index = self._station_index
+        view.station_codes = station_codes
+        view.epoch_us = epoch_us
+        view.temperature_c = temperature_c
+        view.rainfall_mm = rainfall_mm
+        return view
+
+    def rows(self) -> Iterator[Row]:
+        """Yield ``(station_id, ts, temperature_c, rainfall_mm)`` without building ``Reading`` objects."""
+        stations = self.stations
+        for code, us, temperature_c, rainfall_mm in zip(
+            self.station_codes, self.epoch_us, self.temperature_c, self.rainfall_mm
+        ):
+            yield stations[code], EPOCH + timedelta(microseconds=us), temperature_c, rainfall_mm
+
+    def __iter__(self) -> Iterator[Reading]:
+        for station_id, ts, temperature_c, rainfall_mm in self.rows():
+            yield Reading(station_id=station_id, ts=ts, temperature_c=temperature_c, rainfall_mm=rainfall_mm)
+
+    def to_readings(self) -> List[Reading]:
+        return list(self)
+
+
+class BatchStream:
+    """
+    Re-iterable stream of readings delivered as ``ReadingBatch`` chunks.
+
+    ``source`` is called on every pass and must return a fresh iterable of
+    batches, so the readings never have to be held in memory all at once.
+    """
+
+    def __init__(self, source: Callable[[], Iterable[ReadingBatch]]) -> None:
+        self._source = source
+
+    def batches(self) -> Iterator[ReadingBatch]:
+        return iter(self._source())
+
+    def rows(self) -> Iterator[Row]:
+        for batch in self.batches():
+            yield from batch.rows()
+
+    def __iter__(self) -> Iterator[Reading]:
+        for batch in self.batches():
+            yield from batch
+
+    def to_batch(self) -> ReadingBatch:
+        """Concatenate every chunk into one batch."""
+        out = ReadingBatch()
+        for batch in self.batches():
+            remap = [out.station_code(station_id) for station_id in batch.stations]
+            out.station_codes.extend(remap[code] for code in batch.station_codes)
+            out.epoch_us.extend(batch.epoch_us)
+            out.temperature_c.extend(batch.temperature_c)
+            out.rainfall_mm.extend(batch.rainfall_mm)
+        return out
+
+
+def as_batch(readings: Iterable[Reading]) -> ReadingBatch:
+    """Return readings, a batch or a stream as one ``ReadingBatch`` (a batch is returned as is)."""
+    if isinstance(readings, ReadingBatch):
+        return readings
+    if isinstance(readings, BatchStream):
+        return readings.to_batch()
+    return ReadingBatch.from_readings(readings)
+
+
+def iter_rows(readings: Iterable[Reading]) -> Iterator[Row]:
+    """Yield ``(station_id, ts, temperature_c, rainfall_mm)`` rows from readings, a batch or a stream."""
+    if isinstance(readings, (ReadingBatch, BatchStream)):
+        return readings.rows()
+    return ((r.station_id, r.ts, r.temperature_c, r.rainfall_mm) for r in readings)
+
+
+class ReorderBuffer:
+    """
+    Per-station bounded buffer that restores timestamp order for slightly late rows.
+
+    Up to ``window`` rows are held back per station; pushing one more releases
+    that station's oldest row. Rows arriving later than ``window`` positions
+    behind cannot be fixed and are released in arrival order.
+    """
+
+    def __init__(self, window: int = 8) -> None:
+        self.window = window
+        self._heaps: Dict[str, List[Tuple[datetime, int, Row]]] = {}
+        self._seq = 0
+
+    def push(self, row: Row) -> Optional[Row]:
+        """Buffer ``row`` and return the row it displaced, if any."""
+        if self.window <= 0:
+            return row
+        heap = self._heaps.get(row[0])
+        if heap is None:
+            heap = self._heaps[row[0]] = []
+        # The sequence number keeps equal timestamps in arrival order.
+        entry = (row[1], self._seq, row)
+        self._seq += 1
+        if len(heap) < self.window:
+            heapq.heappush(heap, entry)
+            return None
+        return heapq.heappushpop(heap, entry)[2]
+
+    def drain(self) -> Iterator[Row]:
+        """Release every buffered row, station by station."""
+        for heap in self._heaps.values():
+            while heap:
+                yield heapq.heappop(heap)[2]
+        self._heaps.clear()
+
+
+def reorder_rows(rows: Iterable[Row], window: int = 8) -> Iterator[Row]:
+    """Yield ``rows`` with per-station disorder of up to ``window`` positions corrected."""
+    if window <= 0:
+        yield from rows
+        return
+    buffer = ReorderBuffer(window)
+    for row in rows:
+        released = buffer.push(row)
+        if released is not None:
+            yield released
+    yield from buffer.drain()
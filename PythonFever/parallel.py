@@ -0,0 +1,184 @@
+"""
+Process-pool execution of the aggregation pipeline.
+
+Readings are sharded by station, so each worker produces complete summaries,
+events and dry spells for its own stations. Merging is then a
+concatenation. Shards that split the same stations by time are merged
+through the partial accumulators instead (see ``aggregate_day_parallel``).
+"""
+import zlib
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from aggregator import (
+    DAY_OUTPUTS,
+    AggregationPlan,
+    DaySummary,
+    PlanResult,
+    aggregate_day_partial,
+    execute_plan,
+    merge_partials,
+)
+from analytics import rainfall_percentiles
+from model import BatchStream, Reading, ReadingBatch, as_batch
+from sketch import QuantileSketch
+
+if TYPE_CHECKING:
+    from cache import SummaryCache
+
+class StationSharder:
+    """
+    Split batches added one at a time into ``shards`` batches by station.
+
+    Every station lands in exactly one shard; ``parts`` returns the shards
+    built so far, which share one station table.
+    """
+
+    def __init__(self, shards: int) -> None:
+        self.shards = shards
+        self._table = ReadingBatch()
+        self._assignment: List[int] = []
+        self._columns = [tuple(array(typecode) for typecode in "Iqdd") for _ in range(shards)]
+        self._appenders = [tuple(column.append for column in part) for part in self._columns]
+
+    def add(self, batch: ReadingBatch) -> None:
+        table, assignment, appenders = self._table, self._assignment, self._appenders
+        remap = [table.station_code(station_id) for station_id in batch.stations]
+        for station_id in table.stations[len(assignment) :]:
+            # crc32 keeps the assignment stable across runs, unlike hash().
+            assignment.append(zlib.crc32(station_id.encode()) % self.shards)
+        codes = batch.station_codes
+        if remap != list(range(len(remap))):
+            codes = map(remap.__getitem__, codes)
+        for code, epoch_us, temperature_c, rainfall_mm in zip(
+            codes, batch.epoch_us, batch.temperature_c, batch.rainfall_mm
+        ):
+            add_code, add_ts, add_temp, add_rain = appenders[assignment[code]]
+            add_code(code)
+            add_ts(epoch_us)
+            add_temp(temperature_c)
+            add_rain(rainfall_mm)
+
+    def parts(self) -> List[ReadingBatch]:
+        return [self._table.with_columns(*part) for part in self._columns]
+
+
+def shard_by_station(readings: Iterable[Reading], shards: int) -> List[ReadingBatch]:
+    """
+    Split readings into ``shards`` batches so that every station lands in exactly one.
+
+    A ``BatchStream`` is split chunk by chunk, so the feed is never held in
+    memory twice.
+    """
+    sharder = StationSharder(shards)
+    for batch in readings.batches() if isinstance(readings, BatchStream) else [as_batch(readings)]:
+        sharder.add(batch)
+    return sharder.parts()
+
+
+def split_by_time(readings: Iterable[Reading], chunks: int) -> List[ReadingBatch]:
+    """Split readings into ``chunks`` consecutive slices of the feed."""
+    batch = as_batch(readings)
+    size = -(-len(batch) // max(chunks, 1))
+    return [batch[start : start + size] for start in range(0, len(batch), size or 1)]
+
+
+def merge_plan_results(results: Sequence[PlanResult], plan: AggregationPlan) -> PlanResult:
+    """Combine results of station-disjoint shards into one ``PlanResult``."""
+    merged = PlanResult()
+    for result in results:
+        merged.days.update(result.days)
+    if "week" in plan.outputs:
+        merged.weeks = {}
+        for result in results:
+            merged.weeks.update(result.weeks or {})
+    if "month" in plan.outputs:
+        merged.months = {}
+        for result in results:
+            merged.months.update(result.months or {})
+    if "events" in plan.outputs:
+        merged.events = sorted(
+            (event for result in results for event in result.events or []),
+            key=lambda e: (e.station_id, e.start),
+        )
+    if "dry_spells" in plan.outputs:
+        merged.dry_spells = sorted(
+            (spell for result in results for spell in result.dry_spells or []),
+            key=lambda s: (s.station_id, s.start),
+        )
+    if "windows" in plan.outputs:
+        merged.windows = sorted(
+            (window for result in results for window in result.windows or []),
+            key=lambda w: (w.station_id, w.end - w.start, w.start),
+        )
+        merged.window_peaks = sorted(
+            (peak for result in results for peak in result.window_peaks or []),
+            key=lambda p: (p.station_id, p.window),
+        )
+    if "alerts" in plan.outputs:
+        merged.alerts = sorted(
+            (alert for result in results for alert in result.alerts or []),
+            key=lambda a: (a.station_id, a.ts),
+        )
+    if "percentiles" in plan.outputs:
+        sketches = [result.percentile_sketch for result in results if result.percentile_sketch is not None]
+        if plan.percentile_error is not None and sketches:
+            merged.percentile_sketch = QuantileSketch.with_error(plan.percentile_error)
+            for sketch in sketches:
+                merged.percentile_sketch.merge(sketch)
+            merged.percentiles = merged.percentile_sketch.percentiles(plan.percentiles)
+        else:
+            merged.percentiles = rainfall_percentiles(
+                merged.days.values(), percentiles=plan.percentiles, error=plan.percentile_error
+            )
+    return merged
+
+
+def execute_shards(shards: Sequence[ReadingBatch], plan: AggregationPlan, workers: int) -> PlanResult:
+    """Run ``plan`` on station-disjoint ``shards`` in a process pool and merge the results."""
+    shards = [shard for shard in shards if len(shard)]
+    # Day summaries are merged by key; exact percentiles need every station's
+    # days, so they are computed after the merge while sketches are merged.
+    outputs = plan.outputs
+    if outputs & DAY_OUTPUTS:
+        outputs |= {"day"}
+    if plan.percentile_error is None:
+        outputs -= {"percentiles"}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(execute_plan, shards, [replace(plan, outputs=outputs)] * len(shards)))
+    return merge_plan_results(results, plan)
+
+
+def execute_plan_parallel(
+    readings: Iterable[Reading], plan: AggregationPlan, workers: int, cache: Optional["SummaryCache"] = None
+) -> PlanResult:
+    """Run ``plan`` over station shards in a process pool and merge the results."""
+    # pipeline imports this module, so pull it in lazily.
+    from pipeline import plan_pipeline
+
+    return plan_pipeline(plan, workers=workers, cached=cache is not None).run(readings, cache=cache)
+
+
+def aggregate_day_parallel(
+    readings: Iterable[Reading],
+    workers: int,
+    *,
+    split: str = "station",
+) -> Dict[Tuple[str, Tuple[int, int, int]], DaySummary]:
+    """
+    Aggregate day summaries in a process pool.
+
+    ``split="station"`` shards by station; ``split="time"`` hands each worker a
+    consecutive slice of the feed and merges the partial accumulators.
+    """
+    if split == "station":
+        shards = shard_by_station(readings, workers)
+    elif split == "time":
+        shards = split_by_time(readings, workers)
+    else:
+        raise ValueError(f"Unknown split '{split}'")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        partials = list(pool.map(aggregate_day_partial, shards))
+    return {key: acc.to_summary() for key, acc in merge_partials(partials).items()}
@@ -1,10 +1,38 @@
-import csv
+import gzip
 import json
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from datetime import date, datetime
+from itertools import chain, islice
+from json.encoder import encode_basestring_ascii
 from pathlib import Path
-from typing import Iterable, Mapping, Union
+from typing import IO, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Union
 
-from aggregator import DaySummary, MonthSummary, RainEvent, WeekSummary
+from aggregator import DaySummary, MonthSummary, PlanResult, RainEvent, WeekSummary
 from analytics import DrySpell
+from model import BatchStream, Reading, ReadingBatch, from_epoch_us, to_epoch_us
+from sketch import QuantileSketch
+from windowing import WindowSummary
+
+try:
+    from compression import zstd as _zstd  # Python 3.14+
+except ImportError:  # pragma: no cover - depends on the interpreter
+    try:
+        import zstandard as _zstd
+    except ImportError:  # pragma: no cover - optional dependency
+        _zstd = None
+
+# Rows are joined and written this many at a time.
+WRITE_BATCH_ROWS = 4096
+
+_needs_quoting = re.compile(r'[,"\r\n]').search
 
 
 def _prepare_path(path: Path) -> Path:
@@ -12,147 +40,392 @@ def _prepare_path(path: Path) -> Path:
     return path
 
 
+def zstd_available() -> bool:
+    return _zstd is not None
+
+
+def _open_text(target: Path, newline: Optional[str]) -> IO[str]:
+    """Open ``target`` for writing, compressing when it ends in .gz or .zst."""
+    suffix = target.suffix.lower()
+    if suffix == ".gz":
+        return gzip.open(target, "wt", newline=newline)
+    if suffix == ".zst":
+        if _zstd is None:
+            raise RuntimeError(f"Writing {target} requires zstd support (Python 3.14+ or the zstandard package)")
+        return _zstd.open(target, "wt", newline=newline)
+    return target.open("w", newline=newline)
+
+
+def _write_text(path: Union[str, Path], pieces: Iterable[str], *, newline: Optional[str] = None) -> Path:
+    target = _prepare_path(Path(path))
+    pieces = iter(pieces)
+    with _open_text(target, newline) as handle:
+        while True:
+            batch = list(islice(pieces, WRITE_BATCH_ROWS))
+            if not batch:
+                break
+            handle.write("".join(batch))
+    return target
+
+
+def _csv_text(value: str) -> str:
+    """Quote a text field the way ``csv.writer`` does by default."""
+    if _needs_quoting(value):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+def _csv_header(fieldnames: Sequence[str]) -> str:
+    return ",".join(fieldnames) + "\r\n"
+
+
+def _json_number(value: float) -> str:
+    # Same rendering as json.dumps: repr() for finite values, NaN/Infinity otherwise.
+    return repr(value) if math.isfinite(value) else json.dumps(value)
+
+
+def _json_array(items: Iterable[str]) -> Iterator[str]:
+    """Yield the text of ``json.dumps(list, indent=2)`` around pre-rendered items."""
+    items = iter(items)
+    first = next(items, None)
+    if first is None:
+        yield "[]"
+        return
+    yield "[\n" + first
+    for item in items:
+        yield ",\n" + item
+    yield "\n]"
+
+
+def _write_csv(path: Union[str, Path], fieldnames: Sequence[str], rows: Iterable[str]) -> Path:
+    return _write_text(path, chain((_csv_header(fieldnames),), rows), newline="")
+
+
+_DAY_FIELDS = (
+    "station_id",
+    "date",
+    "total_rain_mm",
+    "avg_temp_c",
+    "min_temp_c",
+    "max_temp_c",
+    "max_rainfall_mm",
+    "max_rain_rate_mm_per_hr",
+    "count",
+    "first_observation",
+    "last_observation",
+)
+_DAY_CSV_ROW = "{},{},{:.3f},{:.2f},{:.2f},{:.2f},{:.3f},{:.2f},{},{},{}\r\n".format
+_DAY_NDJSON_ROW = (
+    '{{"station_id": {}, "date": "{}", "total_rain_mm": {}, "avg_temp_c": {}, "min_temp_c": {}, '
+    '"max_temp_c": {}, "max_rainfall_mm": {}, "max_rain_rate_mm_per_hr": {}, "count": {}, '
+    '"first_observation": "{}", "last_observation": "{}"}}\n'
+).format
+
+
 def write_day_summary_csv(path: Union[str, Path], summaries: Iterable[DaySummary]) -> Path:
     """Persist day summaries to a CSV file."""
-    target = _prepare_path(Path(path))
-    fieldnames = [
-        "station_id",
-        "date",
-        "total_rain_mm",
-        "avg_temp_c",
-        "min_temp_c",
-        "max_temp_c",
-        "max_rainfall_mm",
-        "max_rain_rate_mm_per_hr",
-        "count",
-        "first_observation",
-        "last_observation",
-    ]
-
-    with target.open("w", newline="") as handle:
-        writer = csv.DictWriter(handle, fieldnames=fieldnames)
-        writer.writeheader()
-        for summary in summaries:
-            writer.writerow(
-                {
-                    "station_id": summary.station_id,
-                    "date": summary.date.date().isoformat(),
-                    "total_rain_mm": f"{summary.total_rain_mm:.3f}",
-                    "avg_temp_c": f"{summary.avg_temp_c:.2f}",
-                    "min_temp_c": f"{summary.min_temp_c:.2f}",
-                    "max_temp_c": f"{summary.max_temp_c:.2f}",
-                    "max_rainfall_mm": f"{summary.max_rainfall_mm:.3f}",
-                    "max_rain_rate_mm_per_hr": f"{summary.max_rain_rate_mm_per_hr:.2f}",
-                    "count": summary.count,
-                    "first_observation": summary.first_observation.isoformat(),
-                    "last_observation": summary.last_observation.isoformat(),
-                }
+    row = _DAY_CSV_ROW
+    return _write_csv(
+        path,
+        _DAY_FIELDS,
+        (
+            row(
+                _csv_text(s.station_id),
+                s.date.date().isoformat(),
+                s.total_rain_mm,
+                s.avg_temp_c,
+                s.min_temp_c,
+                s.max_temp_c,
+                s.max_rainfall_mm,
+                s.max_rain_rate_mm_per_hr,
+                s.count,
+                s.first_observation.isoformat(),
+                s.last_observation.isoformat(),
             )
-    return target
+            for s in summaries
+        ),
+    )
+
+
+def write_day_summary_ndjson(path: Union[str, Path], summaries: Iterable[DaySummary]) -> Path:
+    """Persist day summaries as newline-delimited JSON, one object per day."""
+    row = _DAY_NDJSON_ROW
+    number = _json_number
+    return _write_text(
+        path,
+        (
+            row(
+                encode_basestring_ascii(s.station_id),
+                s.date.date().isoformat(),
+                number(s.total_rain_mm),
+                number(s.avg_temp_c),
+                number(s.min_temp_c),
+                number(s.max_temp_c),
+                number(s.max_rainfall_mm),
+                number(s.max_rain_rate_mm_per_hr),
+                s.count,
+                s.first_observation.isoformat(),
+                s.last_observation.isoformat(),
+            )
+            for s in summaries
+        ),
+    )
+
+
+_WEEK_JSON_ITEM = (
+    '  {{\n    "station_id": {},\n    "iso_year": {},\n    "iso_week": {},\n    "total_rain_mm": {},\n'
+    '    "avg_temp_c": {},\n    "days": {},\n    "max_daily_rain_mm": {}\n  }}'
+).format
+_WEEK_NDJSON_ROW = (
+    '{{"station_id": {}, "iso_year": {}, "iso_week": {}, "total_rain_mm": {}, "avg_temp_c": {}, '
+    '"days": {}, "max_daily_rain_mm": {}}}\n'
+).format
+
+
+def _week_values(summary: WeekSummary) -> tuple:
+    return (
+        encode_basestring_ascii(summary.station_id),
+        summary.iso_year,
+        summary.iso_week,
+        _json_number(summary.total_rain_mm),
+        _json_number(summary.avg_temp_c),
+        summary.days,
+        _json_number(summary.max_daily_rain_mm),
+    )
 
 
 def write_week_summary_json(path: Union[str, Path], summaries: Iterable[WeekSummary]) -> Path:
     """Persist weekly summaries to a JSON file."""
-    target = _prepare_path(Path(path))
-    payload = [
-        {
-            "station_id": summary.station_id,
-            "iso_year": summary.iso_year,
-            "iso_week": summary.iso_week,
-            "total_rain_mm": summary.total_rain_mm,
-            "avg_temp_c": summary.avg_temp_c,
-            "days": summary.days,
-            "max_daily_rain_mm": summary.max_daily_rain_mm,
-        }
-        for summary in summaries
-    ]
-    target.write_text(json.dumps(payload, indent=2))
-    return target
+    item = _WEEK_JSON_ITEM
+    return _write_text(path, _json_array(item(*_week_values(s)) for s in summaries))
+
+
+def write_week_summary_ndjson(path: Union[str, Path], summaries: Iterable[WeekSummary]) -> Path:
+    """Persist weekly summaries as newline-delimited JSON."""
+    row = _WEEK_NDJSON_ROW
+    return _write_text(path, (row(*_week_values(s)) for s in summaries))
+
+
+_MONTH_FIELDS = (
+    "station_id",
+    "year",
+    "month",
+    "total_rain_mm",
+    "avg_temp_c",
+    "median_temp_c",
+    "days",
+    "max_daily_rain_mm",
+    "wettest_day",
+)
+_MONTH_CSV_ROW = "{},{},{},{:.3f},{:.2f},{:.2f},{},{:.3f},{}\r\n".format
+_MONTH_NDJSON_ROW = (
+    '{{"station_id": {}, "year": {}, "month": {}, "total_rain_mm": {}, "avg_temp_c": {}, '
+    '"median_temp_c": {}, "days": {}, "max_daily_rain_mm": {}, "wettest_day": "{}"}}\n'
+).format
 
 
 def write_month_summary_csv(path: Union[str, Path], summaries: Iterable[MonthSummary]) -> Path:
     """Persist monthly summaries to CSV."""
-    target = _prepare_path(Path(path))
-    fieldnames = [
-        "station_id",
-        "year",
-        "month",
-        "total_rain_mm",
-        "avg_temp_c",
-        "median_temp_c",
-        "days",
-        "max_daily_rain_mm",
-        "wettest_day",
-    ]
-    with target.open("w", newline="") as handle:
-        writer = csv.DictWriter(handle, fieldnames=fieldnames)
-        writer.writeheader()
-        for summary in summaries:
-            writer.writerow(
-                {
-                    "station_id": summary.station_id,
-                    "year": summary.year,
-                    "month": summary.month,
-                    "total_rain_mm": f"{summary.total_rain_mm:.3f}",
-                    "avg_temp_c": f"{summary.avg_temp_c:.2f}",
-                    "median_temp_c": f"{summary.median_temp_c:.2f}",
-                    "days": summary.days,
-                    "max_daily_rain_mm": f"{summary.max_daily_rain_mm:.3f}",
-                    "wettest_day": summary.wettest_day.date().isoformat(),
-                }
+    row = _MONTH_CSV_ROW
+    return _write_csv(
+        path,
+        _MONTH_FIELDS,
+        (
+            row(
+                _csv_text(s.station_id),
+                s.year,
+                s.month,
+                s.total_rain_mm,
+                s.avg_temp_c,
+                s.median_temp_c,
+                s.days,
+                s.max_daily_rain_mm,
+                s.wettest_day.date().isoformat(),
             )
-    return target
+            for s in summaries
+        ),
+    )
+
+
+def write_month_summary_ndjson(path: Union[str, Path], summaries: Iterable[MonthSummary]) -> Path:
+    """Persist monthly rollups as newline-delimited JSON."""
+    row = _MONTH_NDJSON_ROW
+    number = _json_number
+    return _write_text(
+        path,
+        (
+            row(
+                encode_basestring_ascii(s.station_id),
+                s.year,
+                s.month,
+                number(s.total_rain_mm),
+                number(s.avg_temp_c),
+                number(s.median_temp_c),
+                s.days,
+                number(s.max_daily_rain_mm),
+                s.wettest_day.date().isoformat(),
+            )
+            for s in summaries
+        ),
+    )
+
+
+_EVENT_FIELDS = (
+    "station_id",
+    "start",
+    "end",
+    "duration_seconds",
+    "total_rain_mm",
+    "peak_intensity_mm_per_hr",
+    "readings",
+)
+_EVENT_CSV_ROW = "{},{},{},{},{:.3f},{:.2f},{}\r\n".format
+_EVENT_NDJSON_ROW = (
+    '{{"station_id": {}, "start": "{}", "end": "{}", "duration_seconds": {}, "total_rain_mm": {}, '
+    '"peak_intensity_mm_per_hr": {}, "readings": {}}}\n'
+).format
 
 
 def write_rain_events_csv(path: Union[str, Path], events: Iterable[RainEvent]) -> Path:
     """Persist heavy-rain events to CSV for downstream use."""
-    target = _prepare_path(Path(path))
-    fieldnames = [
-        "station_id",
-        "start",
-        "end",
-        "duration_seconds",
-        "total_rain_mm",
-        "peak_intensity_mm_per_hr",
-        "readings",
-    ]
-    with target.open("w", newline="") as handle:
-        writer = csv.DictWriter(handle, fieldnames=fieldnames)
-        writer.writeheader()
-        for event in events:
-            duration_seconds = (event.end - event.start).total_seconds()
-            writer.writerow(
-                {
-                    "station_id": event.station_id,
-                    "start": event.start.isoformat(),
-                    "end": event.end.isoformat(),
-                    "duration_seconds": int(duration_seconds),
-                    "total_rain_mm": f"{event.total_rain_mm:.3f}",
-                    "peak_intensity_mm_per_hr": f"{event.peak_intensity_mm_per_hr:.2f}",
-                    "readings": event.readings,
-                }
+    row = _EVENT_CSV_ROW
+    return _write_csv(
+        path,
+        _EVENT_FIELDS,
+        (
+            row(
+                _csv_text(e.station_id),
+                e.start.isoformat(),
+                e.end.isoformat(),
+                int((e.end - e.start).total_seconds()),
+                e.total_rain_mm,
+                e.peak_intensity_mm_per_hr,
+                e.readings,
             )
-    return target
+            for e in events
+        ),
+    )
+
+
+def write_rain_events_ndjson(path: Union[str, Path], events: Iterable[RainEvent]) -> Path:
+    """Persist heavy-rain events as newline-delimited JSON."""
+    row = _EVENT_NDJSON_ROW
+    number = _json_number
+    return _write_text(
+        path,
+        (
+            row(
+                encode_basestring_ascii(e.station_id),
+                e.start.isoformat(),
+                e.end.isoformat(),
+                int((e.end - e.start).total_seconds()),
+                number(e.total_rain_mm),
+                number(e.peak_intensity_mm_per_hr),
+                e.readings,
+            )
+            for e in events
+        ),
+    )
+
+
+_SPELL_FIELDS = ("station_id", "start", "end", "duration_hours", "readings")
+_SPELL_CSV_ROW = "{},{},{},{:.2f},{}\r\n".format
+_SPELL_NDJSON_ROW = '{{"station_id": {}, "start": "{}", "end": "{}", "duration_hours": {}, "readings": {}}}\n'.format
 
 
 def write_dry_spells_csv(path: Union[str, Path], spells: Iterable[DrySpell]) -> Path:
     """Persist detected dry spells to CSV."""
-    target = _prepare_path(Path(path))
-    fieldnames = ["station_id", "start", "end", "duration_hours", "readings"]
-    with target.open("w", newline="") as handle:
-        writer = csv.DictWriter(handle, fieldnames=fieldnames)
-        writer.writeheader()
-        for spell in spells:
-            writer.writerow(
-                {
-                    "station_id": spell.station_id,
-                    "start": spell.start.isoformat(),
-                    "end": spell.end.isoformat(),
-                    "duration_hours": f"{spell.duration_hours:.2f}",
-                    "readings": spell.readings,
-                }
+    row = _SPELL_CSV_ROW
+    return _write_csv(
+        path,
+        _SPELL_FIELDS,
+        (
+            row(_csv_text(s.station_id), s.start.isoformat(), s.end.isoformat(), s.duration_hours, s.readings)
+            for s in spells
+        ),
+    )
+
+
+def write_dry_spells_ndjson(path: Union[str, Path], spells: Iterable[DrySpell]) -> Path:
+    """Persist detected dry spells as newline-delimited JSON."""
+    row = _SPELL_NDJSON_ROW
+    return _write_text(
+        path,
+        (
+            row(
+                encode_basestring_ascii(s.station_id),
+                s.start.isoformat(),
+                s.end.isoformat(),
+                _json_number(s.duration_hours),
+                s.readings,
             )
-    return target
+            for s in spells
+        ),
+    )
+
+
+_WINDOW_FIELDS = (
+    "station_id",
+    "start",
+    "end",
+    "count",
+    "total_rain_mm",
+    "max_rainfall_mm",
+    "avg_temp_c",
+    "min_temp_c",
+    "max_temp_c",
+)
+_WINDOW_CSV_ROW = "{},{},{},{},{:.3f},{:.3f},{:.2f},{:.2f},{:.2f}\r\n".format
+_WINDOW_NDJSON_ROW = (
+    '{{"station_id": {}, "start": "{}", "end": "{}", "count": {}, "total_rain_mm": {}, '
+    '"max_rainfall_mm": {}, "avg_temp_c": {}, "min_temp_c": {}, "max_temp_c": {}}}\n'
+).format
+
+
+def write_window_summary_csv(path: Union[str, Path], summaries: Iterable[WindowSummary]) -> Path:
+    """Persist window summaries to CSV."""
+    row = _WINDOW_CSV_ROW
+    return _write_csv(
+        path,
+        _WINDOW_FIELDS,
+        (
+            row(
+                _csv_text(w.station_id),
+                w.start.isoformat(),
+                w.end.isoformat(),
+                w.count,
+                w.total_rain_mm,
+                w.max_rainfall_mm,
+                w.avg_temp_c,
+                w.min_temp_c,
+                w.max_temp_c,
+            )
+            for w in summaries
+        ),
+    )
+
+
+def write_window_summary_ndjson(path: Union[str, Path], summaries: Iterable[WindowSummary]) -> Path:
+    """Persist window summaries as newline-delimited JSON."""
+    row = _WINDOW_NDJSON_ROW
+    number = _json_number
+    return _write_text(
+        path,
+        (
+            row(
+                encode_basestring_ascii(w.station_id),
+                w.start.isoformat(),
+                w.end.isoformat(),
+                w.count,
+                number(w.total_rain_mm),
+                number(w.max_rainfall_mm),
+                number(w.avg_temp_c),
+                number(w.min_temp_c),
+                number(w.max_temp_c),
+            )
+            for w in summaries
+        ),
+    )
 
 
 def write_percentiles_json(path: Union[str, Path], percentiles: Mapping[float, float]) -> Path:
@@ -162,5 +435,573 @@ def write_percentiles_json(path: Union[str, Path], percentiles: Mapping[float, f
         f"P{(f'{p:.1f}'.rstrip('0').rstrip('.') if not float(p).is_integer() else int(p))}": value
         for p, value in percentiles.items()
     }
-    target.write_text(json.dumps(payload, indent=2))
+    return _write_text(target, (json.dumps(payload, indent=2),))
+
+
+def write_quantile_sketch(path: Union[str, Path], sketch: QuantileSketch) -> Path:
+    """Persist a serialized quantile sketch so later runs can merge it."""
+    target = _prepare_path(Path(path))
+    target.write_bytes(sketch.to_bytes())
     return target
+
+
+def read_quantile_sketch(path: Union[str, Path]) -> QuantileSketch:
+    return QuantileSketch.from_bytes(Path(path).read_bytes())
+
+
+_STORE_META = "meta.json"
+_STORE_INDEX = "index.bin"
+_STORE_COLUMNS = (("station_codes", "I"), ("epoch_us", "q"), ("temperature_c", "d"), ("rainfall_mm", "d"))
+# station code, first row, stop row, min/max epoch_us, rows in timestamp order
+_STORE_RUN = struct.Struct("<IQQqq?")
+
+
+@dataclass(frozen=True)
+class StoreRun:
+    """Index entry for a contiguous block of one station's rows."""
+
+    station_code: int
+    start: int
+    stop: int
+    min_epoch_us: int
+    max_epoch_us: int
+    ordered: bool
+
+
+class ReadingStore:
+    """
+    Append-only columnar reading store backed by memory-mapped files.
+
+    Each column of a ``ReadingBatch`` lives in its own little-endian file under
+    ``root``. ``append`` writes readings grouped by station, keeping arrival
+    order within a station, and records an index run per station with its time
+    range. ``scan`` consults the index so only the requested stations and time
+    range are touched, and yields batches whose columns are memoryviews into
+    the mapped files rather than copies.
+    """
+
+    def __init__(self, root: Union[str, Path], *, create: bool = False) -> None:
+        self.root = Path(root)
+        meta = self.root / _STORE_META
+        if meta.exists():
+            self.stations: List[str] = json.loads(meta.read_text())["stations"]
+        elif create:
+            self.stations = []
+        else:
+            raise FileNotFoundError(f"No reading store at {self.root}")
+        self._station_index: Dict[str, int] = {s: i for i, s in enumerate(self.stations)}
+        self._runs: Dict[int, List[StoreRun]] = {}
+        self._rows = 0
+        index = self.root / _STORE_INDEX
+        if index.exists():
+            for fields in _STORE_RUN.iter_unpack(index.read_bytes()):
+                self._add_run(StoreRun(*fields))
+        self._whole: Optional[ReadingBatch] = None
+
+    def _add_run(self, run: StoreRun) -> None:
+        self._runs.setdefault(run.station_code, []).append(run)
+        self._rows = max(self._rows, run.stop)
+
+    def __len__(self) -> int:
+        return self._rows
+
+    def __repr__(self) -> str:
+        return f"ReadingStore({str(self.root)!r}, readings={self._rows}, stations={len(self.stations)})"
+
+    def append(self, readings: Iterable[Reading]) -> int:
+        """Append readings (or a ``ReadingBatch``/``BatchStream``) and return how many were written."""
+        if isinstance(readings, BatchStream):
+            return sum(self.append(batch) for batch in readings.batches())
+        batch = readings if isinstance(readings, ReadingBatch) else ReadingBatch.from_readings(readings)
+        if not len(batch):
+            return 0
+        known = len(self.stations)
+        remap = []
+        for station_id in batch.stations:
+            code = self._station_index.get(station_id)
+            if code is None:
+                code = self._station_index[station_id] = len(self.stations)
+                self.stations.append(station_id)
+            remap.append(code)
+
+        rows_by_code: Dict[int, List[int]] = {}
+        for row, code in enumerate(batch.station_codes):
+            rows_by_code.setdefault(code, []).append(row)
+
+        columns = {name: array(typecode) for name, typecode in _STORE_COLUMNS}
+        runs: List[StoreRun] = []
+        start = self._rows
+        for code, rows in rows_by_code.items():
+            stamps = [batch.epoch_us[row] for row in rows]
+            columns["station_codes"].extend([remap[code]] * len(rows))
+            columns["epoch_us"].extend(stamps)
+            columns["temperature_c"].extend(batch.temperature_c[row] for row in rows)
+            columns["rainfall_mm"].extend(batch.rainfall_mm[row] for row in rows)
+            ordered = all(a <= b for a, b in zip(stamps, stamps[1:]))
+            runs.append(StoreRun(remap[code], start, start + len(rows), min(stamps), max(stamps), ordered))
+            start += len(rows)
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        for name, values in columns.items():
+            with (self.root / name).open("ab") as handle:
+                # Drop whatever an interrupted append left past the indexed rows.
+                handle.truncate(self._rows * values.itemsize)
+                if sys.byteorder != "little":
+                    values.byteswap()
+                handle.write(values.tobytes())
+        if len(self.stations) != known or not (self.root / _STORE_META).exists():
+            (self.root / _STORE_META).write_text(json.dumps({"stations": self.stations}))
+        # The index is written last: rows only become visible once it lands.
+        with (self.root / _STORE_INDEX).open("ab") as handle:
+            handle.write(
+                b"".join(
+                    _STORE_RUN.pack(r.station_code, r.start, r.stop, r.min_epoch_us, r.max_epoch_us, r.ordered)
+                    for r in runs
+                )
+            )
+        for run in runs:
+            self._add_run(run)
+        self._whole = None
+        return len(batch)
+
+    def _map(self, name: str, typecode: str) -> Sequence:
+        if not self._rows:
+            return array(typecode)
+        with (self.root / name).open("rb") as handle:
+            mapped = mmap.mmap(handle.fileno(), self._rows * array(typecode).itemsize, access=mmap.ACCESS_READ)
+        if sys.byteorder == "little":
+            return memoryview(mapped).cast(typecode)
+        values = array(typecode)
+        values.frombytes(mapped)
+        values.byteswap()
+        return values
+
+    def _batch(self) -> ReadingBatch:
+        if self._whole is None:
+            # Mappings from before an append stay alive while a batch still uses them.
+            self._whole = ReadingBatch(stations=self.stations).with_columns(
+                *(self._map(name, typecode) for name, typecode in _STORE_COLUMNS)
+            )
+        return self._whole
+
+    def scan(
+        self,
+        stations: Optional[Iterable[str]] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+    ) -> Iterator[ReadingBatch]:
+        """
+        Yield stored readings for ``stations`` with ``start <= ts < end``, station by station.
+
+        ``None`` leaves that dimension unrestricted. Runs stored in timestamp
+        order are trimmed by bisecting the mapped timestamp column; only runs
+        that arrived out of order and straddle a bound are filtered into copies.
+        """
+        lo = to_epoch_us(start) if start is not None else None
+        hi = to_epoch_us(end) if end is not None else None
+        if stations is None:
+            codes: Iterable[int] = range(len(self.stations))
+        else:
+            codes = [self._station_index[s] for s in stations if s in self._station_index]
+        whole = self._batch()
+        stamps = whole.epoch_us
+        for code in codes:
+            for run in self._runs.get(code, ()):
+                if (lo is not None and run.max_epoch_us < lo) or (hi is not None and run.min_epoch_us >= hi):
+                    continue
+                first, stop = run.start, run.stop
+                inside = (lo is None or run.min_epoch_us >= lo) and (hi is None or run.max_epoch_us < hi)
+                if inside or run.ordered:
+                    if not inside and lo is not None:
+                        first = bisect_left(stamps, lo, first, stop)
+                    if not inside and hi is not None:
+                        stop = bisect_left(stamps, hi, first, stop)
+                    if first < stop:
+                        yield whole[first:stop]
+                    continue
+                keep = [
+                    row
+                    for row in range(first, stop)
+                    if (lo is None or stamps[row] >= lo) and (hi is None or stamps[row] < hi)
+                ]
+                if keep:
+                    yield whole.with_columns(
+                        array("I", (whole.station_codes[row] for row in keep)),
+                        array("q", (stamps[row] for row in keep)),
+                        array("d", (whole.temperature_c[row] for row in keep)),
+                        array("d", (whole.rainfall_mm[row] for row in keep)),
+                    )
+
+    def read(
+        self,
+        stations: Optional[Iterable[str]] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+    ) -> ReadingBatch:
+        """Return the matching readings as one batch (zero-copy when nothing is filtered out)."""
+        if stations is None and start is None and end is None:
+            return self._batch()
+        out = self._batch().with_columns(array("I"), array("q"), array("d"), array("d"))
+        columns = (out.station_codes, out.epoch_us, out.temperature_c, out.rainfall_mm)
+        for part in self.scan(stations, start, end):
+            parts = (part.station_codes, part.epoch_us, part.temperature_c, part.rainfall_mm)
+            for column, values in zip(columns, parts):
+                column.frombytes(memoryview(values).cast("B"))
+        return out
+
+
+def write_reading_store(path: Union[str, Path], readings: Iterable[Reading]) -> Path:
+    """Append readings to the columnar store at ``path``, creating it if needed."""
+    ReadingStore(path, create=True).append(readings)
+    return Path(path)
+
+
+_SUMMARY_STORE_VERSION = 1
+# Record layouts: the period key, then the summary fields. Period keys are
+# integers that sort chronologically: the ordinal date for days,
+# ``iso_year * 100 + iso_week`` for weeks and ``year * 100 + month``.
+# day: key, total rain, avg temp, count, min/max temp, max rainfall, max rate,
+# first/last observation (epoch us)
+_DAY_RECORD = struct.Struct("<qddqddddqq")
+# week: key, total rain, avg temp, days, max daily rain
+_WEEK_RECORD = struct.Struct("<qddqd")
+# month: key, total rain, avg/median temp, days, max daily rain, wettest day (epoch us)
+_MONTH_RECORD = struct.Struct("<qdddqdq")
+
+
+def _day_record(summary: DaySummary) -> tuple:
+    return (
+        summary.date.toordinal(),
+        summary.total_rain_mm,
+        summary.avg_temp_c,
+        summary.count,
+        summary.min_temp_c,
+        summary.max_temp_c,
+        summary.max_rainfall_mm,
+        summary.max_rain_rate_mm_per_hr,
+        to_epoch_us(summary.first_observation),
+        to_epoch_us(summary.last_observation),
+    )
+
+
+def _day_summary(station_id: str, record: tuple) -> DaySummary:
+    ordinal, total, avg, count, low, high, max_rain, max_rate, first_us, last_us = record
+    return DaySummary(
+        station_id=station_id,
+        date=datetime.fromordinal(ordinal),
+        total_rain_mm=total,
+        avg_temp_c=avg,
+        count=count,
+        min_temp_c=low,
+        max_temp_c=high,
+        max_rainfall_mm=max_rain,
+        max_rain_rate_mm_per_hr=max_rate,
+        first_observation=from_epoch_us(first_us),
+        last_observation=from_epoch_us(last_us),
+    )
+
+
+def _week_record(summary: WeekSummary) -> tuple:
+    return (
+        summary.iso_year * 100 + summary.iso_week,
+        summary.total_rain_mm,
+        summary.avg_temp_c,
+        summary.days,
+        summary.max_daily_rain_mm,
+    )
+
+
+def _week_summary(station_id: str, record: tuple) -> WeekSummary:
+    key, total, avg, days, max_daily = record
+    return WeekSummary(station_id, *divmod(key, 100), total, avg, days, max_daily)
+
+
+def _month_record(summary: MonthSummary) -> tuple:
+    return (
+        summary.year * 100 + summary.month,
+        summary.total_rain_mm,
+        summary.avg_temp_c,
+        summary.median_temp_c,
+        summary.days,
+        summary.max_daily_rain_mm,
+        to_epoch_us(summary.wettest_day),
+    )
+
+
+def _month_summary(station_id: str, record: tuple) -> MonthSummary:
+    key, total, avg, median, days, max_daily, wettest_us = record
+    return MonthSummary(station_id, *divmod(key, 100), total, avg, median, days, max_daily, from_epoch_us(wettest_us))
+
+
+def _week_key(day: date) -> int:
+    iso_year, iso_week, _ = day.isocalendar()
+    return iso_year * 100 + iso_week
+
+
+class _PackedRecords:
+    """Read-only run of packed records, unpacked on access."""
+
+    __slots__ = ("buffer", "layout", "start", "stop")
+
+    def __init__(self, buffer: memoryview, layout: struct.Struct, start: int, stop: int) -> None:
+        self.buffer = buffer
+        self.layout = layout
+        self.start = start
+        self.stop = stop
+
+    def __len__(self) -> int:
+        return self.stop - self.start
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[tuple, List[tuple]]:
+        if isinstance(index, slice):
+            first, last, _ = index.indices(len(self))
+            return list(self.layout.iter_unpack(self.raw(first, last)))
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self.layout.unpack_from(self.buffer, (self.start + index) * self.layout.size)
+
+    def __iter__(self) -> Iterator[tuple]:
+        return self.layout.iter_unpack(self.raw())
+
+    def raw(self, first: int = 0, last: Optional[int] = None) -> memoryview:
+        size = self.layout.size
+        last = len(self) if last is None else max(last, first)
+        return self.buffer[(self.start + first) * size : (self.start + last) * size]
+
+
+class _SeriesIndex:
+    """
+    One station's records of one kind, sorted by period key.
+
+    After ``SummaryStore.load`` both lists are views into the mapped files;
+    the first ``upsert`` turns them into plain lists.
+    """
+
+    __slots__ = ("keys", "records")
+
+    def __init__(self) -> None:
+        self.keys: Sequence[int] = []
+        self.records: Sequence[tuple] = []
+
+    def upsert(self, records: Iterable[tuple]) -> None:
+        merged = dict(zip(self.keys, self.records))
+        merged.update((record[0], record) for record in records)
+        self.keys = sorted(merged)
+        self.records = [merged[key] for key in self.keys]
+
+    def get(self, key: int) -> Optional[tuple]:
+        i = bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return self.records[i]
+        return None
+
+    def between(self, lo: Optional[int], hi: Optional[int]) -> List[tuple]:
+        start = 0 if lo is None else bisect_left(self.keys, lo)
+        stop = len(self.keys) if hi is None else bisect_right(self.keys, hi)
+        return self.records[start:stop]
+
+
+class SummaryStore:
+    """
+    Day, week and month summaries indexed by (station, period).
+
+    Every station keeps its summaries of each kind sorted by period, so
+    point lookups and range queries bisect instead of scanning; a range over
+    all stations costs one bisection per station plus the matches. Summaries
+    are held as plain records and only the ones a query returns are turned
+    back into dataclasses, which keeps loading a saved store cheap. Adding a
+    summary for a (station, period) already present replaces it.
+
+    Ranges are inclusive and take dates (or datetimes): weeks and months
+    match when their ISO week or calendar month is between those of
+    ``start`` and ``end``.
+    """
+
+    _KINDS = (
+        ("days", _DAY_RECORD, _day_record, _day_summary),
+        ("weeks", _WEEK_RECORD, _week_record, _week_summary),
+        ("months", _MONTH_RECORD, _month_record, _month_summary),
+    )
+
+    def __init__(self) -> None:
+        self._series: Dict[str, Dict[str, _SeriesIndex]] = {kind: {} for kind, *_ in self._KINDS}
+
+    @classmethod
+    def from_summaries(
+        cls,
+        days: Iterable[DaySummary] = (),
+        weeks: Iterable[WeekSummary] = (),
+        months: Iterable[MonthSummary] = (),
+    ) -> "SummaryStore":
+        store = cls()
+        store.add_days(days)
+        store.add_weeks(weeks)
+        store.add_months(months)
+        return store
+
+    def __len__(self) -> int:
+        return sum(len(index.keys) for series in self._series.values() for index in series.values())
+
+    def __repr__(self) -> str:
+        counts = ", ".join(
+            f"{kind}={sum(len(index.keys) for index in series.values())}" for kind, series in self._series.items()
+        )
+        return f"SummaryStore(stations={len(self.stations())}, {counts})"
+
+    def _add(self, kind: str, summaries: Iterable, to_record: Callable) -> None:
+        grouped: Dict[str, List[tuple]] = {}
+        for summary in summaries:
+            grouped.setdefault(summary.station_id, []).append(to_record(summary))
+        series = self._series[kind]
+        for station_id, records in grouped.items():
+            index = series.get(station_id)
+            if index is None:
+                index = series[station_id] = _SeriesIndex()
+            index.upsert(records)
+
+    def add_days(self, summaries: Iterable[DaySummary]) -> None:
+        self._add("days", summaries, _day_record)
+
+    def add_weeks(self, summaries: Iterable[WeekSummary]) -> None:
+        self._add("weeks", summaries, _week_record)
+
+    def add_months(self, summaries: Iterable[MonthSummary]) -> None:
+        self._add("months", summaries, _month_record)
+
+    def stations(self) -> List[str]:
+        return sorted(set().union(*self._series.values()))
+
+    def _point(self, kind: str, station_id: str, key: int, to_summary: Callable):
+        index = self._series[kind].get(station_id)
+        record = index.get(key) if index is not None else None
+        return to_summary(station_id, record) if record is not None else None
+
+    def _range(
+        self, kind: str, station: Optional[str], lo: Optional[int], hi: Optional[int], to_summary: Callable
+    ) -> list:
+        series = self._series[kind]
+        station_ids = sorted(series) if station is None else [station] if station in series else []
+        return [
+            to_summary(station_id, record)
+            for station_id in station_ids
+            for record in series[station_id].between(lo, hi)
+        ]
+
+    def day(self, station_id: str, day: date) -> Optional[DaySummary]:
+        return self._point("days", station_id, day.toordinal(), _day_summary)
+
+    def week(self, station_id: str, iso_year: int, iso_week: int) -> Optional[WeekSummary]:
+        return self._point("weeks", station_id, iso_year * 100 + iso_week, _week_summary)
+
+    def month(self, station_id: str, year: int, month: int) -> Optional[MonthSummary]:
+        return self._point("months", station_id, year * 100 + month, _month_summary)
+
+    def days(
+        self, station: Optional[str] = None, start: Optional[date] = None, end: Optional[date] = None
+    ) -> List[DaySummary]:
+        """Day summaries with ``start <= date <= end``, ordered by station and date."""
+        lo = start.toordinal() if start is not None else None
+        hi = end.toordinal() if end is not None else None
+        return self._range("days", station, lo, hi, _day_summary)
+
+    def weeks(
+        self, station: Optional[str] = None, start: Optional[date] = None, end: Optional[date] = None
+    ) -> List[WeekSummary]:
+        """Weekly rollups for the ISO weeks from ``start`` through ``end``."""
+        lo = _week_key(start) if start is not None else None
+        hi = _week_key(end) if end is not None else None
+        return self._range("weeks", station, lo, hi, _week_summary)
+
+    def months(
+        self, station: Optional[str] = None, start: Optional[date] = None, end: Optional[date] = None
+    ) -> List[MonthSummary]:
+        """Monthly rollups for the calendar months from ``start`` through ``end``."""
+        lo = start.year * 100 + start.month if start is not None else None
+        hi = end.year * 100 + end.month if end is not None else None
+        return self._range("months", station, lo, hi, _month_summary)
+
+    def save(self, root: Union[str, Path]) -> Path:
+        """
+        Write the store under ``root``, replacing the files atomically with the metadata last.
+
+        Each kind gets a file of packed records and a file of their int64 keys,
+        both ordered by station and period; ``meta.json`` lists the stations and
+        how many records each has per kind.
+        """
+        target = Path(root)
+        target.mkdir(parents=True, exist_ok=True)
+        stations = self.stations()
+        counts: Dict[str, List[int]] = {}
+        for kind, layout, _, _ in self._KINDS:
+            series = self._series[kind]
+            indexes = [series.get(station_id, _SeriesIndex()) for station_id in stations]
+            counts[kind] = [len(index.keys) for index in indexes]
+            keys = array("q")
+            for index in indexes:
+                keys.extend(index.keys)
+            if sys.byteorder != "little":
+                keys.byteswap()
+            pack = layout.pack
+            records = b"".join(
+                index.records.raw() if isinstance(index.records, _PackedRecords)
+                else b"".join(pack(*record) for record in index.records)
+                for index in indexes
+            )
+            for suffix, payload in ((".keys", keys.tobytes()), (".bin", records)):
+                tmp = target / f"{kind}{suffix}.tmp"
+                tmp.write_bytes(payload)
+                os.replace(tmp, target / f"{kind}{suffix}")
+        tmp = target / f"{_STORE_META}.tmp"
+        tmp.write_text(json.dumps({"version": _SUMMARY_STORE_VERSION, "stations": stations, "counts": counts}))
+        os.replace(tmp, target / _STORE_META)
+        return target
+
+    @classmethod
+    def load(cls, root: Union[str, Path]) -> "SummaryStore":
+        """Open a saved store; the files are memory-mapped and records unpacked only when queried."""
+        source = Path(root)
+        meta_path = source / _STORE_META
+        if not meta_path.exists():
+            raise FileNotFoundError(f"No summary store at {source}")
+        meta = json.loads(meta_path.read_text())
+        if meta.get("version") != _SUMMARY_STORE_VERSION:
+            raise ValueError(f"{source}: unsupported summary store version {meta.get('version')!r}")
+        store = cls()
+        for kind, layout, _, _ in cls._KINDS:
+            counts = meta["counts"][kind]
+            total = sum(counts)
+            if not total:
+                continue
+            keys = _map_file(source / f"{kind}.keys", "q", total)
+            records = _map_file(source / f"{kind}.bin", "B", total * layout.size)
+            series = store._series[kind]
+            start = 0
+            for station_id, count in zip(meta["stations"], counts):
+                if count:
+                    index = series[station_id] = _SeriesIndex()
+                    index.keys = keys[start : start + count]
+                    index.records = _PackedRecords(records, layout, start, start + count)
+                start += count
+        return store
+
+
+def _map_file(path: Path, typecode: str, length: int) -> Sequence:
+    """Map ``length`` little-endian items of ``typecode`` from ``path``."""
+    with path.open("rb") as handle:
+        mapped = mmap.mmap(handle.fileno(), length * array(typecode).itemsize, access=mmap.ACCESS_READ)
+    if sys.byteorder == "little" or typecode == "B":
+        return memoryview(mapped).cast(typecode)
+    values = array(typecode)
+    values.frombytes(mapped)
+    values.byteswap()
+    return values
+
+
+def write_summary_store(path: Union[str, Path], result: PlanResult) -> Path:
+    """Merge a plan result's day/week/month summaries into the summary store at ``path``."""
+    target = Path(path)
+    store = SummaryStore.load(target) if (target / _STORE_META).exists() else SummaryStore()
+    store.add_days(result.days.values())
+    store.add_weeks((result.weeks or {}).values())
+    store.add_months((result.months or {}).values())
+    return store.save(target)
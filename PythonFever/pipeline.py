@@ -0,0 +1,388 @@
+"""
+Dataflow planning for an analysis run.
+
+``plan_pipeline`` turns an ``AggregationPlan`` and the run's execution
+options into the smallest graph of operators that produces the requested
+outputs; ``Pipeline.run`` wires exactly those operators together and
+executes them in a single pass over the readings. Every batch the source
+yields is handed to each operator that consumes it (the reading store
+writer, day aggregation, the per-station sequence detectors) before the
+next batch is produced, so a generated or parsed feed is never produced
+twice. Readings are only gathered into one ``ReadingBatch`` when an operator
+needs random access to them; ``explain`` says which one and why.
+"""
+import queue
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field, replace
+from itertools import islice
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from aggregator import (
+    DAY_OUTPUTS,
+    SEQUENCE_OUTPUTS,
+    AggregationPlan,
+    DayAccumulator,
+    PlanResult,
+    RainEvent,
+    RainEventDetector,
+    add_day_rows,
+    derive_day_outputs,
+)
+from alerts import AlertEngine
+from analytics import DrySpellDetector
+from cache import DEFAULT_PENDING_ROWS, CachedDayAggregator
+from model import BatchStream, Reading, ReadingBatch, ReorderBuffer, Row, as_batch
+from parallel import StationSharder, execute_shards
+from persistence import ReadingStore, write_reading_store
+from vectorized import aggregate_day_vectorized
+from windowing import WindowAggregator
+
+if TYPE_CHECKING:
+    from alerts import Alert
+    from analytics import DrySpell
+    from cache import SummaryCache
+    from export import ExportScheduler
+    from instrument import StageMetrics
+
+# Outputs derived from day summaries once the pass is over.
+_DAY_ROLLUPS = ("week", "month", "percentiles")
+# Batches queued for the reading store writer before the pass waits for it.
+STORE_QUEUE_DEPTH = 4
+# Rows handed to row-consuming operators at a time.
+ROW_CHUNK = 8192
+
+
+@dataclass(frozen=True)
+class Operator:
+    name: str
+    inputs: Tuple[str, ...] = ()
+    # Why the operator needs every reading at once, if it does.
+    materializes: Optional[str] = None
+    # How the operator runs, when that is not obvious from its name.
+    note: Optional[str] = None
+
+
+@dataclass
+class Pipeline:
+    """Operators of one run in dependency order; build it with ``plan_pipeline``."""
+
+    plan: AggregationPlan
+    operators: List[Operator] = field(default_factory=list)
+    workers: int = 1
+    cached: bool = False
+    store: Optional[Path] = None
+
+    @property
+    def names(self) -> List[str]:
+        return [operator.name for operator in self.operators]
+
+    @property
+    def materializes(self) -> bool:
+        return any(operator.materializes for operator in self.operators)
+
+    def explain(self) -> str:
+        """One line per operator: its inputs and, if it materializes the readings, why."""
+        width = max(len(name) for name in self.names)
+        lines = []
+        for operator in self.operators:
+            line = f"{operator.name:<{width}} <- {', '.join(operator.inputs) or 'source'}"
+            if operator.note:
+                line += f" ({operator.note})"
+            if operator.materializes:
+                line += f" [materializes: {operator.materializes}]"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def run(
+        self,
+        readings: Iterable[Reading],
+        *,
+        cache: Optional["SummaryCache"] = None,
+        exports: Optional["ExportScheduler"] = None,
+        source_metrics: Optional["StageMetrics"] = None,
+    ) -> PlanResult:
+        """
+        Execute the pipeline over ``readings`` in one pass.
+
+        ``cache`` must be given if the pipeline was planned with one. The
+        reading store is written on an ``exports`` thread while the pass is
+        running, or inline without a scheduler. ``source_metrics`` is credited
+        with the time spent producing each batch and with the readings and
+        batches produced.
+        """
+        if self.cached and cache is None:
+            raise ValueError("pipeline was planned with a day summary cache")
+        plan = self.plan
+        result = PlanResult()
+        # What each operator hands its output to: whole batches, or chunks of rows.
+        feeds: Dict[str, List[Callable[[ReadingBatch], None]]] = {name: [] for name in self.names}
+        row_feeds: Dict[str, List[Callable[[List[Row]], None]]] = {name: [] for name in self.names}
+        # Run in operator order once the pass is over.
+        finishers: List[Callable[[], None]] = []
+        shard_results: List[PlanResult] = []
+        channel: Optional[_BatchChannel] = None
+        # Without a cache, sharded runs get their day summaries from the pool too.
+        days_from_shard = any(operator.name == "day" and operator.inputs == ("shard",) for operator in self.operators)
+
+        def push(name: str, batch: ReadingBatch) -> None:
+            for feed in feeds[name]:
+                feed(batch)
+            handlers = row_feeds[name]
+            if handlers:
+                rows = batch.rows()
+                while True:
+                    chunk = list(islice(rows, ROW_CHUNK))
+                    if not chunk:
+                        break
+                    for handler in handlers:
+                        handler(chunk)
+
+        for operator in self.operators:
+            name = operator.name
+            source = operator.inputs[0] if operator.inputs else None
+            if name == "write_store":
+                if exports is not None:
+                    channel = _BatchChannel()
+                    channel.future = exports.submit(write_reading_store, self.store, BatchStream(channel.batches))
+                    feeds[source].append(channel.put)
+                else:
+                    feeds[source].append(ReadingStore(self.store, create=True).append)
+            elif name == "columns":
+                finishers.append(_gather(feeds[source], lambda batch: push("columns", batch)))
+            elif name == "shard":
+                sharder = StationSharder(self.workers)
+                feeds[source].append(sharder.add)
+                shard_plan = plan if days_from_shard else replace(plan, outputs=plan.outputs & SEQUENCE_OUTPUTS)
+                finishers.append(
+                    lambda: shard_results.append(execute_shards(sharder.parts(), shard_plan, self.workers))
+                )
+            elif name == "day" and not days_from_shard:
+                if self.cached:
+                    aggregator = CachedDayAggregator(cache, engine=plan.engine, zones=plan.zones)
+                    feeds[source].append(aggregator.add)
+                    finishers.append(lambda: result.days.update(aggregator.finish()))
+                elif plan.engine == "numpy":
+                    feeds[source].append(lambda batch: result.days.update(aggregate_day_vectorized(batch, plan.zones)))
+                else:
+                    accumulators: Dict[Tuple[str, int], DayAccumulator] = {}
+                    row_feeds[source].append(lambda rows: add_day_rows(accumulators, rows, plan.zones))
+                    finishers.append(
+                        lambda: result.days.update(
+                            {(acc.station_id, acc.date_key): acc.to_summary() for acc in accumulators.values()}
+                        )
+                    )
+            elif name == "reorder" and source != "shard":
+                detectors = _SequenceDetectors(plan)
+                row_feeds[source].append(detectors.add_rows)
+                finishers.append(lambda: detectors.finish(result))
+            # The detectors behind "reorder" and the day rollups are filled in by
+            # the operators above and by ``derive_day_outputs``; sharded ones by the pool.
+
+        batches = _source_batches(readings)
+        if source_metrics is not None:
+            batches = _measured(batches, source_metrics)
+        try:
+            for batch in batches:
+                push("read", batch)
+        except BaseException:
+            if channel is not None:
+                channel.close(failed=True)
+            raise
+        if channel is not None:
+            channel.close()
+        for finish in finishers:
+            finish()
+
+        if days_from_shard:
+            return shard_results[0]
+        if shard_results:
+            for name in ("events", "dry_spells", "windows", "window_peaks", "alerts"):
+                setattr(result, name, getattr(shard_results[0], name))
+        derive_day_outputs(result, plan)
+        return result
+
+
+def plan_pipeline(
+    plan: AggregationPlan,
+    *,
+    workers: int = 1,
+    cached: bool = False,
+    store: Optional[Union[str, Path]] = None,
+) -> Pipeline:
+    """
+    Build the operators ``plan`` needs, given how the run executes.
+
+    ``cached`` says whether a day summary cache is available and ``store``
+    names a reading store every reading is also appended to. Outputs that
+    nothing asked for get no operator, and day aggregation is left out
+    entirely when only sequence outputs are requested.
+    """
+    outputs = plan.outputs
+    needs_days = bool(outputs & DAY_OUTPUTS)
+    sequences = [name for name in sorted(SEQUENCE_OUTPUTS) if name in outputs]
+    cached = cached and needs_days
+    operators = [Operator("read")]
+    if store is not None:
+        operators.append(Operator("write_store", ("read",)))
+
+    days_from = sequences_from = "read"
+    day_note = f"{plan.engine} engine"
+    if cached:
+        day_note = f"cached, buffers up to {DEFAULT_PENDING_ROWS:,} readings of unresolved days"
+    elif needs_days and plan.engine == "numpy" and workers <= 1:
+        operators.append(Operator("columns", ("read",), "the numpy engine aggregates whole columns"))
+        days_from = "columns"
+    if workers > 1 and (sequences or not cached):
+        # Cached days are resolved in this process; the pool only runs what is left.
+        operators.append(Operator("shard", ("read",), f"{workers} worker processes receive whole station shards"))
+        sequences_from = "shard"
+        if not cached:
+            days_from = "shard"
+    if needs_days:
+        operators.append(Operator("day", (days_from,), note=day_note))
+    if sequences:
+        operators.append(Operator("reorder", (sequences_from,)))
+        operators.extend(Operator(name, ("reorder",)) for name in sequences)
+    operators.extend(Operator(name, ("day",)) for name in _DAY_ROLLUPS if name in outputs)
+    return Pipeline(plan, operators, workers=workers, cached=cached, store=Path(store) if store else None)
+
+
+def _source_batches(readings: Iterable[Reading]) -> Iterator[ReadingBatch]:
+    if isinstance(readings, BatchStream):
+        yield from readings.batches()
+    else:
+        yield as_batch(readings)
+
+
+def _measured(batches: Iterator[ReadingBatch], metrics: "StageMetrics") -> Iterator[ReadingBatch]:
+    # Generated and parsed feeds are produced while the pass pulls them, so
+    # only the pulls themselves are timed.
+    while True:
+        cpu_started = time.process_time()
+        started = time.perf_counter()
+        batch = next(batches, None)
+        metrics.wall_seconds += time.perf_counter() - started
+        metrics.cpu_seconds += time.process_time() - cpu_started
+        if batch is None:
+            return
+        metrics.readings += len(batch)
+        metrics.items += 1
+        yield batch
+
+
+def _gather(feeds: List[Callable[[ReadingBatch], None]], emit: Callable[[ReadingBatch], None]) -> Callable[[], None]:
+    # Collect every batch on ``feeds`` and emit them as one once the pass is over.
+    gathered: List[ReadingBatch] = []
+    feeds.append(gathered.append)
+
+    def finish() -> None:
+        if gathered:
+            emit(gathered[0] if len(gathered) == 1 else BatchStream(lambda: gathered).to_batch())
+
+    return finish
+
+
+class _SequenceDetectors:
+    # The event and dry-spell state machines, the window aggregator and the
+    # alert engine behind one per-station reorder buffer, so nothing is sorted
+    # or kept around beyond ``plan.reorder_window`` readings per station (and
+    # the open windows).
+
+    def __init__(self, plan: AggregationPlan) -> None:
+        outputs = plan.outputs
+        self.events: List[RainEvent] = []
+        self.spells: List["DrySpell"] = []
+        self.alerts: List["Alert"] = []
+        self.event_detector = (
+            RainEventDetector(plan.events_threshold_mm, plan.events_gap) if "events" in outputs else None
+        )
+        self.spell_detector = (
+            DrySpellDetector(plan.dry_threshold_mm, plan.dry_min_duration, plan.dry_gap)
+            if "dry_spells" in outputs
+            else None
+        )
+        self.window_aggregator = WindowAggregator(plan.windows) if "windows" in outputs else None
+        self.alert_engine = AlertEngine(plan.alert_rules, zones=plan.zones) if "alerts" in outputs else None
+        self.buffer = ReorderBuffer(plan.reorder_window)
+
+    def add_rows(self, rows: Iterable[Row]) -> None:
+        push, detect = self.buffer.push, self.detect
+        for row in rows:
+            released = push(row)
+            if released is not None:
+                detect(released)
+
+    def detect(self, row: Row) -> None:
+        station_id, ts, temperature_c, rainfall_mm = row
+        if self.event_detector is not None:
+            event = self.event_detector.update(station_id, ts, rainfall_mm)
+            if event is not None:
+                self.events.append(event)
+        if self.spell_detector is not None:
+            spell = self.spell_detector.update(station_id, ts, rainfall_mm)
+            if spell is not None:
+                self.spells.append(spell)
+        if self.window_aggregator is not None:
+            self.window_aggregator.update(station_id, ts, temperature_c, rainfall_mm)
+        if self.alert_engine is not None:
+            fired = self.alert_engine.update(station_id, ts, temperature_c, rainfall_mm)
+            if fired:
+                self.alerts.extend(fired)
+
+    def finish(self, result: PlanResult) -> None:
+        for released in self.buffer.drain():
+            self.detect(released)
+        if self.event_detector is not None:
+            self.events.extend(self.event_detector.flush())
+            result.events = sorted(self.events, key=lambda e: (e.station_id, e.start))
+        if self.spell_detector is not None:
+            self.spells.extend(self.spell_detector.flush())
+            result.dry_spells = sorted(self.spells, key=lambda s: (s.station_id, s.start))
+        if self.window_aggregator is not None:
+            windows = self.window_aggregator.flush()
+            result.windows = sorted(windows, key=lambda w: (w.station_id, w.end - w.start, w.start))
+            result.window_peaks = self.window_aggregator.peaks()
+        if self.alert_engine is not None:
+            result.alerts = sorted(self.alerts, key=lambda a: (a.station_id, a.ts))
+
+
+_DONE = object()
+_FAILED = object()
+
+
+class _BatchChannel:
+    # Bounded hand-off of batches from the pass to a writer on an export
+    # thread. ``put`` waits while the writer is behind, and gives up with the
+    # writer's error if it stops early.
+
+    def __init__(self, depth: int = STORE_QUEUE_DEPTH) -> None:
+        self._queue: "queue.Queue[object]" = queue.Queue(maxsize=depth)
+        self.future: Optional[Future] = None
+
+    def _offer(self, item: object) -> bool:
+        while True:
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                if self.future is not None and self.future.done():
+                    return False
+
+    def put(self, batch: ReadingBatch) -> None:
+        if not self._offer(batch):
+            self.future.result()
+            raise RuntimeError("the reading store writer stopped before the end of the readings")
+
+    def close(self, *, failed: bool = False) -> None:
+        self._offer(_FAILED if failed else _DONE)
+
+    def batches(self) -> Iterator[ReadingBatch]:
+        while True:
+            item = self._queue.get()
+            if item is _DONE:
+                return
+            if item is _FAILED:
+                raise RuntimeError("the analysis failed before every reading was stored")
+            yield item
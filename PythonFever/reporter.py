@@ -1,7 +1,15 @@
-from typing import Iterable, Mapping, Optional
+import os
+import sys
+from datetime import datetime
+from json.encoder import encode_basestring_ascii
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Sequence, TextIO, Tuple
 
-from aggregator import DaySummary, MonthSummary, RainEvent
-from analytics import DrySpell, classify_day_severity
+from aggregator import DaySummary, MonthSummary, RainEvent, WeekSummary
+from alerts import Alert
+from analytics import DrySpell, classify_day_severities, classify_day_severity
+from export import ExportReport
+from instrument import StageMetrics
+from windowing import WindowPeak, WindowSummary, format_duration
 
 
 def rain_alert(summary: DaySummary, threshold_mm: float = 10.0) -> bool:
@@ -30,56 +38,123 @@ def temperature_alert(
     return low_hit or high_hit
 
 
-def render(summary: DaySummary) -> str:
-    severity = classify_day_severity(summary)
-    return (
-        f"[{summary.station_id}] {summary.date.date()} | "
-        f"rain={summary.total_rain_mm:.2f} mm ({severity}) | "
-        f"avgT={summary.avg_temp_c:.1f} °C "
-        f"(min={summary.min_temp_c:.1f}/max={summary.max_temp_c:.1f}) | "
-        f"peakRain={summary.max_rainfall_mm:.2f} mm | "
-        f"peakIntensity={summary.max_rain_rate_mm_per_hr:.1f} mm/h | "
-        f"n={summary.count}"
+_DAY_ROW = (
+    "[{}] {} | rain={:.2f} mm ({}) | avgT={:.1f} °C (min={:.1f}/max={:.1f}) | "
+    "peakRain={:.2f} mm | peakIntensity={:.1f} mm/h | n={}"
+).format
+_DAY_DETAILED = (
+    "Station {} on {}\n"
+    "  Observations : {}\n"
+    "  Window       : {} -> {}\n"
+    "  Rain total   : {:.2f} mm ({}) (mean {:.1f} mm/h, peak {:.1f} mm/h)\n"
+    "  Temperature  : avg {:.1f} °C (min {:.1f} °C / max {:.1f} °C)"
+).format
+
+
+def _day_line(summary: DaySummary, severity: str) -> str:
+    return _DAY_ROW(
+        summary.station_id,
+        summary.date.date(),
+        summary.total_rain_mm,
+        severity,
+        summary.avg_temp_c,
+        summary.min_temp_c,
+        summary.max_temp_c,
+        summary.max_rainfall_mm,
+        summary.max_rain_rate_mm_per_hr,
+        summary.count,
     )
 
 
-def render_detailed(summary: DaySummary) -> str:
+def _day_detailed(summary: DaySummary, severity: str) -> str:
     duration = summary.last_observation - summary.first_observation
     duration_hours = duration.total_seconds() / 3600 if summary.count > 1 else 0.0
     mean_rate = summary.total_rain_mm / duration_hours if duration_hours > 0 else summary.total_rain_mm
-    severity = classify_day_severity(summary)
-    return (
-        f"Station {summary.station_id} on {summary.date.date()}\n"
-        f"  Observations : {summary.count}\n"
-        f"  Window       : {summary.first_observation.isoformat()} -> {summary.last_observation.isoformat()}\n"
-        f"  Rain total   : {summary.total_rain_mm:.2f} mm ({severity}) "
-        f"(mean {mean_rate:.1f} mm/h, peak {summary.max_rain_rate_mm_per_hr:.1f} mm/h)\n"
-        f"  Temperature  : avg {summary.avg_temp_c:.1f} °C "
-        f"(min {summary.min_temp_c:.1f} °C / max {summary.max_temp_c:.1f} °C)"
+    return _DAY_DETAILED(
+        summary.station_id,
+        summary.date.date(),
+        summary.count,
+        summary.first_observation.isoformat(),
+        summary.last_observation.isoformat(),
+        summary.total_rain_mm,
+        severity,
+        mean_rate,
+        summary.max_rain_rate_mm_per_hr,
+        summary.avg_temp_c,
+        summary.min_temp_c,
+        summary.max_temp_c,
     )
 
 
+def render(summary: DaySummary) -> str:
+    return _day_line(summary, classify_day_severity(summary))
+
+
+def render_detailed(summary: DaySummary) -> str:
+    return _day_detailed(summary, classify_day_severity(summary))
+
+
+def render_days(summaries: Sequence[DaySummary], *, detailed: bool = False) -> List[str]:
+    """``render``/``render_detailed`` for many summaries, classifying their severity in one batch."""
+    line = _day_detailed if detailed else _day_line
+    return list(map(line, summaries, classify_day_severities(summaries)))
+
+
+_EVENT_ROW = "[{}] {} -> {} duration={} total={:.2f} mm peak={:.1f} mm/h readings={}".format
+
+
 def render_events(events: Iterable[RainEvent]) -> str:
     lines = []
+    row = _EVENT_ROW
     for event in events:
         duration = event.end - event.start
         rate = event.total_rain_mm / max(duration.total_seconds() / 3600.0, 1e-6)
         peak = max(event.peak_intensity_mm_per_hr, rate, event.total_rain_mm)
         lines.append(
-            f"[{event.station_id}] {event.start.isoformat()} -> {event.end.isoformat()} "
-            f"duration={duration} total={event.total_rain_mm:.2f} mm "
-            f"peak={peak:.1f} mm/h readings={event.readings}"
+            row(
+                event.station_id,
+                event.start.isoformat(),
+                event.end.isoformat(),
+                duration,
+                event.total_rain_mm,
+                peak,
+                event.readings,
+            )
         )
     return "\n".join(lines)
 
 
+_WEEK_ROW = "[{}] ISO {}-W{:02d} | rain={:.2f} mm | avgT={:.1f} °C | days={} | maxDaily={:.2f} mm".format
+
+
+def render_week(summary: WeekSummary) -> str:
+    return _WEEK_ROW(
+        summary.station_id,
+        summary.iso_year,
+        summary.iso_week,
+        summary.total_rain_mm,
+        summary.avg_temp_c,
+        summary.days,
+        summary.max_daily_rain_mm,
+    )
+
+
+_MONTH_ROW = (
+    "[{}] {}-{:02d} | rain={:.2f} mm | avgT={:.1f} °C (median={:.1f}) | days={} | maxDaily={:.2f} mm on {}"
+).format
+
+
 def render_month(summary: MonthSummary) -> str:
-    return (
-        f"[{summary.station_id}] {summary.year}-{summary.month:02d} | "
-        f"rain={summary.total_rain_mm:.2f} mm | "
-        f"avgT={summary.avg_temp_c:.1f} °C (median={summary.median_temp_c:.1f}) | "
-        f"days={summary.days} | maxDaily={summary.max_daily_rain_mm:.2f} mm "
-        f"on {summary.wettest_day.date()}"
+    return _MONTH_ROW(
+        summary.station_id,
+        summary.year,
+        summary.month,
+        summary.total_rain_mm,
+        summary.avg_temp_c,
+        summary.median_temp_c,
+        summary.days,
+        summary.max_daily_rain_mm,
+        summary.wettest_day.date(),
     )
 
 
@@ -93,11 +168,340 @@ def render_percentiles(percentiles: Mapping[float, float]) -> str:
     return " | ".join(parts)
 
 
+_SPELL_ROW = "[{}] {} -> {} duration={:.1f} h readings={}".format
+
+
 def render_dry_spells(spells: Iterable[DrySpell]) -> str:
+    row = _SPELL_ROW
+    return "\n".join(
+        row(spell.station_id, spell.start.isoformat(), spell.end.isoformat(), spell.duration_hours, spell.readings)
+        for spell in spells
+    )
+
+
+_WINDOW_ROW = (
+    "[{}] {} -> {} | rain={:.2f} mm ({:.2f} mm/h) | peakRain={:.2f} mm | "
+    "avgT={:.1f} °C (min={:.1f}/max={:.1f}) | n={}"
+).format
+
+
+def render_windows(summaries: Iterable[WindowSummary]) -> str:
+    row = _WINDOW_ROW
+    return "\n".join(
+        row(
+            summary.station_id,
+            summary.start.isoformat(),
+            summary.end.isoformat(),
+            summary.total_rain_mm,
+            summary.intensity_mm_per_hr,
+            summary.max_rainfall_mm,
+            summary.avg_temp_c,
+            summary.min_temp_c,
+            summary.max_temp_c,
+            summary.count,
+        )
+        for summary in summaries
+    )
+
+
+def render_window_peaks(peaks: Iterable[WindowPeak]) -> str:
     lines = []
-    for spell in spells:
+    for peak in peaks:
         lines.append(
-            f"[{spell.station_id}] {spell.start.isoformat()} -> {spell.end.isoformat()} "
-            f"duration={spell.duration_hours:.1f} h readings={spell.readings}"
+            f"[{peak.station_id}] wettest {format_duration(peak.window)} | "
+            f"rain={peak.total_rain_mm:.2f} mm ({peak.intensity_mm_per_hr:.2f} mm/h) | "
+            f"{peak.start.isoformat()} -> {peak.end.isoformat()}"
         )
     return "\n".join(lines)
+
+
+_ALERT_ROW = "[{}] {} {} {} (value={:.2f})".format
+
+
+def render_alerts(alerts: Iterable[Alert]) -> str:
+    row = _ALERT_ROW
+    return "\n".join(
+        row(
+            alert.station_id,
+            alert.ts.isoformat(),
+            "RAISED" if alert.raised else "cleared",
+            alert.rule.label,
+            alert.value,
+        )
+        for alert in alerts
+    )
+
+
+def render_export_report(reports: Iterable[ExportReport]) -> str:
+    lines = []
+    for report in reports:
+        rate = report.bytes / report.write_seconds / 1e6 if report.write_seconds > 0 else 0.0
+        lines.append(
+            f"{report.path} | {report.bytes} bytes | write={report.write_seconds * 1000:.1f} ms "
+            f"({rate:.1f} MB/s) | fsync={report.fsync_seconds * 1000:.1f} ms"
+        )
+    return "\n".join(lines)
+
+
+def render_stage_report(stages: Iterable[StageMetrics]) -> str:
+    lines = []
+    for metrics in stages:
+        peak = f"{metrics.peak_bytes / 1e6:.1f} MB" if metrics.peak_bytes is not None else "-"
+        rate = f"{metrics.readings_per_s:,.0f} readings/s" if metrics.readings else "-"
+        lines.append(
+            f"{metrics.name} | wall={metrics.wall_seconds * 1000:.1f} ms | cpu={metrics.cpu_seconds * 1000:.1f} ms | "
+            f"{rate} | items={metrics.items} | peak={peak}"
+        )
+    return "\n".join(lines)
+
+
+REPORT_FORMATS = ("text", "tsv", "ndjson")
+
+
+class ReportSink:
+    """
+    Buffered line output for reports.
+
+    ``write`` appends a line (or a block of lines) the way ``print`` would,
+    but lines are joined and written in chunks of about ``chunk_chars``.
+    On a terminal every ``write_lines`` call is flushed right away so
+    output keeps appearing as sections complete; into a pipe, file or pager
+    only full chunks are written. When the reader goes away (``| head``,
+    quitting the pager) the rest of the output is discarded and ``closed``
+    turns true instead of ``BrokenPipeError`` being raised.
+    """
+
+    def __init__(self, stream: Optional[TextIO] = None, *, chunk_chars: Optional[int] = None) -> None:
+        self.stream = stream if stream is not None else sys.stdout
+        isatty = getattr(self.stream, "isatty", None)
+        self.interactive = bool(isatty and isatty())
+        self.chunk_chars = chunk_chars or (8 * 1024 if self.interactive else 1024 * 1024)
+        self.closed = False
+        self._parts: List[str] = []
+        self._size = 0
+
+    def write(self, text: str = "") -> None:
+        self._parts.append(text)
+        self._size += len(text) + 1
+        if self._size >= self.chunk_chars:
+            self.flush()
+
+    def write_lines(self, lines: Iterable[str]) -> int:
+        """Write every line and return how many there were."""
+        count = 0
+        for line in lines:
+            self.write(line)
+            count += 1
+        if self.interactive:
+            self.flush()
+        return count
+
+    def flush(self) -> None:
+        if not self._parts:
+            return
+        parts, self._parts, self._size = self._parts, [], 0
+        if self.closed:
+            return
+        try:
+            self.stream.write("\n".join(parts) + "\n")
+            self.stream.flush()
+        except BrokenPipeError:
+            self.closed = True
+            # Point the descriptor at /dev/null so the interpreter's own
+            # flush at exit does not fail on the closed pipe too.
+            try:
+                devnull = os.open(os.devnull, os.O_WRONLY)
+                os.dup2(devnull, self.stream.fileno())
+                os.close(devnull)
+            except (AttributeError, OSError, ValueError):
+                pass
+
+    def __enter__(self) -> "ReportSink":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.flush()
+
+
+class _Layout:
+    # One machine-readable record kind: TSV rows tagged with the kind in the
+    # first column, or NDJSON objects with a "type" key. ``values`` returns
+    # the row without the trailing ``extra`` columns; text fields are
+    # JSON-escaped, the rest written as numbers.
+
+    def __init__(
+        self, kind: str, fields: Sequence[str], values: Callable[[Any], Tuple], text: Sequence[str] = ("station_id",)
+    ) -> None:
+        self.values = values
+        self.header = "\t".join(("type", *fields))
+        self.tsv_row = "\t".join((kind, *["{}"] * len(fields))).format
+        members = [f'"type": "{kind}"', *(f'"{name}": {{}}' for name in fields)]
+        self.ndjson_row = ("{{" + ", ".join(members) + "}}").format
+        self.text_columns = [index for index, name in enumerate(fields) if name in text]
+
+
+def _iso(value: datetime) -> str:
+    return value.isoformat()
+
+
+_DAY_FIELDS = (
+    "station_id",
+    "date",
+    "count",
+    "total_rain_mm",
+    "avg_temp_c",
+    "min_temp_c",
+    "max_temp_c",
+    "max_rainfall_mm",
+    "max_rain_rate_mm_per_hr",
+    "first_observation",
+    "last_observation",
+    "severity",
+)
+_DAY_TEXT = ("station_id", "date", "first_observation", "last_observation", "severity", "alerts")
+
+
+def _day_values(summary: DaySummary) -> Tuple:
+    return (
+        summary.station_id,
+        summary.date.date().isoformat(),
+        summary.count,
+        summary.total_rain_mm,
+        summary.avg_temp_c,
+        summary.min_temp_c,
+        summary.max_temp_c,
+        summary.max_rainfall_mm,
+        summary.max_rain_rate_mm_per_hr,
+        _iso(summary.first_observation),
+        _iso(summary.last_observation),
+    )
+
+
+_LAYOUTS: Dict[str, _Layout] = {
+    "day": _Layout("day", (*_DAY_FIELDS, "alerts"), _day_values, _DAY_TEXT),
+    "top_wet": _Layout("top_wet", _DAY_FIELDS, _day_values, _DAY_TEXT),
+    "week": _Layout(
+        "week",
+        ("station_id", "iso_year", "iso_week", "total_rain_mm", "avg_temp_c", "days", "max_daily_rain_mm"),
+        lambda s: (s.station_id, s.iso_year, s.iso_week, s.total_rain_mm, s.avg_temp_c, s.days, s.max_daily_rain_mm),
+    ),
+    "month": _Layout(
+        "month",
+        (
+            "station_id",
+            "year",
+            "month",
+            "total_rain_mm",
+            "avg_temp_c",
+            "median_temp_c",
+            "days",
+            "max_daily_rain_mm",
+            "wettest_day",
+        ),
+        lambda s: (
+            s.station_id,
+            s.year,
+            s.month,
+            s.total_rain_mm,
+            s.avg_temp_c,
+            s.median_temp_c,
+            s.days,
+            s.max_daily_rain_mm,
+            s.wettest_day.date().isoformat(),
+        ),
+        ("station_id", "wettest_day"),
+    ),
+    "percentile": _Layout("percentile", ("percentile", "total_rain_mm"), tuple),
+    "event": _Layout(
+        "event",
+        ("station_id", "start", "end", "duration_seconds", "total_rain_mm", "peak_intensity_mm_per_hr", "readings"),
+        lambda e: (
+            e.station_id,
+            _iso(e.start),
+            _iso(e.end),
+            int((e.end - e.start).total_seconds()),
+            e.total_rain_mm,
+            e.peak_intensity_mm_per_hr,
+            e.readings,
+        ),
+        ("station_id", "start", "end"),
+    ),
+    "dry_spell": _Layout(
+        "dry_spell",
+        ("station_id", "start", "end", "duration_hours", "readings"),
+        lambda s: (s.station_id, _iso(s.start), _iso(s.end), s.duration_hours, s.readings),
+        ("station_id", "start", "end"),
+    ),
+    "window": _Layout(
+        "window",
+        (
+            "station_id",
+            "start",
+            "end",
+            "count",
+            "total_rain_mm",
+            "max_rainfall_mm",
+            "avg_temp_c",
+            "min_temp_c",
+            "max_temp_c",
+        ),
+        lambda w: (
+            w.station_id,
+            _iso(w.start),
+            _iso(w.end),
+            w.count,
+            w.total_rain_mm,
+            w.max_rainfall_mm,
+            w.avg_temp_c,
+            w.min_temp_c,
+            w.max_temp_c,
+        ),
+        ("station_id", "start", "end"),
+    ),
+    "window_peak": _Layout(
+        "window_peak",
+        ("station_id", "window", "start", "end", "total_rain_mm", "intensity_mm_per_hr"),
+        lambda p: (
+            p.station_id,
+            format_duration(p.window),
+            _iso(p.start),
+            _iso(p.end),
+            p.total_rain_mm,
+            p.intensity_mm_per_hr,
+        ),
+        ("station_id", "window", "start", "end"),
+    ),
+    "alert": _Layout(
+        "alert",
+        ("station_id", "ts", "rule", "state", "value"),
+        lambda a: (a.station_id, _iso(a.ts), a.rule.label, "raised" if a.raised else "cleared", a.value),
+        ("station_id", "ts", "rule", "state"),
+    ),
+}
+
+
+def render_records(kind: str, items: Iterable[Any], fmt: str, *extra: Sequence[Any]) -> List[str]:
+    """
+    Render ``items`` as ``fmt`` ("tsv" or "ndjson") records of ``kind``.
+
+    ``extra`` holds per-item values for the layout's trailing columns (the
+    severity and alert names of day records). TSV output starts with a
+    header line.
+    """
+    layout = _LAYOUTS[kind]
+    values = layout.values
+    rows = map(tuple.__add__, map(values, items), zip(*extra)) if extra else map(values, items)
+    if fmt == "tsv":
+        row = layout.tsv_row
+        return [layout.header, *(row(*values) for values in rows)]
+    if fmt != "ndjson":
+        raise ValueError(f"Unknown record format '{fmt}'")
+    row = layout.ndjson_row
+    text_columns = layout.text_columns
+    lines = []
+    for values in rows:
+        values = list(values)
+        for index in text_columns:
+            values[index] = encode_basestring_ascii(values[index])
+        lines.append(row(*values))
+    return lines
@@ -1,12 +1,26 @@
+import hashlib
 import math
 import random
+from array import array
 from datetime import datetime, timedelta
-from typing import Iterable, Iterator, Optional, Sequence
+from itertools import islice
+from typing import Iterable, Iterator, Optional, Sequence, Tuple
 
-from model import Reading
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
 
+from ingest import DEFAULT_CHUNK_ROWS
+from model import BatchStream, Reading, ReadingBatch, iter_rows, to_epoch_us
 
-def _resolve_start(start: Optional[datetime]) -> datetime:
+MINUTE_US = 60 * 1_000_000
+
+_DEFAULT_PROFILE = (0.0, 0.0, 0.2, 0.8, 1.5, 2.5, 1.0, 0.4, 0.1, 0.0)
+
+
+def resolve_start(start: Optional[datetime]) -> datetime:
+    """The given start time, or now (UTC) for generators started without one."""
     return start or datetime.utcnow()
 
 
@@ -17,7 +31,7 @@ def rainfall_burst(
     step: float = 0.1,
 ) -> Iterator[Reading]:
     """Generate a contiguous burst with constant rainfall intensity."""
-    t = _resolve_start(start)
+    t = resolve_start(start)
     for _ in range(increments):
         yield Reading(station_id=station_id, ts=t, temperature_c=20.0, rainfall_mm=step)
         t += timedelta(minutes=1)
@@ -36,8 +50,8 @@ def rainfall_profile(
 
     When no profile is provided a default ramp-up/ramp-down pattern is used.
     """
-    profile = profile or [0.0, 0.0, 0.2, 0.8, 1.5, 2.5, 1.0, 0.4, 0.1, 0.0]
-    t = _resolve_start(start)
+    profile = profile or list(_DEFAULT_PROFILE)
+    t = resolve_start(start)
     steps = len(profile)
 
     for idx, amount in enumerate(profile):
@@ -61,7 +75,7 @@ def multi_station_cycle(
     Temperatures follow a simple sinusoidal day/night swing while rainfall
     peaks in the afternoon with slight station offsets.
     """
-    t = _resolve_start(start)
+    t = resolve_start(start)
     for minute in range(minutes):
         # Map minute-of-day to a position on the sine wave.
         phase = 2 * math.pi * (minute / 1440.0)
@@ -78,6 +92,40 @@ def multi_station_cycle(
         t += timedelta(minutes=1)
 
 
+# Noise is drawn from a splitmix64 stream per (seed, station) at position
+# ``epoch_us``, so a reading's noise does not depend on what came before it.
+_MASK = (1 << 64) - 1
+_GOLDEN = 0x9E3779B97F4A7C15
+_MIX1 = 0xBF58476D1CE4E5B9
+_MIX2 = 0x94D049BB133111EB
+_TO_UNIT = 2.0**-53
+
+
+def _mix64(z: int) -> int:
+    z = ((z ^ (z >> 30)) * _MIX1) & _MASK
+    z = ((z ^ (z >> 27)) * _MIX2) & _MASK
+    return z ^ (z >> 31)
+
+
+def _station_key(seed: int, station_id: str) -> int:
+    digest = hashlib.blake2b(f"{seed}\0{station_id}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def _noise_pair(station_key: int, epoch_us: int) -> Tuple[float, float]:
+    """Two independent standard normal draws (Box-Muller) for one reading."""
+    counter = (station_key + epoch_us * _GOLDEN) & _MASK
+    first = _mix64(counter)
+    second = _mix64((counter + _GOLDEN) & _MASK)
+    radius = math.sqrt(-2.0 * math.log(((first >> 11) + 1) * _TO_UNIT))
+    angle = 2 * math.pi * ((second >> 11) * _TO_UNIT)
+    return radius * math.cos(angle), radius * math.sin(angle)
+
+
+def _resolve_seed(seed: Optional[int]) -> int:
+    return random.getrandbits(64) if seed is None else seed
+
+
 def with_noise(
     readings: Iterable[Reading],
     *,
@@ -85,14 +133,265 @@ def with_noise(
     rainfall_sigma: float = 0.05,
     seed: Optional[int] = None,
 ) -> Iterator[Reading]:
-    """Perturb an existing reading stream with Gaussian sensor noise."""
-    rng = random.Random(seed)
-    for reading in readings:
-        noisy_temp = reading.temperature_c + rng.gauss(0.0, temperature_sigma)
-        noisy_rain = max(0.0, reading.rainfall_mm + rng.gauss(0.0, rainfall_sigma))
-        yield Reading(
-            station_id=reading.station_id,
-            ts=reading.ts,
-            temperature_c=noisy_temp,
-            rainfall_mm=noisy_rain,
+    """
+    Perturb an existing reading stream (or ``ReadingBatch``) with Gaussian sensor noise.
+
+    The noise of a reading depends only on ``seed``, its station and its
+    timestamp, so it is the same however the stream is split, ordered or
+    distributed; see ``add_noise``, which this applies chunk by chunk.
+    """
+    seed = _resolve_seed(seed)
+    if isinstance(readings, (ReadingBatch, BatchStream)):
+        batches = [readings] if isinstance(readings, ReadingBatch) else readings.batches()
+        for batch in batches:
+            yield from add_noise(
+                batch, temperature_sigma=temperature_sigma, rainfall_sigma=rainfall_sigma, seed=seed
+            )
+        return
+    rows = iter_rows(readings)
+    while True:
+        chunk = list(islice(rows, DEFAULT_CHUNK_ROWS))
+        if not chunk:
+            return
+        batch = ReadingBatch()
+        append = batch.append_values
+        for station_id, ts, temperature_c, rainfall_mm in chunk:
+            append(station_id, to_epoch_us(ts), temperature_c, rainfall_mm)
+        noisy = add_noise(batch, temperature_sigma=temperature_sigma, rainfall_sigma=rainfall_sigma, seed=seed)
+        # The original timestamps are kept, time zones included.
+        for (station_id, ts, _, _), temperature_c, rainfall_mm in zip(chunk, noisy.temperature_c, noisy.rainfall_mm):
+            yield Reading(station_id=station_id, ts=ts, temperature_c=temperature_c, rainfall_mm=rainfall_mm)
+
+
+def _check_chunk_rows(chunk_rows: int) -> None:
+    if chunk_rows < 1:
+        raise ValueError("chunk_rows must be positive")
+
+
+def _column(typecode: str, values: "np.ndarray") -> array:
+    return array(typecode, values.astype(typecode, copy=False).tobytes())
+
+
+def rainfall_burst_batches(
+    station_id: str = "S1",
+    start: Optional[datetime] = None,
+    increments: int = 100,
+    step: float = 0.1,
+    *,
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+) -> Iterator[ReadingBatch]:
+    """``rainfall_burst`` as ``ReadingBatch`` chunks of at most ``chunk_rows`` readings."""
+    _check_chunk_rows(chunk_rows)
+    t0 = to_epoch_us(resolve_start(start))
+    for first in range(0, increments, chunk_rows):
+        rows = min(chunk_rows, increments - first)
+        yield ReadingBatch(
+            stations=[station_id],
+            station_codes=array("I", [0]) * rows,
+            epoch_us=array("q", range(t0 + first * MINUTE_US, t0 + (first + rows) * MINUTE_US, MINUTE_US)),
+            temperature_c=array("d", [20.0]) * rows,
+            rainfall_mm=array("d", [step]) * rows,
+        )
+
+
+def rainfall_profile_batches(
+    station_id: str = "S1",
+    start: Optional[datetime] = None,
+    profile: Optional[Sequence[float]] = None,
+    interval_minutes: int = 5,
+    base_temp_c: float = 18.0,
+    temp_variation_c: float = 4.0,
+    *,
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+) -> Iterator[ReadingBatch]:
+    """``rainfall_profile`` as ``ReadingBatch`` chunks of at most ``chunk_rows`` readings."""
+    _check_chunk_rows(chunk_rows)
+    profile = profile or _DEFAULT_PROFILE
+    t0 = to_epoch_us(resolve_start(start))
+    interval_us = interval_minutes * MINUTE_US
+    steps = len(profile)
+    for first in range(0, steps, chunk_rows):
+        last = min(first + chunk_rows, steps)
+        if np is not None:
+            phase = (np.arange(first, last) / max(steps - 1, 1)) * math.pi
+            temperature = _column("d", base_temp_c + temp_variation_c * np.sin(phase - math.pi / 2))
+        else:
+            temperature = array(
+                "d",
+                (
+                    base_temp_c + temp_variation_c * math.sin((idx / max(steps - 1, 1)) * math.pi - math.pi / 2)
+                    for idx in range(first, last)
+                ),
+            )
+        yield ReadingBatch(
+            stations=[station_id],
+            station_codes=array("I", [0]) * (last - first),
+            epoch_us=array("q", range(t0 + first * interval_us, t0 + last * interval_us, interval_us)),
+            temperature_c=temperature,
+            rainfall_mm=array("d", map(float, profile[first:last])),
+        )
+
+
+def _cycle_chunk_numpy(
+    stations: Sequence[str],
+    t0: int,
+    first: int,
+    last: int,
+    base_temp_c: float,
+    diurnal_amplitude_c: float,
+    rainfall_peak_mm: float,
+) -> ReadingBatch:
+    # One row per minute, one column per station: the same minute-major order
+    # as ``multi_station_cycle``.
+    count = len(stations)
+    minutes = np.arange(first, last)
+    offsets = np.arange(count)
+    phase = 2 * math.pi * (minutes / 1440.0)
+    base_temp = base_temp_c + diurnal_amplitude_c * np.sin(phase - math.pi / 2)
+    rainfall_phase = phase[:, None] + offsets * (math.pi / count)
+    rainfall = np.maximum(0.0, rainfall_peak_mm * np.sin(rainfall_phase) ** 2)
+    return ReadingBatch(
+        stations=stations,
+        station_codes=_column("I", np.tile(offsets, len(minutes))),
+        epoch_us=_column("q", np.repeat(t0 + minutes * MINUTE_US, count)),
+        temperature_c=_column("d", (base_temp[:, None] + offsets * 0.8).ravel()),
+        rainfall_mm=_column("d", rainfall.ravel()),
+    )
+
+
+def _cycle_chunk_python(
+    stations: Sequence[str],
+    t0: int,
+    first: int,
+    last: int,
+    base_temp_c: float,
+    diurnal_amplitude_c: float,
+    rainfall_peak_mm: float,
+) -> ReadingBatch:
+    count = len(stations)
+    temperatures = array("d")
+    rainfalls = array("d")
+    offsets = range(count)
+    station_offsets = [offset * 0.8 for offset in offsets]
+    rainfall_offsets = [offset * (math.pi / count) for offset in offsets]
+    sin = math.sin
+    for minute in range(first, last):
+        phase = 2 * math.pi * (minute / 1440.0)
+        base_temp = base_temp_c + diurnal_amplitude_c * sin(phase - math.pi / 2)
+        temperatures.extend([base_temp + offset for offset in station_offsets])
+        rainfalls.extend([max(0.0, rainfall_peak_mm * sin(phase + offset) ** 2) for offset in rainfall_offsets])
+    return ReadingBatch(
+        stations=stations,
+        station_codes=array("I", offsets) * (last - first),
+        epoch_us=array("q", (t0 + minute * MINUTE_US for minute in range(first, last) for _ in offsets)),
+        temperature_c=temperatures,
+        rainfall_mm=rainfalls,
+    )
+
+
+def multi_station_cycle_batches(
+    stations: Sequence[str] = ("S1", "S2"),
+    start: Optional[datetime] = None,
+    minutes: int = 24 * 60,
+    base_temp_c: float = 18.0,
+    diurnal_amplitude_c: float = 6.0,
+    rainfall_peak_mm: float = 0.6,
+    *,
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+) -> Iterator[ReadingBatch]:
+    """
+    ``multi_station_cycle`` as ``ReadingBatch`` chunks computed over minute x station grids.
+
+    Each chunk holds whole minutes for every station, about ``chunk_rows``
+    readings (at least one minute). With NumPy the grid is computed in one
+    go; its exact squaring can differ from the scalar generator in the last
+    bit of a rainfall value. Without NumPy the values are identical.
+    """
+    _check_chunk_rows(chunk_rows)
+    stations = list(stations)
+    if not stations:
+        return
+    t0 = to_epoch_us(resolve_start(start))
+    chunk = _cycle_chunk_numpy if np is not None else _cycle_chunk_python
+    step = max(chunk_rows // len(stations), 1)
+    for first in range(0, minutes, step):
+        yield chunk(
+            stations, t0, first, min(first + step, minutes), base_temp_c, diurnal_amplitude_c, rainfall_peak_mm
         )
+
+
+def _mix64_numpy(z: "np.ndarray") -> "np.ndarray":
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(_MIX1)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(_MIX2)
+    return z ^ (z >> np.uint64(31))
+
+
+def _noisy_columns_numpy(
+    batch: ReadingBatch, keys: Sequence[int], temperature_sigma: float, rainfall_sigma: float
+) -> Tuple[array, array]:
+    codes = np.frombuffer(batch.station_codes, dtype=np.uint32)
+    epoch_us = np.frombuffer(batch.epoch_us, dtype=np.int64).view(np.uint64)
+    # uint64 arithmetic wraps around like the masked integer version.
+    counter = np.array(keys, dtype=np.uint64)[codes] + epoch_us * np.uint64(_GOLDEN)
+    first = _mix64_numpy(counter)
+    second = _mix64_numpy(counter + np.uint64(_GOLDEN))
+    radius = np.sqrt(-2.0 * np.log(((first >> np.uint64(11)) + np.uint64(1)).astype(np.float64) * _TO_UNIT))
+    angle = 2 * math.pi * ((second >> np.uint64(11)).astype(np.float64) * _TO_UNIT)
+    temperature = np.frombuffer(batch.temperature_c, dtype=np.float64) + temperature_sigma * (radius * np.cos(angle))
+    rainfall = np.maximum(
+        0.0, np.frombuffer(batch.rainfall_mm, dtype=np.float64) + rainfall_sigma * (radius * np.sin(angle))
+    )
+    return _column("d", temperature), _column("d", rainfall)
+
+
+def _noisy_columns_python(
+    batch: ReadingBatch, keys: Sequence[int], temperature_sigma: float, rainfall_sigma: float
+) -> Tuple[array, array]:
+    temperature = array("d")
+    rainfall = array("d")
+    add_temperature = temperature.append
+    add_rainfall = rainfall.append
+    for code, epoch_us, temperature_c, rainfall_mm in zip(
+        batch.station_codes, batch.epoch_us, batch.temperature_c, batch.rainfall_mm
+    ):
+        temperature_noise, rainfall_noise = _noise_pair(keys[code], epoch_us)
+        add_temperature(temperature_c + temperature_sigma * temperature_noise)
+        add_rainfall(max(0.0, rainfall_mm + rainfall_sigma * rainfall_noise))
+    return temperature, rainfall
+
+
+def add_noise(
+    batch: ReadingBatch,
+    *,
+    temperature_sigma: float = 0.4,
+    rainfall_sigma: float = 0.05,
+    seed: int,
+) -> ReadingBatch:
+    """
+    Return ``batch`` with the Gaussian sensor noise ``with_noise`` would add.
+
+    Each reading's noise comes from a counter-based stream keyed by ``seed``
+    and its station, at position ``epoch_us``. Any chunk or shard of a feed
+    can therefore be perturbed on its own, in any process, with the same
+    result. Vectorized with NumPy when it is installed; NumPy's ``log`` may
+    round differently from ``math.log``, so noise is reproducible for a given
+    installation rather than bit-for-bit across machines. Readings of one
+    station sharing a timestamp get the same noise.
+    """
+    keys = [_station_key(seed, station_id) for station_id in batch.stations]
+    noisy = _noisy_columns_numpy if np is not None and len(batch) else _noisy_columns_python
+    temperature, rainfall = noisy(batch, keys, temperature_sigma, rainfall_sigma)
+    return batch.with_columns(batch.station_codes, batch.epoch_us, temperature, rainfall)
+
+
+def with_noise_batches(
+    batches: Iterable[ReadingBatch],
+    *,
+    temperature_sigma: float = 0.4,
+    rainfall_sigma: float = 0.05,
+    seed: Optional[int] = None,
+) -> Iterator[ReadingBatch]:
+    """``with_noise`` for a stream of batches, one ``add_noise`` call per batch."""
+    seed = _resolve_seed(seed)
+    for batch in batches:
+        yield add_noise(batch, temperature_sigma=temperature_sigma, rainfall_sigma=rainfall_sigma, seed=seed)
@@ -0,0 +1,416 @@
+"""
+Asyncio ingestion service behind ``python main.py serve``.
+
+Stations stream line-delimited readings over TCP (or UDP): CSV lines in
+``station_id,ts,temperature_c,rainfall_mm`` order or NDJSON objects with the
+same keys. Connections hand blocks of complete lines to one bounded queue.
+When it is full, TCP handlers stop reading, so the kernel pushes back on the
+senders; UDP datagrams cannot be slowed down and are dropped and counted
+instead. A single consumer parses each block into a ``ReadingBatch`` and
+feeds a ``StreamingDayAggregator`` and the rain-event and dry-spell
+detectors. Closed day/week/month summaries, events and dry spells are
+published as NDJSON lines to every client of the subscriber socket, as are
+alerts. Alert rules see readings in arrival order, ahead of the reorder
+buffer, so they fire with the block that carried the reading.
+"""
+import asyncio
+import json
+import signal
+import socket
+import sys
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from typing import Any, Iterable, List, Optional, Sequence, Set, Tuple
+
+from aggregator import RainEventDetector, StreamingDayAggregator
+from alerts import AlertEngine, AlertRule
+from analytics import DrySpellDetector
+from ingest import parse_lines
+from model import ReorderBuffer, Row
+from sensor_stream import multi_station_cycle
+
+READ_CHUNK_BYTES = 256 * 1024
+# A connection that sends this much without a newline is cut off.
+MAX_LINE_BYTES = 64 * 1024
+# Subscribers with more unsent output than this are disconnected.
+SUBSCRIBER_BUFFER_LIMIT = 8 * 1024 * 1024
+# Kernel receive buffer requested for the UDP socket, to absorb bursts.
+UDP_RECEIVE_BUFFER = 4 * 1024 * 1024
+# Fake-station UDP datagrams carry at most this many bytes of lines.
+DATAGRAM_BYTES = 8 * 1024
+
+
+@dataclass
+class ServerConfig:
+    host: str = "127.0.0.1"
+    tcp_port: int = 7878
+    udp_port: Optional[int] = None
+    subscribe_port: int = 7879
+    queue_blocks: int = 64
+    allowed_lateness: timedelta = timedelta(0)
+    events_threshold_mm: float = 1.0
+    events_gap: timedelta = timedelta(minutes=10)
+    dry_threshold_mm: float = 0.05
+    dry_min_duration: timedelta = timedelta(hours=6)
+    dry_gap: timedelta = timedelta(minutes=45)
+    reorder_window: int = 8
+    stats_interval: float = 10.0
+    alert_rules: Tuple[AlertRule, ...] = ()
+
+
+@dataclass
+class ServerStats:
+    connections: int = 0
+    readings: int = 0
+    rejected_lines: int = 0
+    dropped_datagrams: int = 0
+    published: int = 0
+    subscribers: int = 0
+
+
+def _message(kind: str, item: Any) -> bytes:
+    payload = {"type": kind}
+    for key, value in asdict(item).items():
+        payload[key] = value.isoformat() if isinstance(value, datetime) else value
+    return (json.dumps(payload) + "\n").encode()
+
+
+class _DatagramIngest(asyncio.DatagramProtocol):
+    """Coalesces the datagrams received in one loop iteration into one queue block."""
+
+    def __init__(self, server: "IngestServer") -> None:
+        self._server = server
+        self._parts: List[bytes] = []
+
+    def datagram_received(self, data: bytes, addr: Any) -> None:
+        if not self._parts:
+            asyncio.get_running_loop().call_soon(self._flush)
+        self._parts.append(data.rstrip(b"\n"))
+
+    def _flush(self) -> None:
+        if not self._parts:
+            return
+        parts, self._parts = self._parts, []
+        try:
+            self._server._queue.put_nowait(b"\n".join(parts) + b"\n")
+        except asyncio.QueueFull:
+            self._server.stats.dropped_datagrams += len(parts)
+
+
+class IngestServer:
+    """Long-lived streaming aggregation over network-fed readings."""
+
+    def __init__(self, config: ServerConfig) -> None:
+        self.config = config
+        self.stats = ServerStats()
+        self.days = StreamingDayAggregator(config.allowed_lateness)
+        self.events = RainEventDetector(config.events_threshold_mm, config.events_gap)
+        self.spells = DrySpellDetector(config.dry_threshold_mm, config.dry_min_duration, config.dry_gap)
+        self.alerts = AlertEngine(config.alert_rules) if config.alert_rules else None
+        self._reorder = ReorderBuffer(config.reorder_window)
+        self._queue: "asyncio.Queue[Optional[bytes]]" = asyncio.Queue(config.queue_blocks)
+        self._subscribers: Set[asyncio.StreamWriter] = set()
+        self._handlers: Set["asyncio.Task[None]"] = set()
+        self._servers: List[asyncio.AbstractServer] = []
+        self._udp: Optional[asyncio.DatagramTransport] = None
+        self._datagrams: Optional[_DatagramIngest] = None
+        self._tasks: List["asyncio.Task[None]"] = []
+        self.tcp_port: Optional[int] = None
+        self.udp_port: Optional[int] = None
+        self.subscribe_port: Optional[int] = None
+
+    async def start(self) -> None:
+        """Bind the sockets (port 0 picks a free port) and start consuming."""
+        config = self.config
+        stations = await asyncio.start_server(self._handle_station, config.host, config.tcp_port)
+        subscribers = await asyncio.start_server(self._handle_subscriber, config.host, config.subscribe_port)
+        self._servers = [stations, subscribers]
+        self.tcp_port = stations.sockets[0].getsockname()[1]
+        self.subscribe_port = subscribers.sockets[0].getsockname()[1]
+        if config.udp_port is not None:
+            self._udp, self._datagrams = await asyncio.get_running_loop().create_datagram_endpoint(
+                lambda: _DatagramIngest(self), local_addr=(config.host, config.udp_port)
+            )
+            self.udp_port = self._udp.get_extra_info("sockname")[1]
+            try:
+                self._udp.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_RECEIVE_BUFFER)
+            except OSError:
+                pass
+        self._tasks.append(asyncio.create_task(self._consume()))
+        if config.stats_interval > 0:
+            self._tasks.append(asyncio.create_task(self._report_stats()))
+
+    async def _handle_station(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self._handlers.add(task)
+        self.stats.connections += 1
+        pending = b""
+        try:
+            while True:
+                chunk = await reader.read(READ_CHUNK_BYTES)
+                if not chunk:
+                    break
+                data = pending + chunk if pending else chunk
+                cut = data.rfind(b"\n") + 1
+                pending = data[cut:]
+                if cut:
+                    # Blocks here while the queue is full: this is the backpressure.
+                    await self._queue.put(data[:cut])
+                if len(pending) > MAX_LINE_BYTES:
+                    # Cut the station off and drop the over-long line.
+                    self.stats.rejected_lines += 1
+                    pending = b""
+                    break
+            if pending.strip():
+                await self._queue.put(pending + b"\n")
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.stats.connections -= 1
+            self._handlers.discard(task)
+            writer.close()
+
+    async def _handle_subscriber(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._subscribers.add(writer)
+        self.stats.subscribers = len(self._subscribers)
+        try:
+            # Subscribers only listen; this returns once they hang up.
+            await reader.read()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._drop_subscriber(writer)
+
+    def _drop_subscriber(self, writer: asyncio.StreamWriter) -> None:
+        self._subscribers.discard(writer)
+        self.stats.subscribers = len(self._subscribers)
+        writer.close()
+
+    def _publish(self, kind: str, items: Iterable[Any]) -> None:
+        messages = [_message(kind, item) for item in items]
+        if not messages:
+            return
+        self.stats.published += len(messages)
+        data = b"".join(messages)
+        for writer in list(self._subscribers):
+            if writer.transport.get_write_buffer_size() > SUBSCRIBER_BUFFER_LIMIT:
+                self._drop_subscriber(writer)
+            else:
+                writer.write(data)
+
+    def _reject(self, line: str, exc: Exception) -> None:
+        self.stats.rejected_lines += 1
+
+    def _detect(self, rows: Iterable[Row]) -> None:
+        events: List[Any] = []
+        spells: List[Any] = []
+        update_event = self.events.update
+        update_spell = self.spells.update
+        for station_id, ts, _, rainfall_mm in rows:
+            event = update_event(station_id, ts, rainfall_mm)
+            if event is not None:
+                events.append(event)
+            spell = update_spell(station_id, ts, rainfall_mm)
+            if spell is not None:
+                spells.append(spell)
+        self._publish("event", events)
+        self._publish("dry_spell", spells)
+
+    def _released(self, rows: Iterable[Row]) -> Iterable[Row]:
+        push = self._reorder.push
+        for row in rows:
+            released = push(row)
+            if released is not None:
+                yield released
+
+    def process(self, block: bytes) -> None:
+        """Aggregate one block of wire lines and publish whatever it closed."""
+        lines = block.decode("utf-8", errors="replace").split("\n")
+        if lines and not lines[-1]:
+            lines.pop()
+        batch = parse_lines(lines, on_error=self._reject)
+        self.stats.readings += len(batch)
+        rows = list(batch.rows())
+        if self.alerts is not None:
+            self._publish("alert", self.alerts.update_rows(rows))
+        self._publish("day", self.days.update_rows(rows))
+        self._publish("week", self.days.weekly.drain())
+        self._publish("month", self.days.monthly.drain())
+        self._detect(self._released(rows))
+
+    def flush(self) -> None:
+        """Close everything still open and publish it, e.g. at shutdown."""
+        self._detect(self._reorder.drain())
+        self._publish("event", self.events.flush())
+        self._publish("dry_spell", self.spells.flush())
+        self._publish("day", self.days.flush())
+        self._publish("week", self.days.weekly.flush())
+        self._publish("month", self.days.monthly.flush())
+
+    async def _consume(self) -> None:
+        while True:
+            block = await self._queue.get()
+            if block is None:
+                return
+            self.process(block)
+
+    async def _report_stats(self) -> None:
+        last_readings, last_time = 0, time.monotonic()
+        while True:
+            await asyncio.sleep(self.config.stats_interval)
+            now = time.monotonic()
+            rate = (self.stats.readings - last_readings) / (now - last_time)
+            last_readings, last_time = self.stats.readings, now
+            print(
+                f"[serve] {rate:,.0f} readings/s | total={self.stats.readings} | "
+                f"queue={self._queue.qsize()}/{self.config.queue_blocks} | "
+                f"connections={self.stats.connections} | subscribers={self.stats.subscribers} | "
+                f"rejected={self.stats.rejected_lines} | dropped={self.stats.dropped_datagrams} | "
+                f"late={self.days.late_readings}",
+                file=sys.stderr,
+            )
+
+    async def stop(self) -> None:
+        """Stop accepting readings, drain the queue, flush and close subscribers."""
+        self._servers[0].close()
+        if self._udp is not None:
+            self._udp.close()
+            self._datagrams._flush()
+        for task in list(self._handlers):
+            task.cancel()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        await self._queue.put(None)
+        await self._tasks[0]
+        for task in self._tasks[1:]:
+            task.cancel()
+        self.flush()
+        for writer in list(self._subscribers):
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+            self._drop_subscriber(writer)
+        self._servers[1].close()
+
+
+async def serve(config: ServerConfig) -> ServerStats:
+    """Run the service until SIGINT/SIGTERM, then shut down cleanly."""
+    server = IngestServer(config)
+    await server.start()
+    udp = f", udp :{server.udp_port}" if server.udp_port is not None else ""
+    print(
+        f"[serve] readings on tcp {config.host}:{server.tcp_port}{udp}; "
+        f"subscribers on tcp {config.host}:{server.subscribe_port}",
+        file=sys.stderr,
+    )
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stopped.set)
+        except (NotImplementedError, RuntimeError):  # pragma: no cover - e.g. Windows
+            pass
+    try:
+        await stopped.wait()
+    finally:
+        await server.stop()
+    return server.stats
+
+
+def _station_lines(
+    station_id: str, start: Optional[datetime], readings: int, base_temp_c: float
+) -> Iterable[str]:
+    for reading in multi_station_cycle([station_id], start=start, minutes=readings, base_temp_c=base_temp_c):
+        yield f"{reading.station_id},{reading.ts.isoformat()},{reading.temperature_c!r},{reading.rainfall_mm!r}\n"
+
+
+async def _fake_tcp_station(
+    host: str, port: int, lines: Iterable[str], block_lines: int, delay: float
+) -> int:
+    _, writer = await asyncio.open_connection(host, port)
+    sent = 0
+    block: List[str] = []
+    try:
+        for line in lines:
+            block.append(line)
+            if len(block) >= block_lines:
+                writer.write("".join(block).encode())
+                sent += len(block)
+                block = []
+                await writer.drain()
+                if delay:
+                    await asyncio.sleep(delay)
+        if block:
+            writer.write("".join(block).encode())
+            sent += len(block)
+        await writer.drain()
+    finally:
+        writer.close()
+        await writer.wait_closed()
+    return sent
+
+
+async def _fake_udp_station(host: str, port: int, lines: Iterable[str], block_lines: int, delay: float) -> int:
+    transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+        asyncio.DatagramProtocol, remote_addr=(host, port)
+    )
+    # Datagrams cannot be slowed down by the receiver, so pace every one of
+    # them instead of bursting a whole block into the server's socket buffer.
+    line_delay = delay / block_lines
+    sent = 0
+    datagram: List[bytes] = []
+    size = 0
+    try:
+        for line in lines:
+            data = line.encode()
+            if size + len(data) > DATAGRAM_BYTES:
+                transport.sendto(b"".join(datagram))
+                await asyncio.sleep(line_delay * len(datagram))
+                datagram, size = [], 0
+            datagram.append(data)
+            size += len(data)
+            sent += 1
+        if datagram:
+            transport.sendto(b"".join(datagram))
+    finally:
+        transport.close()
+    return sent
+
+
+async def run_fake_stations(
+    host: str,
+    port: int,
+    stations: Sequence[str],
+    readings_per_station: int,
+    *,
+    rate: Optional[float] = None,
+    protocol: str = "tcp",
+    block_lines: int = 1000,
+    start: Optional[datetime] = None,
+) -> int:
+    """
+    Stream simulated readings from every station over its own connection.
+
+    ``rate`` caps the total readings per second across stations; ``None``
+    sends as fast as the server accepts them. Every station starts at
+    ``start`` (default: now, UTC) with one reading a minute. Returns the number of lines sent.
+    """
+    if protocol not in ("tcp", "udp"):
+        raise ValueError(f"Unknown protocol '{protocol}'")
+    per_station = rate / len(stations) if rate else None
+    delay = block_lines / per_station if per_station else 0.0
+    station = _fake_tcp_station if protocol == "tcp" else _fake_udp_station
+    sent = await asyncio.gather(
+        *(
+            station(
+                host,
+                port,
+                _station_lines(station_id, start, readings_per_station, 18.0 + index * 0.8),
+                block_lines,
+                delay,
+            )
+            for index, station_id in enumerate(stations)
+        )
+    )
+    return sum(sent)
@@ -0,0 +1,257 @@
+"""
+Mergeable quantile sketch used for rainfall percentiles.
+
+``QuantileSketch`` is a KLL sketch: a stack of compactors where level ``h``
+holds items of weight ``2**h``. When a level overflows it is sorted and every
+other item is promoted to the next level. Memory stays at roughly
+``k / (1 - 2/3)`` items regardless of how many values were added, and
+quantiles are within about ``1.7 / k`` normalized rank of the exact answer.
+Until the first compaction the sketch is exact.
+"""
+import math
+import random
+import statistics
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+_MAGIC = b"QSK1"
+_HEADER = struct.Struct("<4sIQddI")
+_LEVEL = struct.Struct("<I")
+_CAPACITY_DECAY = 2.0 / 3.0
+
+
+def k_for_error(error: float) -> int:
+    """Return the compactor size giving roughly ``error`` normalized rank error."""
+    if not 0.0 < error < 1.0:
+        raise ValueError("error must be between 0 and 1")
+    return max(8, int(math.ceil(1.7 / error)))
+
+
+class QuantileSketch:
+    """Approximate, mergeable distribution of float values (KLL)."""
+
+    def __init__(self, k: int = 200, *, seed: Optional[int] = 0) -> None:
+        if k < 2:
+            raise ValueError("k must be at least 2")
+        self.k = k
+        self.count = 0
+        self.min_value = math.inf
+        self.max_value = -math.inf
+        self._levels: List[List[float]] = [[]]
+        self._size = 0
+        self._limit = self._max_size()
+        self._rng = random.Random(seed)
+
+    @classmethod
+    def with_error(cls, error: float, *, seed: Optional[int] = 0) -> "QuantileSketch":
+        return cls(k_for_error(error), seed=seed)
+
+    @property
+    def exact(self) -> bool:
+        """True while no compaction has happened and every value is retained."""
+        return len(self._levels) == 1
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self._levels) - level - 1
+        return max(2, int(math.ceil(self.k * _CAPACITY_DECAY ** depth)))
+
+    def _max_size(self) -> int:
+        return sum(self._capacity(level) for level in range(len(self._levels)))
+
+    def update(self, value: float) -> None:
+        self.count += 1
+        if value < self.min_value:
+            self.min_value = value
+        if value > self.max_value:
+            self.max_value = value
+        self._levels[0].append(value)
+        self._size += 1
+        if self._size >= self._limit:
+            self._compress()
+
+    def update_many(self, values: Iterable[float]) -> None:
+        for value in values:
+            self.update(value)
+
+    def _compress(self) -> None:
+        for level, items in enumerate(self._levels):
+            if len(items) < self._capacity(level):
+                continue
+            if level + 1 == len(self._levels):
+                self._levels.append([])
+                self._limit = self._max_size()
+            items.sort()
+            # An odd item stays behind so the promoted half carries exact weight.
+            keep = [items.pop()] if len(items) % 2 else []
+            offset = self._rng.randint(0, 1)
+            self._levels[level + 1].extend(items[offset::2])
+            self._size -= len(items) // 2
+            self._levels[level] = keep
+            # Stop as soon as there is room again; update() stays amortized O(1).
+            if self._size < self._limit:
+                return
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        """Fold ``other`` into this sketch and return ``self``."""
+        if other.count == 0:
+            return self
+        while len(self._levels) < len(other._levels):
+            self._levels.append([])
+        self._limit = self._max_size()
+        for level, items in enumerate(other._levels):
+            self._levels[level].extend(items)
+            self._size += len(items)
+        self.count += other.count
+        self.min_value = min(self.min_value, other.min_value)
+        self.max_value = max(self.max_value, other.max_value)
+        while self._size >= self._limit:
+            self._compress()
+        return self
+
+    def _weighted(self) -> List[Tuple[float, int]]:
+        pairs = [(value, 1 << level) for level, items in enumerate(self._levels) for value in items]
+        pairs.sort()
+        return pairs
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate the value at fraction ``q`` (0..1) of the distribution.
+
+        Uses the same linear interpolation between closest ranks as
+        ``analytics.rainfall_percentiles``, so results are identical while the
+        sketch is exact.
+        """
+        if self.count == 0:
+            return 0.0
+        q = min(max(q, 0.0), 1.0)
+        if q <= 0.0:
+            return self.min_value
+        if q >= 1.0:
+            return self.max_value
+        pairs = self._weighted()
+        # ends[i] is the (0-based) rank of the last unit of weight in pairs[i].
+        ends = []
+        total = 0
+        for _, weight in pairs:
+            total += weight
+            ends.append(total - 1)
+        rank = q * (total - 1)
+        lower = int(math.floor(rank))
+        upper = int(math.ceil(rank))
+        low_value = pairs[bisect_left(ends, lower)][0]
+        if lower == upper:
+            return low_value
+        high_value = pairs[bisect_left(ends, upper)][0]
+        return low_value + (high_value - low_value) * (rank - lower)
+
+    def percentiles(self, percentiles: Sequence[float]) -> Dict[float, float]:
+        """Answer a list of percentiles (0..100) in one call."""
+        return {p: self.quantile(p / 100.0) for p in percentiles}
+
+    def to_bytes(self) -> bytes:
+        parts = [
+            _HEADER.pack(_MAGIC, self.k, self.count, self.min_value, self.max_value, len(self._levels))
+        ]
+        for items in self._levels:
+            values = array("d", items)
+            if sys.byteorder != "little":
+                values.byteswap()
+            parts.append(_LEVEL.pack(len(values)))
+            parts.append(values.tobytes())
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, *, seed: Optional[int] = 0) -> "QuantileSketch":
+        magic, k, count, min_value, max_value, n_levels = _HEADER.unpack_from(data, 0)
+        if magic != _MAGIC:
+            raise ValueError("Not a serialized QuantileSketch")
+        sketch = cls(k, seed=seed)
+        sketch.count = count
+        sketch.min_value = min_value
+        sketch.max_value = max_value
+        offset = _HEADER.size
+        sketch._levels = []
+        for _ in range(n_levels):
+            (length,) = _LEVEL.unpack_from(data, offset)
+            offset += _LEVEL.size
+            values = array("d")
+            values.frombytes(data[offset : offset + 8 * length])
+            if sys.byteorder != "little":
+                values.byteswap()
+            offset += 8 * length
+            sketch._levels.append(values.tolist())
+        sketch._size = sum(len(items) for items in sketch._levels)
+        sketch._limit = sketch._max_size()
+        return sketch
+
+    def __len__(self) -> int:
+        """Number of retained items (not the number of values added)."""
+        return self._size
+
+    def __repr__(self) -> str:
+        return f"QuantileSketch(k={self.k}, count={self.count}, retained={self._size})"
+
+
+class StreamingMedian:
+    """
+    Mergeable running median.
+
+    Samples are kept verbatim (and the median is exact, matching
+    ``statistics.median``) until more than ``exact_limit`` have been seen;
+    after that they are folded into a ``QuantileSketch`` with rank error
+    ``error`` and memory stops growing.
+    """
+
+    __slots__ = ("exact_limit", "error", "_samples", "_sketch")
+
+    def __init__(self, exact_limit: int = 256, error: float = 0.01) -> None:
+        self.exact_limit = exact_limit
+        self.error = error
+        self._samples: Optional[List[float]] = []
+        self._sketch: Optional[QuantileSketch] = None
+
+    def _spill(self) -> QuantileSketch:
+        sketch = QuantileSketch.with_error(self.error)
+        sketch.update_many(self._samples or ())
+        self._samples = None
+        self._sketch = sketch
+        return sketch
+
+    def add(self, value: float) -> None:
+        if self._sketch is not None:
+            self._sketch.update(value)
+            return
+        self._samples.append(value)
+        if len(self._samples) > self.exact_limit:
+            self._spill()
+
+    def merge(self, other: "StreamingMedian") -> "StreamingMedian":
+        """Fold ``other`` into this median and return ``self``."""
+        if other._sketch is not None:
+            sketch = self._sketch or self._spill()
+            sketch.merge(other._sketch)
+        elif self._sketch is not None:
+            self._sketch.update_many(other._samples or ())
+        else:
+            self._samples.extend(other._samples or ())
+            if len(self._samples) > self.exact_limit:
+                self._spill()
+        return self
+
+    @property
+    def exact(self) -> bool:
+        return self._sketch is None
+
+    def __len__(self) -> int:
+        return self._sketch.count if self._sketch is not None else len(self._samples)
+
+    def median(self) -> Optional[float]:
+        """Return the median, or ``None`` if nothing was added."""
+        if self._sketch is not None:
+            return self._sketch.quantile(0.5)
+        if not self._samples:
+            return None
+        return statistics.median(self._samples)
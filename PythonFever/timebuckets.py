@@ -0,0 +1,335 @@
+"""
+Calendar bucketing on integer epoch timestamps.
+
+Days are numbered from the epoch (``day_index = epoch_us // DAY_US``).
+``CalendarTable`` maps day indexes to their date, ISO week and month keys
+through tables built once per range of years, so bucketing a reading is an
+integer division and a list (or NumPy array) lookup instead of building and
+inspecting ``datetime`` objects.
+
+``StationZones`` assigns stations a fixed UTC offset or an IANA time zone,
+so their days can be local days. Zone rules are turned into sorted tables
+of offset changes, and a local day index is
+``(epoch_us + offset_us) // DAY_US`` with the offset found by bisection.
+"""
+from bisect import bisect_right
+from datetime import date, datetime, timedelta, timezone, tzinfo
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Tuple, Union
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+try:
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+except ImportError:  # pragma: no cover - Python < 3.9
+    ZoneInfo = None
+
+DAY_US = 86_400 * 1_000_000
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+_EPOCH_UTC = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+DateKey = Tuple[int, int, int]
+PeriodKey = Tuple[int, int]
+ZoneSpec = Union[str, timedelta, tzinfo]
+
+
+def day_index(epoch_us: int) -> int:
+    """Day number since 1970-01-01 of a UTC epoch-microsecond timestamp."""
+    return epoch_us // DAY_US
+
+
+def ordinal_day(value: Union[date, datetime]) -> int:
+    """Day number since 1970-01-01 of a date (or the date part of a datetime)."""
+    return value.toordinal() - EPOCH_ORDINAL
+
+
+def _year_start(year: int) -> int:
+    return date(year, 1, 1).toordinal() - EPOCH_ORDINAL
+
+
+class CalendarTable:
+    """
+    Date, ISO week and month keys for every day of a growing range of years.
+
+    Lookups outside the range extend it by whole years. Keys are shared
+    tuples, so dictionaries keyed by them do not hold one tuple per reading.
+    """
+
+    def __init__(self) -> None:
+        self.first = 0
+        self._dates: List[DateKey] = []
+        self._weeks: List[PeriodKey] = []
+        self._months: List[PeriodKey] = []
+        self._arrays: Optional[Dict[str, "np.ndarray"]] = None
+
+    def __len__(self) -> int:
+        return len(self._dates)
+
+    def cover(self, first_day: int, last_day: int) -> None:
+        """Make sure days ``first_day`` to ``last_day`` (inclusive) are in the table."""
+        if self._dates and self.first <= first_day and last_day < self.first + len(self._dates):
+            return
+        if self._dates:
+            first_day = min(first_day, self.first)
+            last_day = max(last_day, self.first + len(self._dates) - 1)
+        first_year = date.fromordinal(first_day + EPOCH_ORDINAL).year
+        last_year = date.fromordinal(last_day + EPOCH_ORDINAL).year
+        start, stop = _year_start(first_year), _year_start(last_year + 1)
+        months: Dict[PeriodKey, PeriodKey] = {}
+        weeks: Dict[PeriodKey, PeriodKey] = {}
+        dates: List[DateKey] = []
+        week_keys: List[PeriodKey] = []
+        month_keys: List[PeriodKey] = []
+        for ordinal in range(start + EPOCH_ORDINAL, stop + EPOCH_ORDINAL):
+            day = date.fromordinal(ordinal)
+            iso_year, iso_week, _ = day.isocalendar()
+            dates.append((day.year, day.month, day.day))
+            week_keys.append(weeks.setdefault((iso_year, iso_week), (iso_year, iso_week)))
+            month_keys.append(months.setdefault((day.year, day.month), (day.year, day.month)))
+        self.first = start
+        self._dates, self._weeks, self._months = dates, week_keys, month_keys
+        self._arrays = None
+
+    def _index(self, day: int) -> int:
+        index = day - self.first
+        if index < 0 or index >= len(self._dates):
+            self.cover(day, day)
+            index = day - self.first
+        return index
+
+    def date_key(self, day: int) -> DateKey:
+        index = self._index(day)
+        return self._dates[index]
+
+    def iso_week_key(self, day: int) -> PeriodKey:
+        index = self._index(day)
+        return self._weeks[index]
+
+    def month_key(self, day: int) -> PeriodKey:
+        index = self._index(day)
+        return self._months[index]
+
+    def arrays(self) -> Dict[str, "np.ndarray"]:
+        """``year``, ``month``, ``day``, ``iso_year`` and ``iso_week`` columns indexed by ``day - first``."""
+        if self._arrays is None:
+            self._arrays = {
+                "year": np.array([key[0] for key in self._dates], dtype=np.int64),
+                "month": np.array([key[1] for key in self._dates], dtype=np.int64),
+                "day": np.array([key[2] for key in self._dates], dtype=np.int64),
+                "iso_year": np.array([key[0] for key in self._weeks], dtype=np.int64),
+                "iso_week": np.array([key[1] for key in self._weeks], dtype=np.int64),
+            }
+        return self._arrays
+
+    def lookup(self, days: "np.ndarray", column: str) -> "np.ndarray":
+        """Vectorized lookup of one ``arrays()`` column for an array of day indexes."""
+        if len(days):
+            self.cover(int(days.min()), int(days.max()))
+        return self.arrays()[column][days - self.first]
+
+
+# Shared by the aggregators; it only ever grows.
+CALENDAR = CalendarTable()
+
+
+def parse_offset(text: str) -> Optional[timedelta]:
+    """Parse ``+HH:MM``, ``-HH``, ``UTC+HH:MM`` and the like; ``None`` if ``text`` is no offset."""
+    value = text.strip().upper()
+    for prefix in ("UTC", "GMT"):
+        if value.startswith(prefix):
+            value = value[len(prefix) :] or "+0"
+    if not value or value[0] not in "+-":
+        return None
+    hours, _, minutes = value[1:].partition(":")
+    if not hours.isdigit() or (minutes and not minutes.isdigit()):
+        return None
+    offset = timedelta(hours=int(hours), minutes=int(minutes or 0))
+    if offset >= timedelta(hours=24):
+        raise ValueError(f"UTC offset out of range: {text!r}")
+    return -offset if value[0] == "-" else offset
+
+
+def _resolve_zone(spec: ZoneSpec) -> Union[timedelta, tzinfo]:
+    if isinstance(spec, (timedelta, tzinfo)):
+        return spec
+    offset = parse_offset(spec)
+    if offset is not None:
+        return offset
+    if ZoneInfo is None:
+        raise ValueError(f"Time zone names like {spec!r} need the zoneinfo module (Python 3.9+)")
+    try:
+        return ZoneInfo(spec)
+    except (ZoneInfoNotFoundError, ValueError) as exc:
+        raise ValueError(f"Unknown time zone {spec!r}") from exc
+
+
+class _ZoneRule:
+    """
+    UTC offsets of one zone as a step function of epoch microseconds.
+
+    ``offsets[i]`` applies from ``transitions[i - 1]`` (inclusive) up to
+    ``transitions[i]``. Rules of real zones are probed day by day over the
+    years that have been asked about, and offset changes are located to the
+    second.
+    """
+
+    def __init__(self, zone: Union[timedelta, tzinfo]) -> None:
+        self.zone = zone
+        self.transitions: List[int] = []
+        self.transition_times: List[datetime] = []
+        self.offsets: List[int] = []
+        self.deltas: List[timedelta] = []
+        self._first_day = self._stop_day = 0
+        # timedelta offsets and fixed-offset tzinfos such as datetime.timezone.
+        fixed = zone if isinstance(zone, timedelta) else zone.utcoffset(None)
+        self.fixed = fixed is not None
+        if self.fixed:
+            self._set([], [fixed // timedelta(microseconds=1)])
+
+    def __getstate__(self) -> Dict[str, object]:
+        return {"zone": self.zone}
+
+    def __setstate__(self, state: Dict[str, object]) -> None:
+        # Tables are cheap to rebuild and would only bloat worker payloads.
+        self.__init__(state["zone"])
+
+    def _set(self, transitions: List[int], offsets: List[int]) -> None:
+        self.transitions = transitions
+        self.offsets = offsets
+        self.transition_times = [datetime(1970, 1, 1) + timedelta(microseconds=us) for us in transitions]
+        self.deltas = [timedelta(microseconds=us) for us in offsets]
+
+    def _offset_at(self, epoch_s: int) -> int:
+        instant = _EPOCH_UTC + timedelta(seconds=epoch_s)
+        return instant.astimezone(self.zone).utcoffset() // timedelta(microseconds=1)
+
+    def cover(self, first_day: int, last_day: int) -> None:
+        if self.fixed or self._first_day <= first_day and last_day < self._stop_day:
+            return
+        if self._stop_day > self._first_day:
+            first_day, last_day = min(first_day, self._first_day), max(last_day, self._stop_day - 1)
+        # A day of margin on either side, then whole years.
+        start = _year_start(date.fromordinal(first_day - 1 + EPOCH_ORDINAL).year)
+        stop = _year_start(date.fromordinal(last_day + 1 + EPOCH_ORDINAL).year + 1)
+        transitions: List[int] = []
+        offsets = [self._offset_at(start * 86_400)]
+        for day in range(start + 1, stop + 1):
+            offset = self._offset_at(day * 86_400)
+            if offset == offsets[-1]:
+                continue
+            low, high = (day - 1) * 86_400, day * 86_400
+            while high - low > 1:
+                middle = (low + high) // 2
+                if self._offset_at(middle) == offset:
+                    high = middle
+                else:
+                    low = middle
+            transitions.append(high * 1_000_000)
+            offsets.append(offset)
+        self._set(transitions, offsets)
+        self._first_day, self._stop_day = start, stop
+
+    def offset_us(self, epoch_us: int) -> int:
+        if self.fixed:
+            return self.offsets[0]
+        day = epoch_us // DAY_US
+        if not self._first_day <= day < self._stop_day:
+            self.cover(day, day)
+        return self.offsets[bisect_right(self.transitions, epoch_us)]
+
+    def local_ordinal(self, ts: datetime) -> int:
+        """Local proleptic ordinal of a naive UTC ``ts``."""
+        if self.fixed:
+            return (ts + self.deltas[0]).toordinal()
+        day = ts.toordinal() - EPOCH_ORDINAL
+        if not self._first_day <= day < self._stop_day:
+            self.cover(day, day)
+        return (ts + self.deltas[bisect_right(self.transition_times, ts)]).toordinal()
+
+    def offsets_array(self, epoch_us: "np.ndarray") -> "np.ndarray":
+        if len(epoch_us):
+            self.cover(int(epoch_us.min()) // DAY_US, int(epoch_us.max()) // DAY_US)
+        if self.fixed:
+            return np.full(len(epoch_us), self.offsets[0], dtype=np.int64)
+        offsets = np.array(self.offsets, dtype=np.int64)
+        return offsets[np.searchsorted(np.array(self.transitions, dtype=np.int64), epoch_us, side="right")]
+
+
+def _is_utc(rule: _ZoneRule) -> bool:
+    return rule.fixed and rule.offsets[0] == 0
+
+
+class StationZones:
+    """
+    Per-station time zones for local-day bucketing.
+
+    ``zones`` maps station ids to a UTC offset (``timedelta`` or text such as
+    ``"+05:30"``), a ``tzinfo`` or an IANA zone name; other stations use
+    ``default`` (UTC unless given). Readings keep their UTC timestamps, and
+    only the day they are counted towards changes.
+    """
+
+    def __init__(self, zones: Optional[Mapping[str, ZoneSpec]] = None, default: ZoneSpec = timedelta(0)) -> None:
+        self._rules: Dict[object, _ZoneRule] = {}
+        self.default = self._rule(default)
+        self.stations: Dict[str, _ZoneRule] = {
+            station_id: self._rule(spec) for station_id, spec in (zones or {}).items()
+        }
+
+    @classmethod
+    def parse(cls, specs: Iterable[str]) -> "StationZones":
+        """Build zones from ``STATION=ZONE`` entries; a bare ``ZONE`` sets the default."""
+        zones: Dict[str, ZoneSpec] = {}
+        default: ZoneSpec = timedelta(0)
+        for spec in specs:
+            station_id, sep, zone = spec.rpartition("=")
+            if not sep:
+                default = zone
+            elif not station_id or not zone:
+                raise ValueError(f"Expected STATION=ZONE, got {spec!r}")
+            else:
+                zones[station_id] = zone
+        return cls(zones, default)
+
+    def _rule(self, spec: ZoneSpec) -> _ZoneRule:
+        zone = _resolve_zone(spec)
+        rule = self._rules.get(zone)
+        if rule is None:
+            rule = self._rules[zone] = _ZoneRule(zone)
+        return rule
+
+    def _station_rule(self, station_id: str) -> _ZoneRule:
+        return self.stations.get(station_id, self.default)
+
+    @property
+    def is_utc(self) -> bool:
+        """True when every station buckets by UTC day, i.e. the zones change nothing."""
+        return all(_is_utc(rule) for rule in self._rules.values())
+
+    def offset_us(self, station_id: str, epoch_us: int) -> int:
+        return self._station_rule(station_id).offset_us(epoch_us)
+
+    def local_day(self, station_id: str, epoch_us: int) -> int:
+        """Local day index of ``epoch_us`` at ``station_id``."""
+        return (epoch_us + self._station_rule(station_id).offset_us(epoch_us)) // DAY_US
+
+    def local_ordinal(self, station_id: str, ts: datetime) -> int:
+        """Local proleptic ordinal (``date.toordinal``) of a naive UTC ``ts`` at ``station_id``."""
+        return self._station_rule(station_id).local_ordinal(ts)
+
+    def local_days(self, stations: Sequence[str], codes: "np.ndarray", epoch_us: "np.ndarray") -> "np.ndarray":
+        """Vectorized ``local_day`` for columns of station codes (into ``stations``) and timestamps."""
+        offsets = np.zeros(len(epoch_us), dtype=np.int64)
+        by_rule: Dict[int, List] = {}
+        for code, station_id in enumerate(stations):
+            rule = self._station_rule(station_id)
+            if not _is_utc(rule):
+                by_rule.setdefault(id(rule), [rule]).append(code)
+        for rule, *rule_codes in by_rule.values():
+            mask = np.isin(codes, rule_codes)
+            if mask.any():
+                offsets[mask] = rule.offsets_array(epoch_us[mask])
+        return (epoch_us + offsets) // DAY_US
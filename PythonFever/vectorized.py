@@ -0,0 +1,134 @@
+"""
+Optional NumPy backend for the day/week/month aggregations.
+
+The functions here produce exactly the same summaries as their pure-Python
+counterparts in ``aggregator`` but group readings with a stable
+sort-and-reduce over ``(station, day)`` keys instead of a per-reading loop.
+"""
+from datetime import datetime
+from typing import TYPE_CHECKING, Dict, Iterable, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+from aggregator import DaySummary, MonthSummary, WeekSummary, rollup_month, rollup_week
+from model import Reading, as_batch, from_epoch_us
+from timebuckets import CALENDAR, DAY_US
+
+if TYPE_CHECKING:
+    from timebuckets import StationZones
+
+
+def numpy_available() -> bool:
+    return np is not None
+
+
+def _require_numpy() -> None:
+    if np is None:
+        raise RuntimeError("The numpy engine requires NumPy to be installed")
+
+
+def aggregate_day_vectorized(
+    readings: Iterable[Reading], zones: Optional["StationZones"] = None
+) -> Dict[Tuple[str, Tuple[int, int, int]], DaySummary]:
+    """Vectorized equivalent of ``aggregator.aggregate_day``."""
+    _require_numpy()
+    batch = as_batch(readings)
+    if not len(batch):
+        return {}
+
+    codes = np.asarray(batch.station_codes, dtype=np.int64)
+    ts = np.asarray(batch.epoch_us, dtype=np.int64)
+    temp = np.asarray(batch.temperature_c, dtype=np.float64)
+    rain = np.asarray(batch.rainfall_mm, dtype=np.float64)
+
+    day = ts // DAY_US if zones is None or zones.is_utc else zones.local_days(batch.stations, codes, ts)
+    day_min = int(day.min())
+    span = int(day.max()) - day_min + 1
+    key = codes * span + (day - day_min)
+
+    # A stable sort keeps arrival order inside each group, which is the order
+    # the Python loop sees, so rates between consecutive readings line up.
+    order = np.argsort(key, kind="stable")
+    key_s = key[order]
+    boundary = np.empty(len(key_s), dtype=bool)
+    boundary[0] = True
+    np.not_equal(key_s[1:], key_s[:-1], out=boundary[1:])
+    starts = np.flatnonzero(boundary)
+    group_sorted = np.cumsum(boundary) - 1
+    group = np.empty_like(group_sorted)
+    group[order] = group_sorted
+
+    # bincount accumulates its weights sequentially in input (arrival) order,
+    # matching the float rounding of the ``+=`` in aggregate_day.
+    n_groups = len(starts)
+    rain_sum = np.bincount(group, weights=rain, minlength=n_groups)
+    temp_sum = np.bincount(group, weights=temp, minlength=n_groups)
+    count = np.bincount(group, minlength=n_groups)
+
+    ts_s = ts[order]
+    temp_s = temp[order]
+    rain_s = rain[order]
+    min_temp = np.minimum.reduceat(temp_s, starts)
+    max_temp = np.maximum.reduceat(temp_s, starts)
+    max_rain = np.maximum(np.maximum.reduceat(rain_s, starts), 0.0)
+    first_ts = np.minimum.reduceat(ts_s, starts)
+    last_ts = np.maximum.reduceat(ts_s, starts)
+
+    delta_us = np.diff(ts_s)
+    valid = ~boundary[1:] & (delta_us > 0)
+    rate = np.zeros(len(ts_s), dtype=np.float64)
+    rate[1:][valid] = rain_s[1:][valid] / ((delta_us[valid] / 1e6) / 3600.0)
+    max_rate = np.maximum.reduceat(rate, starts)
+
+    group_codes = (key_s[starts] // span).tolist()
+    group_days = (key_s[starts] % span + day_min).tolist()
+    # Emit groups in first-arrival order like the dict built by aggregate_day.
+    emit_order = np.argsort(order[starts], kind="stable").tolist()
+
+    rain_sum_l = rain_sum.tolist()
+    temp_sum_l = temp_sum.tolist()
+    count_l = count.tolist()
+    min_temp_l = min_temp.tolist()
+    max_temp_l = max_temp.tolist()
+    max_rain_l = max_rain.tolist()
+    max_rate_l = max_rate.tolist()
+    first_l = first_ts.tolist()
+    last_l = last_ts.tolist()
+
+    date_key_of = CALENDAR.date_key
+    out: Dict[Tuple[str, Tuple[int, int, int]], DaySummary] = {}
+    for g in emit_order:
+        date_key = date_key_of(group_days[g])
+        station_id = batch.stations[group_codes[g]]
+        c = count_l[g]
+        out[(station_id, date_key)] = DaySummary(
+            station_id=station_id,
+            date=datetime(*date_key, 0, 0, 0),
+            total_rain_mm=rain_sum_l[g],
+            avg_temp_c=temp_sum_l[g] / c,
+            count=c,
+            min_temp_c=min_temp_l[g],
+            max_temp_c=max_temp_l[g],
+            max_rainfall_mm=max_rain_l[g],
+            max_rain_rate_mm_per_hr=max_rate_l[g],
+            first_observation=from_epoch_us(first_l[g]),
+            last_observation=from_epoch_us(last_l[g]),
+        )
+    return out
+
+
+def aggregate_week_vectorized(
+    readings: Iterable[Reading],
+) -> Dict[Tuple[str, Tuple[int, int]], WeekSummary]:
+    """Vectorized equivalent of ``aggregator.aggregate_week``."""
+    return rollup_week(aggregate_day_vectorized(readings))
+
+
+def aggregate_month_vectorized(
+    readings: Iterable[Reading],
+) -> Dict[Tuple[str, Tuple[int, int]], MonthSummary]:
+    """Vectorized equivalent of ``aggregator.aggregate_month``."""
+    return rollup_month(aggregate_day_vectorized(readings))
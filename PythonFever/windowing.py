@@ -0,0 +1,361 @@
+"""
+Windowed rain accumulations per station.
+
+``WindowAggregator`` maintains, for every ``WindowSpec`` and station:
+
+* tumbling (``slide`` equal to ``size``) or hopping (``slide`` shorter than
+  ``size``) window summaries aligned to the epoch, e.g. hourly totals or
+  3-hour totals every 15 minutes. Readings are folded into panes of
+  ``gcd(size, slide)``; closed panes sit in a ring buffer with running sums,
+  and monotonic deques of the pane extremes give each window's maxima and
+  minima, so a reading costs O(1) amortized however far windows overlap.
+* a sliding window that ends at every reading, i.e. the rolling rainfall
+  over the last ``size``. Only its peak is kept: the wettest ``size``-long
+  span and its intensity.
+
+Each station's readings must arrive in timestamp order (see
+``model.ReorderBuffer``); older readings are dropped and counted in
+``late_readings``.
+"""
+import math
+import re
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+from model import from_epoch_us, to_epoch_us
+
+_DURATION_UNITS = {"d": 86_400_000_000, "h": 3_600_000_000, "m": 60_000_000, "s": 1_000_000}
+_DURATION = re.compile(r"(\d+)([dhms])")
+
+
+def parse_duration(text: str) -> timedelta:
+    """Parse durations such as ``15m``, ``1h``, ``1h30m`` or ``2d``."""
+    value = text.strip().lower()
+    parts = _DURATION.findall(value)
+    if not parts or "".join(number + unit for number, unit in parts) != value:
+        raise ValueError(f"Invalid duration '{text}' (use e.g. 30s, 15m, 1h, 1h30m, 2d)")
+    return timedelta(microseconds=sum(int(number) * _DURATION_UNITS[unit] for number, unit in parts))
+
+
+def format_duration(duration: timedelta) -> str:
+    """Inverse of ``parse_duration`` for whole seconds, e.g. ``timedelta(minutes=90)`` -> ``1h30m``."""
+    seconds = int(duration.total_seconds())
+    parts = []
+    for unit, size in (("d", 86_400), ("h", 3_600), ("m", 60), ("s", 1)):
+        if seconds >= size:
+            parts.append(f"{seconds // size}{unit}")
+            seconds %= size
+    return "".join(parts) or "0s"
+
+
+@dataclass(frozen=True)
+class WindowSpec:
+    """Windows of ``size`` starting every ``slide`` (``None``: every ``size``, i.e. tumbling)."""
+
+    size: timedelta
+    slide: Optional[timedelta] = None
+
+    def __post_init__(self) -> None:
+        if self.size <= timedelta(0):
+            raise ValueError("window size must be positive")
+        if self.slide is not None and not timedelta(0) < self.slide <= self.size:
+            raise ValueError("window slide must be positive and no longer than the window")
+
+    @property
+    def kind(self) -> str:
+        return "tumbling" if self.slide in (None, self.size) else "hopping"
+
+    @property
+    def label(self) -> str:
+        if self.kind == "tumbling":
+            return format_duration(self.size)
+        return f"{format_duration(self.size)} every {format_duration(self.slide)}"
+
+
+@dataclass
+class WindowSummary:
+    station_id: str
+    start: datetime
+    end: datetime
+    count: int
+    total_rain_mm: float
+    max_rainfall_mm: float
+    avg_temp_c: float
+    min_temp_c: float
+    max_temp_c: float
+
+    @property
+    def intensity_mm_per_hr(self) -> float:
+        return self.total_rain_mm / ((self.end - self.start).total_seconds() / 3600.0)
+
+
+@dataclass
+class WindowPeak:
+    """Wettest ``window``-long span of a station, ending at the reading ``end``."""
+
+    station_id: str
+    window: timedelta
+    start: datetime
+    end: datetime
+    total_rain_mm: float
+
+    @property
+    def intensity_mm_per_hr(self) -> float:
+        return self.total_rain_mm / (self.window.total_seconds() / 3600.0)
+
+
+class _PaneWindows:
+    # Tumbling/hopping windows of one station. Pane ``p`` covers
+    # [p * pane_us, (p + 1) * pane_us); windows start every ``every`` panes
+    # and the one ending at pane ``e`` covers panes [e - panes, e).
+
+    __slots__ = (
+        "station_id",
+        "pane_us",
+        "panes",
+        "every",
+        "out",
+        "pane",
+        "count",
+        "rain",
+        "temp",
+        "max_rain",
+        "min_temp",
+        "max_temp",
+        "ring",
+        "ring_count",
+        "ring_rain",
+        "ring_temp",
+        "evicted",
+        "max_rain_q",
+        "min_temp_q",
+        "max_temp_q",
+    )
+
+    def __init__(self, station_id: str, spec: WindowSpec, out: List[WindowSummary]) -> None:
+        size_us = spec.size // timedelta(microseconds=1)
+        slide_us = size_us if spec.slide is None else spec.slide // timedelta(microseconds=1)
+        self.station_id = station_id
+        self.pane_us = math.gcd(size_us, slide_us)
+        self.panes = size_us // self.pane_us
+        self.every = slide_us // self.pane_us
+        self.out = out
+        self.pane: Optional[int] = None
+        self.count = 0
+        self.rain = 0.0
+        self.temp = 0.0
+        self.max_rain = -math.inf
+        self.min_temp = math.inf
+        self.max_temp = -math.inf
+        # Closed, non-empty panes still inside the newest window: (pane, count, rain, temp sum).
+        self.ring: Deque[Tuple[int, int, float, float]] = deque()
+        self.ring_count = 0
+        self.ring_rain = 0.0
+        self.ring_temp = 0.0
+        self.evicted = 0
+        # (pane, value) with values decreasing (maxima) or increasing (minimum) front to back.
+        self.max_rain_q: Deque[Tuple[int, float]] = deque()
+        self.min_temp_q: Deque[Tuple[int, float]] = deque()
+        self.max_temp_q: Deque[Tuple[int, float]] = deque()
+
+    def add(self, epoch_us: int, temperature_c: float, rainfall_mm: float) -> None:
+        pane = epoch_us // self.pane_us
+        if pane != self.pane:
+            self._advance(pane)
+        self.count += 1
+        self.rain += rainfall_mm
+        self.temp += temperature_c
+        if rainfall_mm > self.max_rain:
+            self.max_rain = rainfall_mm
+        if temperature_c < self.min_temp:
+            self.min_temp = temperature_c
+        if temperature_c > self.max_temp:
+            self.max_temp = temperature_c
+
+    def close(self) -> None:
+        """Emit every window that still holds readings."""
+        if self.pane is not None:
+            self._advance(None)
+
+    def _advance(self, pane: Optional[int]) -> None:
+        current = self.pane
+        if current is not None:
+            self._push(current)
+            # Windows ending after current + panes hold none of the closed panes.
+            last = current + self.panes if pane is None else min(pane, current + self.panes)
+            # Windows start every ``every`` panes; find the first one ending after ``current``.
+            every = self.every
+            end = ((current - self.panes) // every + 1) * every + self.panes
+            while end <= last:
+                self._emit(end)
+                end += every
+        self.pane = pane
+        self.count = 0
+        self.rain = 0.0
+        self.temp = 0.0
+        self.max_rain = -math.inf
+        self.min_temp = math.inf
+        self.max_temp = -math.inf
+
+    def _push(self, pane: int) -> None:
+        self.ring.append((pane, self.count, self.rain, self.temp))
+        self.ring_count += self.count
+        self.ring_rain += self.rain
+        self.ring_temp += self.temp
+        queue = self.max_rain_q
+        while queue and queue[-1][1] <= self.max_rain:
+            queue.pop()
+        queue.append((pane, self.max_rain))
+        queue = self.max_temp_q
+        while queue and queue[-1][1] <= self.max_temp:
+            queue.pop()
+        queue.append((pane, self.max_temp))
+        queue = self.min_temp_q
+        while queue and queue[-1][1] >= self.min_temp:
+            queue.pop()
+        queue.append((pane, self.min_temp))
+
+    def _emit(self, end: int) -> None:
+        first = end - self.panes
+        ring = self.ring
+        while ring[0][0] < first:
+            _, count, rain, temp = ring.popleft()
+            self.ring_count -= count
+            self.ring_rain -= rain
+            self.ring_temp -= temp
+            self.evicted += 1
+        if self.evicted >= len(ring):
+            # Re-add the sums now and then so subtraction errors cannot build
+            # up; this costs one pass per window's worth of evictions.
+            self.ring_rain = math.fsum(entry[2] for entry in ring)
+            self.ring_temp = math.fsum(entry[3] for entry in ring)
+            self.evicted = 0
+        for queue in (self.max_rain_q, self.min_temp_q, self.max_temp_q):
+            while queue[0][0] < first:
+                queue.popleft()
+        count = self.ring_count
+        self.out.append(
+            WindowSummary(
+                station_id=self.station_id,
+                start=from_epoch_us(first * self.pane_us),
+                end=from_epoch_us(end * self.pane_us),
+                count=count,
+                total_rain_mm=self.ring_rain,
+                max_rainfall_mm=self.max_rain_q[0][1],
+                avg_temp_c=self.ring_temp / count,
+                min_temp_c=self.min_temp_q[0][1],
+                max_temp_c=self.max_temp_q[0][1],
+            )
+        )
+
+
+class RollingSum:
+    """
+    Sum of the values added over the last ``size``, i.e. over ``(ts - size, ts]``.
+
+    Values must be added in timestamp order. Each ``add`` is O(1) amortized
+    and returns the new sum.
+    """
+
+    __slots__ = ("size_us", "buffer", "total", "evicted")
+
+    def __init__(self, size: timedelta) -> None:
+        if size <= timedelta(0):
+            raise ValueError("rolling window size must be positive")
+        self.size_us = size // timedelta(microseconds=1)
+        # (epoch_us, value) of the non-zero values inside the window.
+        self.buffer: Deque[Tuple[int, float]] = deque()
+        self.total = 0.0
+        self.evicted = 0
+
+    def add(self, epoch_us: int, value: float) -> float:
+        buffer = self.buffer
+        horizon = epoch_us - self.size_us
+        while buffer and buffer[0][0] <= horizon:
+            self.total -= buffer.popleft()[1]
+            self.evicted += 1
+        if value:
+            buffer.append((epoch_us, value))
+            self.total += value
+        if self.evicted and self.evicted >= len(buffer):
+            # Re-add now and then so subtraction errors cannot build up.
+            self.total = math.fsum(item[1] for item in buffer)
+            self.evicted = 0
+        return self.total
+
+
+class _SlidingPeak(RollingSum):
+    # Rainfall over (ts - size, ts] at every reading, keeping the maximum.
+
+    __slots__ = ("peak", "peak_end_us")
+
+    def __init__(self, spec: WindowSpec) -> None:
+        super().__init__(spec.size)
+        self.peak = 0.0
+        self.peak_end_us: Optional[int] = None
+
+    def add(self, epoch_us: int, rainfall_mm: float) -> float:
+        total = RollingSum.add(self, epoch_us, rainfall_mm)
+        if total > self.peak or self.peak_end_us is None:
+            self.peak = total
+            self.peak_end_us = epoch_us
+        return total
+
+
+class WindowAggregator:
+    """
+    Window summaries and rolling peaks for every ``WindowSpec``, per station.
+
+    ``update`` expects every station's readings in timestamp order. Closed
+    windows are collected until ``drain()``; ``flush()`` also closes the
+    windows still open at the end of the feed.
+    """
+
+    def __init__(self, specs: Iterable[WindowSpec]) -> None:
+        self.specs = tuple(specs)
+        if not self.specs:
+            raise ValueError("at least one window spec is required")
+        self.late_readings = 0
+        self._stations: Dict[str, List[Tuple[_PaneWindows, _SlidingPeak]]] = {}
+        self._last_us: Dict[str, int] = {}
+        self._closed: List[WindowSummary] = []
+
+    def update(self, station_id: str, ts: datetime, temperature_c: float, rainfall_mm: float) -> None:
+        epoch_us = to_epoch_us(ts)
+        states = self._stations.get(station_id)
+        if states is None:
+            states = self._stations[station_id] = [
+                (_PaneWindows(station_id, spec, self._closed), _SlidingPeak(spec)) for spec in self.specs
+            ]
+        elif epoch_us < self._last_us[station_id]:
+            self.late_readings += 1
+            return
+        self._last_us[station_id] = epoch_us
+        for panes, peak in states:
+            panes.add(epoch_us, temperature_c, rainfall_mm)
+            peak.add(epoch_us, rainfall_mm)
+
+    def drain(self) -> List[WindowSummary]:
+        """Return and forget the windows closed since the last call."""
+        # The station states append to this very list, so empty it in place.
+        closed = self._closed[:]
+        self._closed.clear()
+        return closed
+
+    def flush(self) -> List[WindowSummary]:
+        """Close every open window and return all undrained summaries."""
+        for states in self._stations.values():
+            for panes, _ in states:
+                panes.close()
+        return self.drain()
+
+    def peaks(self) -> List[WindowPeak]:
+        """Wettest span of every window size per station, ordered by station and size."""
+        peaks = []
+        for station_id, states in sorted(self._stations.items()):
+            for spec, (_, peak) in zip(self.specs, states):
+                end = from_epoch_us(peak.peak_end_us)
+                peaks.append(WindowPeak(station_id, spec.size, end - spec.size, end, peak.peak))
+        return sorted(peaks, key=lambda p: (p.station_id, p.window))